@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import resource
+import time
+
+import numpy as np
+import torch
+
+from deepquestpy.parallel import is_out_of_memory_error, run_sharded
+
+logger = logging.getLogger(__name__)
+
+
+def get_thread_counts(num_cores):
+    """1, 2, 4, ... threads, up to the number of cores."""
+    return sorted({2 ** i for i in range(num_cores.bit_length()) if 2 ** i <= num_cores} | {num_cores})
+
+
+def make_measure_function(engine, pairs, batch_size):
+    """
+    Returns a shard function for `run_sharded` that predicts the pairs `[start, end)` by batches of `batch_size` and
+    returns the latency (in seconds) of the model on each batch, and the peak resident memory of the worker (in KB).
+    The batches are encoded beforehand, and the first one is run once before the measures.
+    """
+
+    def measure_shard(start, end):
+        batches = [engine.encode(pairs[i : min(i + batch_size, end)]) for i in range(start, end, batch_size)]
+        engine.forward(batches[0])
+        latencies = []
+        for batch in batches:
+            batch_start = time.perf_counter()
+            engine.forward(batch)
+            latencies.append(time.perf_counter() - batch_start)
+        return latencies, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return measure_shard
+
+
+def measure_configuration(engine, pairs, batch_size, num_workers, threads_per_worker):
+    """Measures the throughput, p95 batch latency and peak memory of one configuration on CPU."""
+    measure_shard = make_measure_function(engine, pairs, batch_size)
+    results = run_sharded(measure_shard, len(pairs), num_workers, threads_per_worker)
+    latencies = np.concatenate([shard_latencies for shard_latencies, _ in results])
+    # the workers run concurrently, so the slowest one gives the throughput
+    model_seconds = max(sum(shard_latencies) for shard_latencies, _ in results)
+    return {
+        "pairs_per_second": len(pairs) / model_seconds,
+        "p95_latency_ms": float(np.percentile(latencies, 95) * 1000),
+        # an upper bound: the pages of the weights shared by the workers are counted for each of them
+        "peak_memory_mb": sum(peak_kb for _, peak_kb in results) / 1024,
+    }
+
+
+def autotune(engine, pairs, batch_sizes, worker_counts, thread_counts=None, max_latency_ms=None, max_memory_mb=None):
+    """
+    Sweeps the batch sizes, numbers of worker processes and torch threads per worker (using at most all the cores)
+    on a sample of pairs, and returns the fastest configuration within the latency and memory limits, and the
+    measures of all of them. A batch size that runs out of memory ends the sweep of the larger ones.
+
+    The engine must be on CPU and must not have run the model yet, as the measures run in forked workers.
+    """
+    num_cores = os.cpu_count() or 1
+    thread_counts = thread_counts or get_thread_counts(num_cores)
+    results = []
+    for num_workers in sorted(worker_counts):
+        for threads_per_worker in sorted(thread_counts):
+            if num_workers * threads_per_worker > num_cores:
+                continue
+            for batch_size in sorted(batch_sizes):
+                if batch_size * num_workers > len(pairs):
+                    break
+                result = {
+                    "batch_size": batch_size,
+                    "num_workers": num_workers,
+                    "threads_per_worker": threads_per_worker,
+                }
+                try:
+                    result.update(measure_configuration(engine, pairs, batch_size, num_workers, threads_per_worker))
+                except (MemoryError, RuntimeError) as e:
+                    if not is_out_of_memory_error(e):
+                        raise
+                    result["error"] = "out of memory"
+                logger.info(json.dumps(result))
+                results.append(result)
+                if "error" in result:
+                    break
+
+    candidates = [
+        result
+        for result in results
+        if "error" not in result
+        and (max_latency_ms is None or result["p95_latency_ms"] <= max_latency_ms)
+        and (max_memory_mb is None or result["peak_memory_mb"] <= max_memory_mb)
+    ]
+    if not candidates:
+        raise ValueError("No configuration is within the latency and memory limits")
+    return max(candidates, key=lambda result: result["pairs_per_second"]), results
+
+
+def save_inference_profile(path, best, results, **metadata):
+    profile = {**metadata, "num_cores": os.cpu_count(), **best, "sweep": results}
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+
+
+def apply_inference_profile(path, inference_args):
+    """
+    Sets the `num_workers` and `threads_per_worker` of the prediction arguments from a profile written by
+    `deepquestpy autotune`, and returns its batch size.
+    """
+    with open(path) as f:
+        profile = json.load(f)
+    missing = [key for key in ["batch_size", "num_workers", "threads_per_worker"] if key not in profile]
+    if missing:
+        raise ValueError(f"The inference profile {path} has no {', '.join(missing)}")
+    num_cores = profile.get("num_cores")
+    if num_cores != os.cpu_count():
+        logger.warning(f"The inference profile {path} was tuned on {num_cores} cores, not {os.cpu_count()}")
+    inference_args.num_workers = profile["num_workers"]
+    inference_args.threads_per_worker = profile["threads_per_worker"]
+    if inference_args.num_workers == 1:
+        # a single process predicts in the main process
+        torch.set_num_threads(profile["threads_per_worker"])
+    return profile["batch_size"]
@@ -0,0 +1,96 @@
+import logging
+import sys
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from transformers import HfArgumentParser
+
+from deepquestpy.autotune import autotune, save_inference_profile
+from deepquestpy.data.line_index import ParallelLineIndex
+from deepquestpy.inference import get_inference_engine, is_birnn_arch
+
+logger = logging.getLogger(__name__)
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(",")] if value else None
+
+
+@dataclass
+class AutotuneArguments:
+    """
+    Arguments pertaining to the checkpoint, the sample of input and the configurations swept on CPU.
+    """
+
+    model_name_or_path: str = field(
+        metadata={"help": "Checkpoint of a transformer model, or `model.tar.gz` archive of a BiRNN model."}
+    )
+    src_file: str = field(metadata={"help": "Source segments of the real input, one per line."})
+    mt_file: str = field(metadata={"help": "Translations of the source segments, one per line."})
+    arch_name: str = field(
+        default="transformer-sent", metadata={"help": "Architecture of the model, or birnn-sent for a BiRNN archive."}
+    )
+    src_lang: str = field(default="src", metadata={"help": "Source language id (transformer models)."})
+    tgt_lang: str = field(default="tgt", metadata={"help": "Target language id (transformer models)."})
+    output_file: str = field(
+        default="inference_profile.json",
+        metadata={"help": "Where to write the profile, to be given as --inference_profile."},
+    )
+    num_samples: int = field(default=512, metadata={"help": "Number of pairs sampled from the input."})
+    seed: int = field(default=42, metadata={"help": "Seed of the sampling of the pairs."})
+    batch_sizes: str = field(default="1,4,8,16,32,64", metadata={"help": "Comma-separated batch sizes to try."})
+    worker_counts: str = field(default="1,2,4", metadata={"help": "Comma-separated numbers of workers to try."})
+    thread_counts: Optional[str] = field(
+        default=None, metadata={"help": "Comma-separated numbers of threads per worker. Defaults to 1, 2, 4, ..."}
+    )
+    max_latency_ms: Optional[float] = field(default=None, metadata={"help": "Maximum p95 latency of a batch."})
+    max_memory_mb: Optional[float] = field(default=None, metadata={"help": "Maximum peak memory of all the workers."})
+
+
+def main(args=None):
+    parser = HfArgumentParser(AutotuneArguments)
+    (autotune_args,) = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+
+    index = ParallelLineIndex({"src": autotune_args.src_file, "mt": autotune_args.mt_file})
+    pairs = [(record["src"], record["mt"]) for record in index.sample(autotune_args.num_samples, autotune_args.seed)]
+    engine_kwargs = {}
+    if not is_birnn_arch(autotune_args.arch_name):
+        engine_kwargs = {"src_lang": autotune_args.src_lang, "tgt_lang": autotune_args.tgt_lang}
+    engine = get_inference_engine(
+        autotune_args.model_name_or_path, autotune_args.arch_name, device="cpu", **engine_kwargs
+    )
+
+    best, results = autotune(
+        engine,
+        pairs,
+        parse_int_list(autotune_args.batch_sizes),
+        parse_int_list(autotune_args.worker_counts),
+        thread_counts=parse_int_list(autotune_args.thread_counts),
+        max_latency_ms=autotune_args.max_latency_ms,
+        max_memory_mb=autotune_args.max_memory_mb,
+    )
+    save_inference_profile(
+        autotune_args.output_file,
+        best,
+        results,
+        model_name_or_path=autotune_args.model_name_or_path,
+        arch_name=autotune_args.arch_name,
+    )
+    logger.info(
+        f"Best configuration: batches of {best['batch_size']}, {best['num_workers']} workers with "
+        f"{best['threads_per_worker']} threads ({best['pairs_per_second']:.1f} pairs/s, "
+        f"p95 latency {best['p95_latency_ms']:.1f} ms, {best['peak_memory_mb']:.0f} MB)"
+    )
+    logger.info(f"Inference profile written to {autotune_args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
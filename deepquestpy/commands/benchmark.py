@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import sys
+import time
+
+from dataclasses import dataclass, field
+
+from datasets import Dataset
+from transformers import HfArgumentParser, Trainer, TrainingArguments
+
+from deepquestpy.commands.cli_args import DataArguments, ModelArguments
+from deepquestpy.data.line_index import ParallelLineIndex
+from deepquestpy.inference import InferenceEngine
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BenchmarkArguments:
+    """
+    Arguments pertaining to the pairs used to compare the inference engine with the `Trainer`.
+    """
+
+    src_file: str = field(metadata={"help": "Source segments, one per line."})
+    mt_file: str = field(metadata={"help": "Translations of the source segments, one per line."})
+    num_pairs: int = field(default=1000, metadata={"help": "Number of pairs predicted by each run."})
+    call_sizes: str = field(
+        default="1,8,64", metadata={"help": "Comma-separated numbers of pairs per call, to measure their overhead."}
+    )
+    repeats: int = field(default=3, metadata={"help": "Number of runs of each measure, the fastest is kept."})
+
+
+def time_calls(predict_function, pairs, call_size, repeats):
+    """Returns the fastest time (in seconds) to predict the pairs with calls of `call_size` pairs."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for call_start in range(0, len(pairs), call_size):
+            predict_function(pairs[call_start : call_start + call_size])
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_trainer_predict_function(engine, training_args):
+    """The path used by `run_transformer.py`: a `Trainer` predicting an Arrow dataset built for each call."""
+    deepquest_model = engine.deepquest_model
+    trainer = Trainer(model=engine.model, args=training_args, tokenizer=deepquest_model.get_tokenizer())
+    src_lang, tgt_lang = deepquest_model.data_args.src_lang, deepquest_model.data_args.tgt_lang
+
+    def predict(pairs):
+        columns = {"translation": [{src_lang: src, tgt_lang: tgt} for src, tgt in pairs]}
+        if hasattr(deepquest_model, "label_list"):
+            columns[deepquest_model.data_args.label_column_name_tgt] = [[] for _ in pairs]
+        dataset = deepquest_model.tokenize_datasets(Dataset.from_dict(columns))
+        deepquest_model.set_evaluation_dataset_for_metrics(dataset)
+        predictions, labels, _ = trainer.predict(dataset)
+        return deepquest_model.postprocess_predictions(predictions, labels)
+
+    return predict
+
+
+def main(args=None):
+    parser = HfArgumentParser((ModelArguments, DataArguments, TrainingArguments, BenchmarkArguments))
+    model_args, data_args, training_args, benchmark_args = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+
+    index = ParallelLineIndex({"src": benchmark_args.src_file, "mt": benchmark_args.mt_file})
+    pairs = [(record["src"], record["mt"]) for record in index.get_range(0, benchmark_args.num_pairs)]
+
+    engine = InferenceEngine(
+        model_args.model_name_or_path,
+        model_args.arch_name,
+        src_lang=data_args.src_lang,
+        tgt_lang=data_args.tgt_lang,
+        batch_size=training_args.per_device_eval_batch_size,
+        fp16=training_args.fp16,
+        labels_in_gaps=data_args.labels_in_gaps,
+    )
+    trainer_predict = make_trainer_predict_function(engine, training_args)
+
+    results = []
+    for call_size in [int(size) for size in benchmark_args.call_sizes.split(",")]:
+        result = {"pairs_per_call": call_size}
+        for name, predict_function in [("trainer", trainer_predict), ("engine", engine.predict)]:
+            seconds = time_calls(predict_function, pairs, call_size, benchmark_args.repeats)
+            num_calls = (len(pairs) + call_size - 1) // call_size
+            result[name] = {
+                "seconds": seconds,
+                "pairs_per_second": len(pairs) / seconds,
+                "milliseconds_per_call": 1000 * seconds / num_calls,
+            }
+        result["speedup"] = result["trainer"]["seconds"] / result["engine"]["seconds"]
+        logger.info(
+            f"{call_size} pairs per call: {result['trainer']['milliseconds_per_call']:.1f} ms with the Trainer, "
+            f"{result['engine']['milliseconds_per_call']:.1f} ms with the engine ({result['speedup']:.2f}x)"
+        )
+        results.append(result)
+
+    os.makedirs(training_args.output_dir, exist_ok=True)
+    with open(os.path.join(training_args.output_dir, "inference_benchmark.json"), "w") as writer:
+        json.dump(results, writer, indent=2)
+
+
+if __name__ == "__main__":
+    main()
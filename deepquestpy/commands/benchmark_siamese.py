@@ -0,0 +1,124 @@
+import json
+import logging
+import sys
+import time
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+from transformers import HfArgumentParser
+
+from deepquestpy.data.line_index import ParallelLineIndex
+from deepquestpy.inference import get_inference_engine
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SiameseBenchmarkArguments:
+    """
+    Arguments pertaining to the comparison of a siamese sentence-level model with a cross-encoder.
+    """
+
+    cross_encoder: str = field(metadata={"help": "Checkpoint (or BiRNN archive) of the cross-encoder model."})
+    siamese_model: str = field(metadata={"help": "Checkpoint of a transformer-siamese-sent model."})
+    src_file: str = field(
+        metadata={
+            "help": "Source segments, one per line. The cache of the siamese model benefits from sources repeated "
+            "on nearby lines (n-best lists, several systems)."
+        }
+    )
+    mt_file: str = field(metadata={"help": "Translations of the source segments, one per line."})
+    score_file: Optional[str] = field(default=None, metadata={"help": "Gold scores, one per line."})
+    cross_encoder_arch: str = field(
+        default="transformer-sent",
+        metadata={"help": "Architecture of the cross-encoder, or birnn-sent for a BiRNN model."},
+    )
+    num_pairs: int = field(default=1000, metadata={"help": "Number of pairs predicted, in the order of the files."})
+    batch_size: int = field(default=32, metadata={"help": "Number of pairs per batch."})
+    src_lang: str = field(default="src", metadata={"help": "Source language id."})
+    tgt_lang: str = field(default="tgt", metadata={"help": "Target language id."})
+    output_file: Optional[str] = field(default=None, metadata={"help": "Where to write the results as JSON."})
+
+
+def time_predictions(engine, pairs):
+    """Returns the predictions of the pairs and the time (in seconds) taken to predict them."""
+    start = time.perf_counter()
+    predictions = engine.predict(pairs)
+    return np.asarray(predictions, dtype=float), time.perf_counter() - start
+
+
+def pearson(x, y):
+    return float(np.corrcoef(x, y)[0, 1])
+
+
+def main(args=None):
+    parser = HfArgumentParser(SiameseBenchmarkArguments)
+    (benchmark_args,) = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+
+    index = ParallelLineIndex(
+        {"src": benchmark_args.src_file, "mt": benchmark_args.mt_file, "score": benchmark_args.score_file}
+    )
+    records = index.get_range(0, benchmark_args.num_pairs)
+    pairs = [(record["src"], record["mt"]) for record in records]
+    gold_scores = [float(record["score"]) for record in records] if benchmark_args.score_file else None
+    cross_encoder = get_inference_engine(
+        benchmark_args.cross_encoder,
+        benchmark_args.cross_encoder_arch,
+        batch_size=benchmark_args.batch_size,
+        src_lang=benchmark_args.src_lang,
+        tgt_lang=benchmark_args.tgt_lang,
+    )
+    siamese = get_inference_engine(
+        benchmark_args.siamese_model,
+        "transformer-siamese-sent",
+        batch_size=benchmark_args.batch_size,
+        src_lang=benchmark_args.src_lang,
+        tgt_lang=benchmark_args.tgt_lang,
+    )
+    source_cache_size = siamese.model.source_cache.max_size if siamese.model.source_cache is not None else 0
+
+    # warms up both models on a batch, then starts the siamese model with an empty cache
+    cross_encoder.predict(pairs[: benchmark_args.batch_size])
+    siamese.predict(pairs[: benchmark_args.batch_size])
+
+    results = {"pairs": len(pairs), "distinct_sources": len(set(src for src, _ in pairs))}
+    variants = {"cross_encoder": time_predictions(cross_encoder, pairs)}
+    siamese.model.set_source_cache_size(0)
+    variants["siamese_no_cache"] = time_predictions(siamese, pairs)
+    siamese.model.set_source_cache_size(source_cache_size)
+    variants["siamese"] = time_predictions(siamese, pairs)
+    cache = siamese.model.source_cache
+
+    cross_encoder_seconds = variants["cross_encoder"][1]
+    for name, (predictions, seconds) in variants.items():
+        result = {
+            "seconds": seconds,
+            "pairs_per_second": len(pairs) / seconds,
+            "speedup": cross_encoder_seconds / seconds,
+        }
+        if gold_scores is not None:
+            result["pearson"] = pearson(predictions, gold_scores)
+        if name != "cross_encoder":
+            result["pearson_with_cross_encoder"] = pearson(predictions, variants["cross_encoder"][0])
+        results[name] = result
+        logger.info(f"{name}: {json.dumps(result)}")
+    if cache is not None:
+        results["siamese"]["cache_hit_rate"] = cache.hits / max(cache.hits + cache.misses, 1)
+        logger.info(f"Source cache hit rate: {results['siamese']['cache_hit_rate']:.1%}")
+
+    if benchmark_args.output_file:
+        with open(benchmark_args.output_file, "w") as writer:
+            json.dump(results, writer, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import glob
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+from dataclasses import dataclass, field
+
+from datasets import Dataset, IterableDataset
+from transformers import HfArgumentParser, Trainer, TrainingArguments
+
+from deepquestpy.commands.cli_args import DataArguments, ModelArguments
+from deepquestpy.commands.utils import get_deepquest_model, get_label_list, load_raw_datasets, truncate_dataset
+from deepquestpy.metrics.accumulators import compute_accumulated_metrics
+from deepquestpy.models.base import DeepQuestModelWord
+from deepquestpy.parallel import add_out_of_memory_backoff
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+
+@dataclass
+class BulkArguments:
+    """
+    Arguments pertaining to how the bulk prediction job is split.
+    """
+
+    chunk_size: int = field(
+        default=100000, metadata={"help": "Number of examples predicted and committed to disk at a time."},
+    )
+    split: str = field(default="test", metadata={"help": "The split of the dataset to predict."})
+
+
+def _write_json_atomically(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as writer:
+        json.dump(content, writer, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(output_dir, job):
+    """Returns the manifest of a job, checking that it was started with the same settings."""
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {"job": job, "completed": [], "num_chunks": None, "metric_states": {}}
+    with open(manifest_path) as reader:
+        manifest = json.load(reader)
+    if manifest["job"] != job:
+        raise ValueError(
+            f"The job in {output_dir} was started with different settings ({manifest['job']}). "
+            "Use another --output_dir or --overwrite_output_dir to start over."
+        )
+    return manifest
+
+
+def iter_chunks(dataset, chunk_size):
+    """
+    Yields `(chunk_id, get_chunk)` for each chunk of a dataset, where `get_chunk()` returns the examples of the chunk.
+    Streamed datasets are read only once: the examples of the chunks that are not requested are skipped.
+    """
+    if not isinstance(dataset, IterableDataset):
+        for chunk_id, start in enumerate(range(0, len(dataset), chunk_size)):
+            end = min(start + chunk_size, len(dataset))
+            yield chunk_id, lambda start=start, end=end: dataset.select(range(start, end))
+        return
+
+    examples = iter(dataset)
+    for chunk_id in itertools.count():
+        chunk = list(itertools.islice(examples, chunk_size))
+        if not chunk:
+            return
+        yield chunk_id, lambda chunk=chunk: Dataset.from_dict(
+            {name: [example[name] for example in chunk] for name in chunk[0]}
+        )
+
+
+def concatenate_outputs(output_dir, chunks_dir, num_chunks):
+    """Concatenates the prediction files of the chunks, in order, into `<output_dir>/predict.*`."""
+    file_names = sorted(os.path.basename(path) for path in glob.glob(os.path.join(chunks_dir, "00000000", "*")))
+    for file_name in file_names:
+        tmp_path = os.path.join(output_dir, f"{file_name}.tmp")
+        with open(tmp_path, "wb") as writer:
+            for chunk_id in range(num_chunks):
+                with open(os.path.join(chunks_dir, f"{chunk_id:08d}", file_name), "rb") as reader:
+                    shutil.copyfileobj(reader, writer)
+        os.replace(tmp_path, os.path.join(output_dir, file_name))
+    return file_names
+
+
+def main(args=None):
+    parser = HfArgumentParser((ModelArguments, DataArguments, TrainingArguments, BulkArguments))
+    model_args, data_args, training_args, bulk_args = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+
+    output_dir = training_args.output_dir
+    if training_args.overwrite_output_dir and os.path.exists(os.path.join(output_dir, MANIFEST_NAME)):
+        shutil.rmtree(output_dir)
+    chunks_dir = os.path.join(output_dir, "chunks")
+    os.makedirs(chunks_dir, exist_ok=True)
+
+    # the settings that determine the content of the chunks
+    job = {
+        "model_name_or_path": model_args.model_name_or_path,
+        "arch_name": model_args.arch_name,
+        "dataset_name": data_args.dataset_name,
+        "test_file": data_args.test_file,
+        "src_lang": data_args.src_lang,
+        "tgt_lang": data_args.tgt_lang,
+        "split": bulk_args.split,
+        "max_predict_samples": data_args.max_predict_samples,
+        "chunk_size": bulk_args.chunk_size,
+    }
+    manifest = load_manifest(output_dir, job)
+    completed = set(manifest["completed"])
+
+    raw_datasets = load_raw_datasets(data_args)
+    if bulk_args.split not in raw_datasets:
+        raise ValueError(f"The dataset does not have a {bulk_args.split} split")
+    dataset = raw_datasets[bulk_args.split]
+    if data_args.max_predict_samples is not None:
+        dataset = truncate_dataset(dataset, data_args.max_predict_samples)
+    num_chunks = None
+    if not isinstance(dataset, IterableDataset):
+        num_chunks = (len(dataset) + bulk_args.chunk_size - 1) // bulk_args.chunk_size
+    if completed:
+        logger.info(f"Resuming the job: {len(completed)} chunks were already completed")
+
+    deepquest_model = get_deepquest_model(model_args.arch_name, model_args, data_args, training_args)
+    if isinstance(deepquest_model, DeepQuestModelWord):
+        deepquest_model.set_label_list(get_label_list(raw_datasets, data_args.label_column_name_tgt))
+    model = deepquest_model.get_model()
+    if training_args.n_gpu <= 1:
+        # a batch that does not fit in memory is split instead of failing the job (not with DataParallel replicas)
+        add_out_of_memory_backoff(model)
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        tokenizer=deepquest_model.get_tokenizer(),
+        data_collator=deepquest_model.get_data_collator(),
+    )
+    # the metrics are accumulated chunk by chunk, and their state is committed with the chunks
+    accumulators = deepquest_model.get_metric_accumulators()
+    for prefix, state in manifest.get("metric_states", {}).items():
+        accumulators[prefix].load_state(state)
+
+    start_time = time.perf_counter()
+    num_predicted = 0
+    last_chunk_id = -1
+    for chunk_id, get_chunk in iter_chunks(dataset, bulk_args.chunk_size):
+        last_chunk_id = chunk_id
+        if chunk_id in completed:
+            continue
+        chunk = deepquest_model.tokenize_datasets(get_chunk())
+        deepquest_model.set_evaluation_dataset_for_metrics(chunk)
+        predictions, labels, _ = trainer.predict(chunk)
+        predictions = deepquest_model.postprocess_predictions(predictions, labels)
+        if labels is not None:
+            deepquest_model.update_metric_accumulators(accumulators, predictions, labels)
+
+        # write the chunk to a temporary folder that is renamed once complete, so a chunk is either there or not
+        chunk_dir = os.path.join(chunks_dir, f"{chunk_id:08d}")
+        tmp_dir = f"{chunk_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        deepquest_model.save_output(output_file_path=os.path.join(tmp_dir, "predict"), predictions=predictions)
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        os.replace(tmp_dir, chunk_dir)
+        completed.add(chunk_id)
+        manifest["completed"] = sorted(completed)
+        manifest["metric_states"] = {prefix: acc.get_state().tolist() for prefix, acc in accumulators.items()}
+        _write_json_atomically(os.path.join(output_dir, MANIFEST_NAME), manifest)
+
+        num_predicted += len(chunk)
+        speed = num_predicted / (time.perf_counter() - start_time)
+        progress = f"{len(completed)}/{num_chunks}" if num_chunks is not None else f"{len(completed)}"
+        logger.info(f"Completed chunk {chunk_id} ({progress} chunks, {speed:.1f} examples/s)")
+
+    num_chunks = last_chunk_id + 1
+    manifest["num_chunks"] = num_chunks
+    _write_json_atomically(os.path.join(output_dir, MANIFEST_NAME), manifest)
+    if sorted(completed) != list(range(num_chunks)):
+        raise ValueError(f"Some chunks are missing from {chunks_dir}, the job needs to be run again")
+    file_names = concatenate_outputs(output_dir, chunks_dir, num_chunks)
+    logger.info(f"Wrote {', '.join(os.path.join(output_dir, name) for name in file_names)}")
+
+    metrics = compute_accumulated_metrics(accumulators)
+    if metrics:
+        trainer.log_metrics("predict", metrics)
+        trainer.save_metrics("predict", metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import sys
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+from datasets import Dataset
+from transformers import HfArgumentParser, Trainer, TrainingArguments
+
+from deepquestpy.commands.cli_args import DataArguments, ModelArguments
+from deepquestpy.commands.utils import get_deepquest_model
+from deepquestpy.data.line_index import ParallelLineIndex
+
+logger = logging.getLogger(__name__)
+
+SUBCOMMANDS = ["predict", "calibrate"]
+CALIBRATION_FILE_NAME = "cascade_calibration.json"
+
+
+@dataclass
+class CascadeArguments:
+    """
+    Arguments pertaining to the BiRNN prefilter and to which segments are routed to the transformer.
+    """
+
+    birnn_model: str = field(metadata={"help": "Path to the model.tar.gz of a trained sentence-level BiRNN."})
+    src_file: str = field(metadata={"help": "Source segments, one per line."})
+    mt_file: str = field(metadata={"help": "Translations of the source segments, one per line."})
+    band_low: Optional[float] = field(
+        default=None, metadata={"help": "Segments with a BiRNN score in [band_low, band_high] go to the transformer."},
+    )
+    band_high: Optional[float] = field(default=None, metadata={"help": "See `band_low`."})
+    budget: Optional[float] = field(
+        default=None,
+        metadata={
+            "help": "Maximum fraction of the segments scored by the transformer: the ones with a BiRNN score closest "
+            "to the centre of the band (or to the median score if there is no band)."
+        },
+    )
+    calibration_file: Optional[str] = field(
+        default=None, metadata={"help": "Read the band from the output of `deepquestpy cascade calibrate`."},
+    )
+    target_agreement: float = field(
+        default=0.95,
+        metadata={"help": "For calibrate only. Minimum Pearson correlation with the transformer-only scores."},
+    )
+    num_band_edges: int = field(
+        default=100, metadata={"help": "For calibrate only. Number of BiRNN score quantiles tried as band edges."},
+    )
+    birnn_batch_size: int = field(default=64, metadata={"help": "Batch size of the BiRNN."})
+
+
+class CascadeScorer:
+    """Scores segment pairs with a sentence-level BiRNN and with a `TransformerDeepQuestModelSent`."""
+
+    def __init__(self, model_args, data_args, training_args, cascade_args):
+        # register the AllenNLP components of the BiRNN before loading the archive
+        import deepquestpy.data.birnn_sent_reader  # noqa: F401
+        import deepquestpy.models.birnn  # noqa: F401
+        from deepquestpy.models.mmap_weights import load_model_archive
+        from deepquestpy.rerank import NBestReranker
+
+        archive = load_model_archive(cascade_args.birnn_model)
+        self.birnn = NBestReranker(archive.model, archive.dataset_reader, batch_size=cascade_args.birnn_batch_size)
+
+        self.data_args = data_args
+        self.deepquest_model = get_deepquest_model(model_args.arch_name, model_args, data_args, training_args)
+        self.trainer = Trainer(
+            model=self.deepquest_model.get_model(),
+            args=training_args,
+            tokenizer=self.deepquest_model.get_tokenizer(),
+            data_collator=self.deepquest_model.get_data_collator(),
+        )
+
+    def score_birnn(self, sources, targets):
+        return self.birnn.score_pairs(sources, targets)
+
+    def score_transformer(self, sources, targets):
+        if not sources:
+            return np.zeros(0)
+        src_lang, tgt_lang = self.data_args.src_lang, self.data_args.tgt_lang
+        dataset = Dataset.from_dict(
+            {"translation": [{src_lang: src, tgt_lang: tgt} for src, tgt in zip(sources, targets)]}
+        )
+        predictions = self.trainer.predict(self.deepquest_model.tokenize_datasets(dataset)).predictions
+        return self.deepquest_model.postprocess_predictions(predictions)["predictions"]
+
+
+def select_segments(birnn_scores, band_low=None, band_high=None, budget=None):
+    """Returns a boolean mask of the segments to score with the transformer."""
+    selected = np.ones(len(birnn_scores), dtype=bool)
+    if band_low is not None:
+        selected &= birnn_scores >= band_low
+    if band_high is not None:
+        selected &= birnn_scores <= band_high
+    if budget is not None:
+        max_selected = int(budget * len(birnn_scores))
+        if selected.sum() > max_selected:
+            if band_low is not None and band_high is not None:
+                centre = (band_low + band_high) / 2
+            else:
+                centre = np.median(birnn_scores)
+            distance = np.where(selected, np.abs(birnn_scores - centre), np.inf)
+            selected = np.zeros(len(birnn_scores), dtype=bool)
+            selected[np.argsort(distance, kind="stable")[:max_selected]] = True
+    return selected
+
+
+def calibrate_band(birnn_scores, transformer_scores, target_agreement, num_band_edges=100):
+    """
+    Finds the band `[low, high]` of BiRNN scores that sends the fewest segments to the transformer while keeping the
+    Pearson correlation between the cascade scores and the transformer-only scores above `target_agreement`.
+
+    The segments are sorted by BiRNN score, so that each band is a contiguous range `[i, j)` of the sorted segments.
+    The sums needed by the correlation of every candidate band are then computed at once from prefix sums.
+    """
+    order = np.argsort(birnn_scores, kind="stable")
+    b = np.asarray(birnn_scores, dtype=np.float64)[order]
+    t = np.asarray(transformer_scores, dtype=np.float64)[order]
+    n = len(b)
+
+    def prefix(values):
+        return np.concatenate([[0.0], np.cumsum(values)])
+
+    prefix_b, prefix_bb, prefix_bt = prefix(b), prefix(b * b), prefix(b * t)
+    prefix_t, prefix_tt = prefix(t), prefix(t * t)
+
+    edges = np.unique(np.linspace(0, n, num_band_edges + 1).astype(int))
+    start, end = np.meshgrid(edges, edges, indexing="ij")
+    valid = end >= start
+    start, end = start[valid], end[valid]
+
+    def band_sum(prefix_values):
+        return prefix_values[end] - prefix_values[start]
+
+    # cascade scores: transformer inside the band, BiRNN outside
+    sum_m = prefix_b[n] - band_sum(prefix_b) + band_sum(prefix_t)
+    sum_mm = prefix_bb[n] - band_sum(prefix_bb) + band_sum(prefix_tt)
+    sum_mt = prefix_bt[n] - band_sum(prefix_bt) + band_sum(prefix_tt)
+    covariance = sum_mt - sum_m * prefix_t[n] / n
+    variance_m = sum_mm - sum_m ** 2 / n
+    variance_t = prefix_tt[n] - prefix_t[n] ** 2 / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        agreement = np.nan_to_num(covariance / np.sqrt(variance_m * variance_t), nan=-1.0)
+
+    routed = end - start
+    candidates = np.flatnonzero(agreement >= target_agreement)
+    if len(candidates) == 0:
+        raise ValueError(f"No band reaches a Pearson correlation of {target_agreement} with the transformer scores")
+    best = candidates[np.lexsort((-agreement[candidates], routed[candidates]))[0]]
+    i, j = start[best], end[best]
+    return {
+        "band_low": float(b[i]) if j > i else None,
+        "band_high": float(b[j - 1]) if j > i else None,
+        "routed_fraction": float(routed[best] / n),
+        "agreement": float(agreement[best]),
+    }
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    if not args or args[0] not in SUBCOMMANDS:
+        print(f"usage: deepquestpy cascade {{{','.join(SUBCOMMANDS)}}} [args]")
+        sys.exit(1)
+    subcommand, args = args[0], args[1:]
+
+    parser = HfArgumentParser((ModelArguments, DataArguments, TrainingArguments, CascadeArguments))
+    model_args, data_args, training_args, cascade_args = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+    os.makedirs(training_args.output_dir, exist_ok=True)
+
+    records = ParallelLineIndex({"src": cascade_args.src_file, "mt": cascade_args.mt_file}).get_range(0, sys.maxsize)
+    sources = [record["src"] for record in records]
+    targets = [record["mt"] for record in records]
+    scorer = CascadeScorer(model_args, data_args, training_args, cascade_args)
+    birnn_scores = scorer.score_birnn(sources, targets)
+
+    if subcommand == "calibrate":
+        transformer_scores = scorer.score_transformer(sources, targets)
+        calibration = calibrate_band(
+            birnn_scores, transformer_scores, cascade_args.target_agreement, cascade_args.num_band_edges
+        )
+        with open(os.path.join(training_args.output_dir, CALIBRATION_FILE_NAME), "w") as writer:
+            json.dump(calibration, writer, indent=2)
+        logger.info(f"Calibrated band: {calibration}")
+        return
+
+    band_low, band_high = cascade_args.band_low, cascade_args.band_high
+    if cascade_args.calibration_file is not None:
+        with open(cascade_args.calibration_file) as reader:
+            calibration = json.load(reader)
+        band_low, band_high = calibration["band_low"], calibration["band_high"]
+        if band_low is None:  # the BiRNN alone is good enough
+            band_low, band_high = np.inf, -np.inf
+    if band_low is None and band_high is None and cascade_args.budget is None:
+        raise ValueError("Specify a band (--band_low/--band_high), a --budget or a --calibration_file")
+
+    selected = select_segments(birnn_scores, band_low, band_high, cascade_args.budget)
+    selected_idx = np.flatnonzero(selected)
+    scores = birnn_scores.astype(np.float64)
+    scores[selected_idx] = scorer.score_transformer(
+        [sources[i] for i in selected_idx], [targets[i] for i in selected_idx]
+    )
+    logger.info(f"Scored {len(selected_idx)} of {len(scores)} segments with the transformer")
+
+    with open(os.path.join(training_args.output_dir, "predict.preds"), "w") as writer:
+        for score, from_transformer in zip(scores, selected):
+            writer.write(f"{score:3.3f}\t{'transformer' if from_transformer else 'birnn'}\n")
+
+
+if __name__ == "__main__":
+    main()
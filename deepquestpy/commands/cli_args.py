@@ -26,6 +26,20 @@ class DataArguments:
     test_file: Optional[str] = field(
         default=None, metadata={"help": "An optional input test data file to predict on (a csv file)."},
     )
+    streaming: bool = field(
+        default=False,
+        metadata={
+            "help": "Whether to stream the dataset instead of preparing it on disk first. "
+            "Training on a streamed dataset requires setting `max_steps`."
+        },
+    )
+    tokenized_cache_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Folder where the tokenized datasets are cached under a hash of their contents and preprocessing "
+            "arguments, so they can be reused across runs and machines (see `deepquestpy preprocess`)."
+        },
+    )
     overwrite_cache: bool = field(default=False, metadata={"help": "Overwrite the cached training and evaluation sets"})
     preprocessing_num_workers: Optional[int] = field(
         default=None, metadata={"help": "The number of processes to use for the preprocessing."},
@@ -59,6 +73,10 @@ class DataArguments:
             "value if set."
         },
     )
+    label_column_name: str = field(
+        default="hter",
+        metadata={"help": "For sentence-level only. The name of the column in the dataset that contains the scores."},
+    )
     label_column_name_src: str = field(
         default="src_tags",
         metadata={"help": "The name of the column in the dataset that contains the word-level labels for the source."},
@@ -81,6 +99,13 @@ class DataArguments:
     labels_in_gaps: bool = field(
         default=False, metadata={"help": "For word-level only. Whether to use labels for gaps in the target sentence."},
     )
+    project_source_tags: bool = field(
+        default=False,
+        metadata={
+            "help": "For word-level only. Derive the source tags predictions from the target ones through the "
+            "`alignments` column of the dataset: a source word is BAD if it is aligned to a BAD target word."
+        },
+    )
     max_train_samples: Optional[int] = field(
         default=None,
         metadata={
@@ -102,6 +127,16 @@ class DataArguments:
             "value if set."
         },
     )
+    bootstrap_resamples: int = field(
+        default=0,
+        metadata={
+            "help": "For sentence-level only. Number of bootstrap resamples used to compute confidence intervals of "
+            "the evaluation metrics (0 to disable)."
+        },
+    )
+    confidence_level: float = field(
+        default=0.95, metadata={"help": "For sentence-level only. Confidence level of the bootstrap intervals."},
+    )
 
 
 @dataclass
@@ -127,3 +162,108 @@ class ModelArguments:
         default="main",
         metadata={"help": "The specific model version to use (can be a branch name, tag name or commit id)."},
     )
+    train_adapter: bool = field(
+        default=False,
+        metadata={
+            "help": "Freeze the pretrained encoder and only train a bottleneck adapter and the prediction head. "
+            "Only the weights of the adapter are saved, so one encoder can be shared by several language pairs."
+        },
+    )
+    adapter_size: int = field(default=64, metadata={"help": "Hidden size of the bottleneck adapters."})
+    adapter_name: Optional[str] = field(
+        default=None,
+        metadata={"help": "Name of the adapter to train or use for prediction. Defaults to `<src_lang>-<tgt_lang>`."},
+    )
+    adapter_paths: Optional[str] = field(
+        default=None,
+        metadata={"help": "Comma-separated list of folders with trained adapters to load on top of the encoder."},
+    )
+    teacher_model_name_or_path: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Path to a trained QE model of the same architecture to distill into the model being trained. "
+            "The predictions of the teacher are computed once and stored in `teacher_store_dir`."
+        },
+    )
+    teacher_store_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Folder for the memory-mapped predictions of the teacher. Defaults to <output_dir>/teacher_store."
+        },
+    )
+    distillation_alpha: float = field(
+        default=0.5,
+        metadata={"help": "Weight of the teacher targets in the loss (the gold labels get `1 - distillation_alpha`)."},
+    )
+    distillation_temperature: float = field(
+        default=1.0, metadata={"help": "For word-level only. Temperature used to soften the tags of the teacher."},
+    )
+    exit_layers: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "For transformer-sent-early-exit only. Comma-separated list of the layers with an exit head. "
+            "Defaults to every fourth layer."
+        },
+    )
+    early_exit_training: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "For transformer-sent-early-exit only. How to train the exit heads: `joint` (on the gold scores) "
+            "or `self_distillation` (on the predictions of the last layer). Defaults to `joint`."
+        },
+    )
+    early_exit_threshold: Optional[float] = field(
+        default=None,
+        metadata={
+            "help": "For transformer-sent-early-exit only. An example leaves the model at the first exit whose "
+            "predicted absolute error is below this value. If not set, all the layers are used."
+        },
+    )
+    source_cache_size: int = field(
+        default=10000,
+        metadata={
+            "help": "For transformer-siamese-sent only. Number of source embeddings kept at inference, so that a "
+            "source scored with several translations is encoded once. 0 disables the cache."
+        },
+    )
+    frozen_layers: int = field(
+        default=0,
+        metadata={"help": "Number of bottom encoder layers (and the embeddings) kept frozen during training."},
+    )
+    feature_cache_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Folder where the hidden states of the `frozen_layers` bottom layers are stored (as float16) the "
+            "first time they are computed, so that training only runs the top layers."
+        },
+    )
+
+
+@dataclass
+class InferenceArguments:
+    """
+    Arguments pertaining to how the predictions are computed on CPU.
+    """
+
+    num_workers: int = field(
+        default=1,
+        metadata={
+            "help": "Number of worker processes that predict contiguous shards of the test set on CPU. "
+            "The model is loaded once and shared with the workers."
+        },
+    )
+    threads_per_worker: Optional[int] = field(
+        default=None,
+        metadata={"help": "Number of torch threads of each worker. Defaults to the number of cores / num_workers."},
+    )
+    benchmark_workers: bool = field(
+        default=False,
+        metadata={"help": "Report the prediction throughput with 1, 2, 4, ... and `num_workers` workers."},
+    )
+    inference_profile: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Profile written by `deepquestpy autotune`, which sets `per_device_eval_batch_size`, "
+            "`num_workers` and `threads_per_worker`."
+        },
+    )
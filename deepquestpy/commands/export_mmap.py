@@ -0,0 +1,136 @@
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from dataclasses import dataclass, field
+
+from transformers import HfArgumentParser
+
+from deepquestpy.inference import get_inference_engine, is_birnn_arch
+from deepquestpy.models.mmap_weights import save_mmap_archive, save_mmap_checkpoint
+
+logger = logging.getLogger(__name__)
+
+# predicted once by every worker, so that the weights the model uses are actually read
+SAMPLE_PAIRS = [("This is a test sentence.", "Ceci est une phrase de test.")]
+
+
+@dataclass
+class ExportArguments:
+    """
+    Arguments pertaining to the checkpoint exported with memory-mapped weights and to the measure of its loading.
+    """
+
+    model_name_or_path: str = field(
+        metadata={"help": "Checkpoint of a transformer model, or `model.tar.gz` archive of a BiRNN model."}
+    )
+    output_dir: str = field(metadata={"help": "Where to write the exported model."})
+    arch_name: str = field(
+        default="transformer-sent", metadata={"help": "Architecture of the model, or birnn-sent for a BiRNN archive."}
+    )
+    num_workers: int = field(
+        default=4,
+        metadata={"help": "Number of worker processes loading the model at the same time to measure their memory."},
+    )
+
+
+def read_memory_usage():
+    """Returns the resident, proportional (shared pages divided among their processes), shared and private memory."""
+    usage = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == "kB":
+                usage[fields[0].rstrip(":")] = int(fields[1]) / 1024
+    return {
+        "rss_mb": usage["Rss"],
+        "pss_mb": usage["Pss"],
+        "shared_mb": usage["Shared_Clean"] + usage["Shared_Dirty"],
+        "private_mb": usage["Private_Clean"] + usage["Private_Dirty"],
+    }
+
+
+def _measure_worker(load_model, barrier, results):
+    try:
+        start = time.perf_counter()
+        engine = load_model()
+        load_seconds = time.perf_counter() - start
+        engine.predict(SAMPLE_PAIRS)
+        # all the workers hold their model while they are measured
+        barrier.wait()
+        results.put({"load_seconds": load_seconds, **read_memory_usage()})
+        barrier.wait()
+    except BaseException as e:
+        barrier.abort()
+        results.put({"error": repr(e)})
+
+
+def measure_loading(load_model, num_workers):
+    """
+    Loads the model in `num_workers` forked processes at the same time, and returns the load time and the memory of
+    each of them once it has predicted a pair. The parent must not have run the model before.
+    """
+    context = multiprocessing.get_context("fork")
+    barrier, results = context.Barrier(num_workers), context.Queue()
+    workers = []
+    for _ in range(num_workers):
+        workers.append(context.Process(target=_measure_worker, args=(load_model, barrier, results)))
+        workers[-1].start()
+    measures = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    errors = [measure["error"] for measure in measures if "error" in measure]
+    if errors:
+        raise ValueError(f"Loading the model in a worker failed: {errors[0]}")
+    return measures
+
+
+def summarize_loading(load_model, num_workers):
+    summary = {"load_seconds": measure_loading(load_model, 1)[0]["load_seconds"]}
+    if num_workers > 0:
+        measures = measure_loading(load_model, num_workers)
+        summary["workers"] = num_workers
+        for name in ["load_seconds", "rss_mb", "pss_mb", "shared_mb", "private_mb"]:
+            summary[f"worker_{name}"] = sum(measure[name] for measure in measures) / num_workers
+        summary["total_pss_mb"] = sum(measure["pss_mb"] for measure in measures)
+    return summary
+
+
+def main(args=None):
+    parser = HfArgumentParser(ExportArguments)
+    (export_args,) = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+
+    if is_birnn_arch(export_args.arch_name):
+        from allennlp.common.util import import_module_and_submodules
+        from allennlp.models.archival import load_archive
+
+        import_module_and_submodules("deepquestpy")
+        save_mmap_archive(load_archive(export_args.model_name_or_path), export_args.output_dir)
+    else:
+        engine = get_inference_engine(export_args.model_name_or_path, export_args.arch_name, device="cpu")
+        save_mmap_checkpoint(engine.model, engine.deepquest_model.get_tokenizer(), export_args.output_dir)
+        del engine
+    logger.info(f"Model exported to {export_args.output_dir}")
+
+    report = {}
+    for name, path in [("original", export_args.model_name_or_path), ("mmap", export_args.output_dir)]:
+        report[name] = summarize_loading(
+            lambda path=path: get_inference_engine(path, export_args.arch_name, device="cpu"), export_args.num_workers
+        )
+        logger.info(f"{name}: {json.dumps(report[name])}")
+    with open(os.path.join(export_args.output_dir, "export_report.json"), "w") as writer:
+        json.dump(report, writer, indent=2)
+
+
+if __name__ == "__main__":
+    main()
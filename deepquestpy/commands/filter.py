@@ -0,0 +1,174 @@
+import logging
+import queue
+import sys
+import threading
+import time
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from transformers import HfArgumentParser
+
+from deepquestpy.inference import BiRNNInferenceEngine, batched, get_inference_engine
+from deepquestpy.models.base import DeepQuestModelSent
+
+logger = logging.getLogger(__name__)
+
+# marks the end of the stream in the queues between the stages of the pipeline
+_END = object()
+
+
+@dataclass
+class FilterArguments:
+    """
+    Arguments pertaining to the model that scores the `src<TAB>mt` lines read from stdin, and to the filtering.
+    """
+
+    model_name_or_path: str = field(
+        metadata={"help": "Checkpoint of a transformer model, or `model.tar.gz` archive of a BiRNN model."}
+    )
+    arch_name: str = field(
+        default="transformer-sent", metadata={"help": "Architecture of the model: transformer-sent or birnn-sent."}
+    )
+    src_lang: str = field(default="src", metadata={"help": "Source language id (transformer models)."})
+    tgt_lang: str = field(default="tgt", metadata={"help": "Target language id (transformer models)."})
+    min_score: Optional[float] = field(
+        default=None, metadata={"help": "Only write the lines scored at least `min_score` (e.g. for DA)."}
+    )
+    max_score: Optional[float] = field(
+        default=None, metadata={"help": "Only write the lines scored at most `max_score` (e.g. for HTER)."}
+    )
+    batch_size: int = field(default=32, metadata={"help": "Number of lines scored at a time."})
+    queue_size: int = field(default=4, metadata={"help": "Number of batches buffered between two stages."})
+    fp16: bool = field(default=False, metadata={"help": "Run the transformer models in half precision."})
+    report_every: float = field(default=10.0, metadata={"help": "Seconds between two throughput reports on stderr."})
+
+
+def get_scorer(filter_args):
+    engine = get_inference_engine(
+        filter_args.model_name_or_path,
+        filter_args.arch_name,
+        batch_size=filter_args.batch_size,
+        src_lang=filter_args.src_lang,
+        tgt_lang=filter_args.tgt_lang,
+        fp16=filter_args.fp16,
+    )
+    if not isinstance(engine, BiRNNInferenceEngine) and not isinstance(engine.deepquest_model, DeepQuestModelSent):
+        raise ValueError(f"Only sentence-level models can filter lines, not {filter_args.arch_name}")
+    return engine
+
+
+def parse_lines(lines, first_line_num):
+    """Splits `src<TAB>mt[<TAB>...]` lines into (source, translation) pairs."""
+    pairs = []
+    for line_num, line in enumerate(lines, start=first_line_num):
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 2:
+            raise ValueError(f"Line {line_num} is not in the `src<TAB>mt` format: {line!r}")
+        pairs.append((fields[0], fields[1]))
+    return pairs
+
+
+def _run_stage(function, input_queue, output_queue, errors):
+    """Applies `function` to the items of `input_queue` in order. Errors are recorded and end the stream."""
+    try:
+        while True:
+            item = input_queue.get()
+            if item is _END:
+                break
+            output_queue.put(function(item))
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        output_queue.put(_END)
+
+
+def _start_thread(target, *args):
+    # daemon threads, so that a failed stage cannot keep the process alive on a full queue
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def score_lines(lines, scorer, batch_size=32, queue_size=4):
+    """
+    Yields `(lines, scores)` for successive batches of the input lines, in their original order. Reading the input,
+    tokenizing, running the model and the consumer of the results run concurrently in separate threads, connected by
+    bounded queues, so that the model never waits on I/O or tokenization (both release the GIL).
+    """
+    errors = []
+    line_batches, encoded_batches, scored_batches = [queue.Queue(maxsize=queue_size) for _ in range(3)]
+
+    def read():
+        try:
+            line_num = 1
+            for batch_lines in batched(lines, batch_size):
+                line_batches.put((line_num, batch_lines))
+                line_num += len(batch_lines)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            line_batches.put(_END)
+
+    def encode(item):
+        line_num, batch_lines = item
+        return batch_lines, scorer.encode(parse_lines(batch_lines, line_num))
+
+    def forward(item):
+        batch_lines, batch = item
+        return batch_lines, scorer.forward(batch)
+
+    _start_thread(read)
+    _start_thread(_run_stage, encode, line_batches, encoded_batches, errors)
+    _start_thread(_run_stage, forward, encoded_batches, scored_batches, errors)
+    while True:
+        item = scored_batches.get()
+        if item is _END:
+            break
+        yield item
+    if errors:
+        raise errors[0]
+
+
+def main(args=None):
+    parser = HfArgumentParser(FilterArguments)
+    (filter_args,) = parser.parse_args_into_dataclasses(args=args)
+
+    # stdout carries the filtered lines
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stderr)],
+        level=logging.INFO,
+    )
+
+    scorer = get_scorer(filter_args)
+    filtering = filter_args.min_score is not None or filter_args.max_score is not None
+    num_lines = num_written = 0
+    start = last_report = time.perf_counter()
+    for batch_lines, scores in score_lines(sys.stdin, scorer, filter_args.batch_size, filter_args.queue_size):
+        output = []
+        for line, score in zip(batch_lines, scores):
+            if filter_args.min_score is not None and score < filter_args.min_score:
+                continue
+            if filter_args.max_score is not None and score > filter_args.max_score:
+                continue
+            line = line.rstrip("\n")
+            output.append(f"{line}\n" if filtering else f"{line}\t{score:.6f}\n")
+        sys.stdout.write("".join(output))
+        num_lines += len(batch_lines)
+        num_written += len(output)
+        now = time.perf_counter()
+        if now - last_report >= filter_args.report_every:
+            logger.info(f"{num_lines} lines scored, {num_lines / (now - start):.1f} lines/s")
+            last_report = now
+    sys.stdout.flush()
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"{num_lines} lines scored in {elapsed:.1f}s ({num_lines / max(elapsed, 1e-9):.1f} lines/s), "
+        f"{num_written} lines written"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import importlib
+import sys
+
+# maps command names to the modules that implement them
+COMMANDS = {
+    "autotune": "deepquestpy.commands.autotune",
+    "benchmark": "deepquestpy.commands.benchmark",
+    "benchmark_siamese": "deepquestpy.commands.benchmark_siamese",
+    "bulk_predict": "deepquestpy.commands.bulk_predict",
+    "cascade": "deepquestpy.commands.cascade",
+    "export_mmap": "deepquestpy.commands.export_mmap",
+    "filter": "deepquestpy.commands.filter",
+    "precompute_embeddings": "deepquestpy.commands.precompute_embeddings",
+    "preprocess": "deepquestpy.commands.preprocess",
+    "prune_layers": "deepquestpy.commands.prune_layers",
+    "tag_post_edits": "deepquestpy.commands.tag_post_edits",
+    "trim_vocab": "deepquestpy.commands.trim_vocab",
+}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(f"usage: deepquestpy {{{','.join(COMMANDS)}}} [args]")
+        sys.exit(1)
+    command = importlib.import_module(COMMANDS[sys.argv[1]])
+    command.main(sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
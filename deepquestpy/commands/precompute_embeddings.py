@@ -0,0 +1,118 @@
+import contextlib
+import itertools
+import logging
+import sys
+
+from dataclasses import dataclass, field
+
+import numpy as np
+import torch
+from transformers import HfArgumentParser
+
+from deepquestpy.data.array_store import RaggedArrayWriter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EmbeddingArguments:
+    """
+    Arguments pertaining to the BiRNN configuration whose embeddings are precomputed.
+    """
+
+    config_file: str = field(metadata={"help": "The AllenNLP configuration of the BiRNN (reader and embedders)."})
+    output_dir: str = field(metadata={"help": "Where to store the embeddings, to be set as `embedding_store_dir`."})
+    splits: str = field(default="train,dev,test", metadata={"help": "Comma-separated list of the splits to embed."})
+    batch_size: int = field(default=32, metadata={"help": "Number of instances embedded at a time."})
+
+
+@torch.no_grad()
+def precompute_split(reader, vocab, embedders, split, store_dir, batch_size, metadata=None):
+    """
+    Runs the frozen embedders of both sides over the instances of a split, in the order of the reader, and writes
+    the embeddings of each instance to a float16 store per side.
+    """
+    from allennlp.data import Batch
+    from allennlp.nn.util import get_text_field_mask, move_to_device
+
+    from deepquestpy.models.embedding_store import get_store_path
+
+    device = next(itertools.chain(*[embedder.parameters() for embedder in embedders.values()])).device
+    writers = {
+        side: RaggedArrayWriter(
+            get_store_path(store_dir, split, side),
+            np.float16,
+            row_shape=(embedder.get_output_dim(),),
+            metadata={**(metadata or {}), "split": split, "side": side},
+        )
+        for side, embedder in embedders.items()
+    }
+    instances = iter(reader.read(split))
+    num_instances = 0
+    with contextlib.ExitStack() as stack:
+        for writer in writers.values():
+            stack.enter_context(writer)
+        while True:
+            batch_instances = list(itertools.islice(instances, batch_size))
+            if not batch_instances:
+                break
+            batch = Batch(batch_instances)
+            batch.index_instances(vocab)
+            tensors = move_to_device(batch.as_tensor_dict(), device)
+            for side, embedder in embedders.items():
+                tokens = tensors[f"tokens_{side}"]
+                embedded = embedder(tokens).half().cpu().numpy()
+                lengths = get_text_field_mask(tokens).sum(dim=1).tolist()
+                for i, length in enumerate(lengths):
+                    writers[side].append(embedded[i, :length])
+            num_instances += len(batch_instances)
+    return num_instances
+
+
+def main(args=None):
+    parser = HfArgumentParser(EmbeddingArguments)
+    (embedding_args,) = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+
+    # register the AllenNLP components of the BiRNN before reading the configuration
+    import deepquestpy.data.birnn_reader  # noqa: F401
+    import deepquestpy.data.birnn_sent_reader  # noqa: F401
+    from allennlp.common import Params
+    from allennlp.data import DatasetReader, Vocabulary
+    from allennlp.modules import TextFieldEmbedder
+
+    params = Params.from_file(embedding_args.config_file)
+    reader_params = params["dataset_reader"].duplicate()
+    reader_params["with_instance_metadata"] = False
+    reader = DatasetReader.from_params(reader_params)
+    # the embedders are pretrained transformers, whose indexers do not need a vocabulary built from the data
+    vocab = Vocabulary()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    embedders = {}
+    for side in ["src", "tgt"]:
+        embedder_params = params["model"][f"text_field_embedder_{side}"].duplicate()
+        embedder = TextFieldEmbedder.from_params(embedder_params, vocab=vocab)
+        embedders[side] = embedder.to(device).eval()
+
+    for split in embedding_args.splits.split(","):
+        split = split.strip()
+        num_instances = precompute_split(
+            reader,
+            vocab,
+            embedders,
+            split,
+            embedding_args.output_dir,
+            embedding_args.batch_size,
+            metadata={"config_file": embedding_args.config_file},
+        )
+        logger.info(f"Stored the embeddings of the {num_instances} instances of {split}")
+
+
+if __name__ == "__main__":
+    main()
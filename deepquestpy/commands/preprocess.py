@@ -0,0 +1,66 @@
+import logging
+import sys
+
+from dataclasses import dataclass, field
+
+from transformers import HfArgumentParser
+
+from deepquestpy.commands.cli_args import DataArguments, ModelArguments
+from deepquestpy.commands.utils import get_deepquest_model, get_label_list, load_raw_datasets, truncate_dataset
+from deepquestpy.models.base import DeepQuestModelWord
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PreprocessArguments:
+    """
+    Arguments pertaining to which splits to tokenize.
+    """
+
+    splits: str = field(
+        default="train,validation,test", metadata={"help": "Comma-separated list of the splits to tokenize."},
+    )
+
+
+def main(args=None):
+    parser = HfArgumentParser((ModelArguments, DataArguments, PreprocessArguments))
+    model_args, data_args, preprocess_args = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+
+    if data_args.tokenized_cache_dir is None:
+        raise ValueError("--tokenized_cache_dir is required to store the tokenized datasets")
+    if data_args.streaming:
+        raise ValueError("Streamed datasets are tokenized on the fly and cannot be preprocessed in advance")
+
+    raw_datasets = load_raw_datasets(data_args)
+    deepquest_model = get_deepquest_model(model_args.arch_name, model_args, data_args, None)
+    if isinstance(deepquest_model, DeepQuestModelWord):
+        deepquest_model.set_label_list(get_label_list(raw_datasets, data_args.label_column_name_tgt))
+
+    # Use the same limits as the training and prediction runs, so that their cache entries match
+    max_samples = {
+        "train": data_args.max_train_samples,
+        "validation": data_args.max_eval_samples,
+        "test": data_args.max_predict_samples,
+    }
+    for split in preprocess_args.splits.split(","):
+        split = split.strip()
+        if split not in raw_datasets:
+            raise ValueError(f"The dataset does not have a {split} split")
+        dataset = raw_datasets[split]
+        if max_samples.get(split) is not None:
+            dataset = truncate_dataset(dataset, max_samples[split])
+        tokenized_dataset = deepquest_model.tokenize_datasets(dataset)
+        cache_files = [cache_file["filename"] for cache_file in tokenized_dataset.cache_files]
+        logger.info(f"Tokenized {split} split ({len(tokenized_dataset)} examples): {', '.join(cache_files)}")
+
+
+if __name__ == "__main__":
+    main()
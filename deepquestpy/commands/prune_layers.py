@@ -0,0 +1,202 @@
+import copy
+import json
+import logging
+import os
+import sys
+import time
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+import torch
+from transformers import HfArgumentParser, Trainer, TrainingArguments
+from transformers.trainer_utils import set_seed
+
+from deepquestpy.commands.cli_args import DataArguments, ModelArguments
+from deepquestpy.commands.utils import get_deepquest_model, get_label_list, load_raw_datasets, truncate_dataset
+from deepquestpy.models.base import DeepQuestModelWord
+from deepquestpy.models.pruning import get_model_size, prune_top_layers
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PruneArguments:
+    """
+    Arguments pertaining to which variants of the model to export and how to compare them.
+    """
+
+    layers_to_drop: str = field(
+        default="2,4,6,8",
+        metadata={
+            "help": "Comma-separated numbers of top encoder layers to remove, one variant per number. "
+            "The unpruned model is always evaluated as the reference."
+        },
+    )
+    recovery_steps: int = field(
+        default=0, metadata={"help": "Number of fine-tuning steps on the train split after removing the layers."},
+    )
+    latency_samples: int = field(
+        default=200, metadata={"help": "Number of validation examples used to measure the latency on CPU."},
+    )
+    latency_batch_size: int = field(default=1, metadata={"help": "Batch size used to measure the latency."})
+    quality_metric: Optional[str] = field(
+        default=None,
+        metadata={"help": "Metric used to choose a variant. Defaults to pearson (sentence) or tgt_mcc (word)."},
+    )
+    min_quality: Optional[float] = field(
+        default=None, metadata={"help": "Minimum value of `quality_metric` that the chosen variant must reach."},
+    )
+
+
+def measure_latency(model, tokenizer, dataset, batch_size, num_samples):
+    """Returns the average time (in milliseconds) to predict one example on CPU."""
+    model = model.to("cpu")
+    model.eval()
+    input_names = [name for name in tokenizer.model_input_names if name in dataset.column_names]
+    dataset = dataset.select(range(min(num_samples, len(dataset))))
+    batches = []
+    for start in range(0, len(dataset), batch_size):
+        batch = dataset[start : start + batch_size]
+        batches.append(tokenizer.pad({name: batch[name] for name in input_names}, return_tensors="pt"))
+    with torch.no_grad():
+        model(**batches[0])  # warm-up
+        start = time.perf_counter()
+        for inputs in batches:
+            model(**inputs)
+        elapsed = time.perf_counter() - start
+    return 1000 * elapsed / len(dataset)
+
+
+def format_report(results, metric_names):
+    header = ["layers", "params (M)", "size (MB)", "latency (ms)", "speedup"] + metric_names
+    rows = [header]
+    for result in results:
+        row = [
+            str(result["num_layers"]),
+            f"{result['num_params'] / 1e6:.1f}",
+            f"{result['size_mb']:.1f}",
+            f"{result['latency_ms']:.2f}",
+            f"{result['speedup']:.2f}x",
+        ]
+        row += [f"{result['metrics'].get(name, float('nan')):.4f}" for name in metric_names]
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join("  ".join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def main(args=None):
+    parser = HfArgumentParser((ModelArguments, DataArguments, TrainingArguments, PruneArguments))
+    model_args, data_args, training_args, prune_args = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+    set_seed(training_args.seed)
+
+    if data_args.streaming:
+        raise ValueError("The variants are evaluated on a prepared validation split, so --streaming is not supported")
+
+    raw_datasets = load_raw_datasets(data_args)
+    deepquest_model = get_deepquest_model(model_args.arch_name, model_args, data_args, training_args)
+    word_level = isinstance(deepquest_model, DeepQuestModelWord)
+    if word_level:
+        deepquest_model.set_label_list(get_label_list(raw_datasets, data_args.label_column_name_tgt))
+
+    if "validation" not in raw_datasets:
+        raise ValueError("Evaluating the pruned models requires a validation dataset")
+    eval_dataset = raw_datasets["validation"]
+    if data_args.max_eval_samples is not None:
+        eval_dataset = truncate_dataset(eval_dataset, data_args.max_eval_samples)
+    eval_dataset = deepquest_model.tokenize_datasets(eval_dataset)
+
+    train_dataset = None
+    if prune_args.recovery_steps > 0:
+        if "train" not in raw_datasets:
+            raise ValueError("--recovery_steps requires a train dataset")
+        train_dataset = raw_datasets["train"]
+        if data_args.max_train_samples is not None:
+            train_dataset = truncate_dataset(train_dataset, data_args.max_train_samples)
+        train_dataset = deepquest_model.tokenize_datasets(train_dataset)
+
+    tokenizer = deepquest_model.get_tokenizer()
+    reference_model = deepquest_model.get_model()
+    num_layers = reference_model.config.num_hidden_layers
+    layers_to_drop = sorted({int(n) for n in prune_args.layers_to_drop.split(",") if n.strip()} - {0})
+
+    results = []
+    for num_dropped in [0] + layers_to_drop:
+        if num_dropped == 0:
+            model = reference_model
+        else:
+            model = prune_top_layers(copy.deepcopy(reference_model), num_dropped)
+        variant_args = copy.deepcopy(training_args)
+        variant_args.output_dir = os.path.join(training_args.output_dir, f"layers-{num_layers - num_dropped}")
+        variant_args.max_steps = prune_args.recovery_steps
+        trainer = Trainer(
+            model=model,
+            args=variant_args,
+            train_dataset=train_dataset,
+            eval_dataset=eval_dataset,
+            tokenizer=tokenizer,
+            data_collator=deepquest_model.get_data_collator(),
+            compute_metrics=deepquest_model.compute_metrics,
+        )
+        if num_dropped > 0:
+            if prune_args.recovery_steps > 0:
+                logger.info(f"Fine-tuning the model without its top {num_dropped} layers")
+                trainer.train()
+            trainer.save_model()
+
+        deepquest_model.set_evaluation_dataset_for_metrics(eval_dataset)
+        metrics = trainer.evaluate()
+        num_params, num_bytes = get_model_size(trainer.model)
+        latency_ms = measure_latency(
+            trainer.model, tokenizer, eval_dataset, prune_args.latency_batch_size, prune_args.latency_samples
+        )
+        results.append(
+            {
+                "num_layers": num_layers - num_dropped,
+                "path": variant_args.output_dir if num_dropped > 0 else model_args.model_name_or_path,
+                "num_params": num_params,
+                "size_mb": num_bytes / 2 ** 20,
+                "latency_ms": latency_ms,
+                "speedup": results[0]["latency_ms"] / latency_ms if results else 1.0,
+                "metrics": {
+                    name[len("eval_") :]: value
+                    for name, value in metrics.items()
+                    if name.startswith("eval_") and not name.endswith(("runtime", "per_second"))
+                },
+            }
+        )
+
+    metric_names = sorted({name for result in results for name in result["metrics"]})
+    print(format_report(results, metric_names))
+    report = {"results": results}
+
+    if prune_args.min_quality is not None:
+        quality_metric = prune_args.quality_metric
+        if quality_metric is None:
+            quality_metric = "tgt_mcc" if word_level else "pearson"
+        candidates = [
+            result
+            for result in results
+            if result["metrics"].get(quality_metric, float("-inf")) >= prune_args.min_quality
+        ]
+        if candidates:
+            chosen = min(candidates, key=lambda result: result["latency_ms"])
+            report["chosen"] = chosen["path"]
+            print(f"Fastest model with {quality_metric} >= {prune_args.min_quality}: {chosen['path']}")
+        else:
+            print(f"No model reaches {quality_metric} >= {prune_args.min_quality}")
+
+    os.makedirs(training_args.output_dir, exist_ok=True)
+    with open(os.path.join(training_args.output_dir, "prune_report.json"), "w") as writer:
+        json.dump(report, writer, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from transformers import HfArgumentParser
+
+from deepquestpy.data.line_index import ParallelLineIndex
+from deepquestpy.data.tagging import tag_triple
+
+logger = logging.getLogger(__name__)
+
+# index of the input files, set by the parent right before forking the workers
+_index = None
+
+
+@dataclass
+class TaggingArguments:
+    """
+    Arguments pertaining to the post-edited data to tag and where to write the tags.
+    """
+
+    src_file: str = field(metadata={"help": "Source sentences, one per line, tokenized with whitespaces."})
+    mt_file: str = field(metadata={"help": "Translations of the source sentences, one per line."})
+    pe_file: str = field(metadata={"help": "Post-editions of the translations, one per line."})
+    output_dir: str = field(
+        metadata={"help": "Where to write <split>/<split>.{src,mt,tags,source_tags,hter} for wmt20_mlqe_synth."}
+    )
+    alignments_file: Optional[str] = field(
+        default=None,
+        metadata={"help": "Source-MT word alignments (`i-j` pairs), one line per sentence. Needed for source tags."},
+    )
+    split: str = field(default="train", metadata={"help": "Name of the split to write."})
+    num_workers: int = field(default=os.cpu_count() or 1, metadata={"help": "Number of tagging processes."})
+    block_size: int = field(default=10000, metadata={"help": "Number of sentences sent to a worker at a time."})
+
+
+def _tag_block(bounds):
+    start, end = bounds
+    tags, source_tags, hters = [], [], []
+    for record in _index.get_range(start, end):
+        src_tags, mt_tags, hter = tag_triple(record["src"], record["mt"], record["pe"], record["alignments"])
+        tags.append(" ".join(mt_tags) + "\n")
+        source_tags.append(" ".join(src_tags) + "\n" if src_tags is not None else None)
+        hters.append(f"{hter:.6f}\n")
+    return tags, source_tags, hters
+
+
+def tag_files(args):
+    """Tags the sentences in blocks of `block_size`, in parallel, and writes the tags in the order of the input."""
+    global _index
+    split_dir = os.path.join(args.output_dir, args.split)
+    os.makedirs(split_dir, exist_ok=True)
+    prefix = os.path.join(split_dir, args.split)
+
+    index = ParallelLineIndex(
+        {"src": args.src_file, "mt": args.mt_file, "pe": args.pe_file, "alignments": args.alignments_file}
+    )
+    blocks = [(start, min(start + args.block_size, len(index))) for start in range(0, len(index), args.block_size)]
+    extensions = ["tags", "source_tags", "hter"] if args.alignments_file is not None else ["tags", "hter"]
+    writers = {ext: open(f"{prefix}.{ext}.tmp", "w", encoding="utf-8") for ext in extensions}
+
+    start_time = time.perf_counter()
+    num_tagged = 0
+    _index = index
+    try:
+        context = multiprocessing.get_context("fork")
+        with context.Pool(args.num_workers) as pool:
+            for tags, source_tags, hters in pool.imap(_tag_block, blocks):
+                writers["tags"].writelines(tags)
+                writers["hter"].writelines(hters)
+                if "source_tags" in writers:
+                    writers["source_tags"].writelines(source_tags)
+                num_tagged += len(tags)
+                speed = num_tagged / (time.perf_counter() - start_time)
+                logger.info(f"Tagged {num_tagged}/{len(index)} sentences ({speed:.0f} sentences/s)")
+    finally:
+        _index = None
+        for writer in writers.values():
+            writer.close()
+
+    for ext in extensions:
+        os.replace(f"{prefix}.{ext}.tmp", f"{prefix}.{ext}")
+    for ext, path in [("src", args.src_file), ("mt", args.mt_file)]:
+        if os.path.abspath(path) != os.path.abspath(f"{prefix}.{ext}"):
+            shutil.copyfile(path, f"{prefix}.{ext}")
+    return num_tagged
+
+
+def main(args=None):
+    parser = HfArgumentParser(TaggingArguments)
+    (tagging_args,) = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+
+    num_tagged = tag_files(tagging_args)
+    split_dir = os.path.join(tagging_args.output_dir, tagging_args.split)
+    logger.info(f"Wrote the tags of {num_tagged} sentences to {split_dir}")
+
+
+if __name__ == "__main__":
+    main()
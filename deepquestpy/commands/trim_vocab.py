@@ -0,0 +1,179 @@
+import copy
+import json
+import logging
+import os
+import sys
+import time
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+from transformers import HfArgumentParser, Trainer, TrainingArguments
+
+from deepquestpy.commands.cli_args import DataArguments, ModelArguments
+from deepquestpy.commands.utils import get_deepquest_model, get_label_list, load_raw_datasets, truncate_dataset
+from deepquestpy.models.base import DeepQuestModelWord
+from deepquestpy.models.pruning import get_model_size
+from deepquestpy.models.vocab_trimming import collect_token_ids, save_trimmed_tokenizer, trim_embeddings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TrimArguments:
+    """
+    Arguments pertaining to the corpora that define the kept vocabulary and to the check of the trimmed model.
+    """
+
+    corpus_files: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Comma-separated text files of the expected input, one segment per line (or `src<TAB>mt` "
+            "lines), scanned in addition to the splits of the dataset."
+        },
+    )
+    heldout_split: str = field(
+        default="test",
+        metadata={"help": "Split not scanned, on which the predictions of both models are compared."},
+    )
+
+
+def load_model(model_args, data_args, training_args, raw_datasets):
+    """Returns the DeepQuestModel and the pretrained model of a checkpoint, and the time taken to load them."""
+    start = time.perf_counter()
+    deepquest_model = get_deepquest_model(model_args.arch_name, model_args, data_args, training_args)
+    if isinstance(deepquest_model, DeepQuestModelWord):
+        deepquest_model.set_label_list(get_label_list(raw_datasets, data_args.label_column_name_tgt))
+    deepquest_model.get_tokenizer()
+    model = deepquest_model.get_model()
+    return deepquest_model, model, time.perf_counter() - start
+
+
+def iter_texts(datasets, src_lang, tgt_lang, corpus_files):
+    for dataset in datasets:
+        for translation in dataset["translation"]:
+            yield translation[src_lang]
+            yield translation[tgt_lang]
+    for path in corpus_files:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                yield from line.rstrip("\n").split("\t")
+
+
+def predict(deepquest_model, model, dataset, training_args):
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        tokenizer=deepquest_model.get_tokenizer(),
+        data_collator=deepquest_model.get_data_collator(),
+    )
+    deepquest_model.set_evaluation_dataset_for_metrics(dataset)
+    predictions, labels, _ = trainer.predict(dataset)
+    return deepquest_model.postprocess_predictions(predictions, labels)
+
+
+def compare_predictions(reference, trimmed):
+    """Returns the number of examples whose predictions differ, and the largest difference between two scores."""
+    num_different, max_difference = 0, 0.0
+    for name, reference_values in reference.items():
+        if np.ndim(reference_values) == 0:
+            # summaries such as the average exit layer of early-exit models
+            continue
+        different = np.zeros(len(reference_values), dtype=bool)
+        for i, (reference_value, trimmed_value) in enumerate(zip(reference_values, trimmed[name])):
+            reference_value, trimmed_value = np.asarray(reference_value), np.asarray(trimmed_value)
+            if reference_value.shape != trimmed_value.shape:
+                different[i] = True
+            elif not np.array_equal(reference_value, trimmed_value):
+                different[i] = True
+                max_difference = max(max_difference, float(np.abs(reference_value - trimmed_value).max()))
+        num_different = max(num_different, int(different.sum()))
+    return num_different, max_difference
+
+
+def main(args=None):
+    parser = HfArgumentParser((ModelArguments, DataArguments, TrainingArguments, TrimArguments))
+    model_args, data_args, training_args, trim_args = parser.parse_args_into_dataclasses(args=args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+
+    if data_args.streaming:
+        raise ValueError("The splits are scanned and compared as prepared datasets, so --streaming is not supported")
+
+    raw_datasets = load_raw_datasets(data_args)
+    deepquest_model, model, startup_seconds = load_model(model_args, data_args, training_args, raw_datasets)
+    tokenizer = deepquest_model.get_tokenizer()
+
+    scanned_splits = [split for split in raw_datasets if split != trim_args.heldout_split]
+    corpus_files = [path for path in (trim_args.corpus_files or "").split(",") if path]
+    logger.info(f"Scanning the {', '.join(scanned_splits)} splits and {len(corpus_files)} corpus files")
+    texts = iter_texts(
+        [raw_datasets[split] for split in scanned_splits], data_args.src_lang, data_args.tgt_lang, corpus_files
+    )
+    kept_ids = collect_token_ids(tokenizer, texts)
+    logger.info(f"Keeping {len(kept_ids)} of the {len(tokenizer)} tokens of the vocabulary")
+
+    num_params, num_bytes = get_model_size(model)
+    output_dir = training_args.output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    save_trimmed_tokenizer(tokenizer, kept_ids, output_dir)
+    trimmed_model = trim_embeddings(copy.deepcopy(model), kept_ids)
+    trimmed_model.save_pretrained(output_dir)
+    trimmed_num_params, trimmed_num_bytes = get_model_size(trimmed_model)
+    del trimmed_model
+
+    trimmed_model_args = copy.deepcopy(model_args)
+    trimmed_model_args.model_name_or_path = output_dir
+    trimmed_model_args.config_name = None
+    trimmed_model_args.tokenizer_name = None
+    trimmed_deepquest_model, trimmed_model, trimmed_startup_seconds = load_model(
+        trimmed_model_args, data_args, training_args, raw_datasets
+    )
+    report = {
+        "vocab_size": len(tokenizer),
+        "trimmed_vocab_size": len(kept_ids),
+        "num_params": num_params,
+        "trimmed_num_params": trimmed_num_params,
+        "size_mb": num_bytes / 2 ** 20,
+        "trimmed_size_mb": trimmed_num_bytes / 2 ** 20,
+        "startup_seconds": startup_seconds,
+        "trimmed_startup_seconds": trimmed_startup_seconds,
+    }
+
+    if trim_args.heldout_split in raw_datasets:
+        heldout_dataset = raw_datasets[trim_args.heldout_split]
+        if data_args.max_predict_samples is not None:
+            heldout_dataset = truncate_dataset(heldout_dataset, data_args.max_predict_samples)
+        reference_dataset = deepquest_model.tokenize_datasets(heldout_dataset)
+        trimmed_dataset = trimmed_deepquest_model.tokenize_datasets(heldout_dataset)
+        # the examples with pieces outside the kept vocabulary are segmented differently
+        report["heldout_examples_with_trimmed_pieces"] = sum(
+            not np.isin(ids, kept_ids).all() for ids in reference_dataset["input_ids"]
+        )
+        num_different, max_difference = compare_predictions(
+            predict(deepquest_model, model, reference_dataset, training_args),
+            predict(trimmed_deepquest_model, trimmed_model, trimmed_dataset, training_args),
+        )
+        report["heldout_examples"] = len(heldout_dataset)
+        report["heldout_different_predictions"] = num_different
+        report["heldout_max_score_difference"] = max_difference
+        if num_different:
+            logger.warning(f"The predictions differ on {num_different} of {len(heldout_dataset)} held-out examples")
+        else:
+            logger.info(f"The predictions are identical on the {len(heldout_dataset)} held-out examples")
+    else:
+        logger.warning(f"No {trim_args.heldout_split} split to compare the predictions of the trimmed model")
+
+    logger.info(json.dumps(report, indent=2))
+    with open(os.path.join(output_dir, "trim_report.json"), "w") as writer:
+        json.dump(report, writer, indent=2)
+
+
+if __name__ == "__main__":
+    main()
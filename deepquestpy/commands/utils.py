@@ -1,6 +1,9 @@
+import hashlib
 import importlib
 from pathlib import Path
 
+from datasets import IterableDataset, load_dataset
+
 # Paths
 PACKAGE_DIR = Path(__file__).resolve().parent.parent
 DATASETS_LOADERS_DIR = PACKAGE_DIR / "datasets"
@@ -10,6 +13,8 @@ METRICS_DIR = PACKAGE_DIR / "metrics"
 # maps lower-cased model names to model class names
 ARCHITECTURE_MAP = {
     "transformer-sent": "TransformerDeepQuestModelSent",
+    "transformer-sent-early-exit": "TransformerDeepQuestModelSentEarlyExit",
+    "transformer-siamese-sent": "TransformerDeepQuestModelSentSiamese",
     "transformer-word": "TransformerDeepQuestModelWord",
     "beringlab-word": "BeringLabWord",
     "birnn-sent": "BiRNNSent",
@@ -27,3 +32,79 @@ def get_deepquest_model(architecture_name, *args, **kwargs):
     except ValueError as e:
         print(f"/!\ {e}")
 
+
+def get_data_files_fingerprint(data_files, chunk_size=1 << 24):
+    """Computes a hash of the contents of the data files of each split."""
+    hasher = hashlib.blake2b(digest_size=16)
+    for split in sorted(data_files):
+        hasher.update(split.encode("utf-8"))
+        with open(data_files[split], "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def load_raw_datasets(data_args):
+    """Loads the dataset splits given in the command line arguments."""
+    if data_args.dataset_name in ["mlqe_pe"]:
+        raw_datasets = load_dataset(
+            f"{DATASETS_LOADERS_DIR}/{data_args.dataset_name}",
+            name=f"{data_args.src_lang}-{data_args.tgt_lang}",
+            streaming=data_args.streaming,
+        )
+    elif data_args.dataset_name in ["wmt20_mlqe_synth"]:
+        raw_datasets = load_dataset(
+            f"{DATASETS_LOADERS_DIR}/{data_args.dataset_name}",
+            name=f"{data_args.src_lang}-{data_args.tgt_lang}",
+            data_dir=data_args.data_dir,
+            streaming=data_args.streaming,
+        )
+    elif data_args.dataset_name in ["mqm_google"]:
+        data_files = {}
+        if data_args.train_file is not None:
+            data_files["train"] = data_args.train_file
+        if data_args.validation_file is not None:
+            data_files["validation"] = data_args.validation_file
+        if data_args.test_file is not None:
+            data_files["test"] = data_args.test_file
+        raw_datasets = load_dataset(
+            f"{DATASETS_LOADERS_DIR}/{data_args.dataset_name}",
+            name=f"{data_args.src_lang}-{data_args.tgt_lang}",
+            data_files=data_files,
+            data_fingerprint=get_data_files_fingerprint(data_files),
+            streaming=data_args.streaming,
+        )
+    elif data_args.dataset_name is not None:
+        raw_datasets = load_dataset(
+            data_args.dataset_name, name=f"{data_args.src_lang}-{data_args.tgt_lang}", streaming=data_args.streaming
+        )
+    else:
+        data_files = {}
+        if data_args.train_file is not None:
+            data_files["train"] = data_args.train_file
+        if data_args.validation_file is not None:
+            data_files["validation"] = data_args.validation_file
+        if data_args.test_file is not None:
+            data_files["test"] = data_args.test_file
+        raw_datasets = load_dataset(
+            f"{DATASETS_LOADERS_DIR}/custom",
+            data_files=data_files,
+            data_fingerprint=get_data_files_fingerprint(data_files),
+            streaming=data_args.streaming,
+        )
+    return raw_datasets
+
+
+def truncate_dataset(dataset, max_samples):
+    if isinstance(dataset, IterableDataset):
+        return dataset.take(max_samples)
+    return dataset.select(range(max_samples))
+
+
+def get_label_list(raw_datasets, label_column_name):
+    """Returns the names of the word-level labels from the features of the first available split."""
+    for split in ["train", "validation", "test"]:
+        if split in raw_datasets:
+            features = raw_datasets[split].features
+            break
+    return features[label_column_name].feature.names
@@ -0,0 +1,79 @@
+import numpy as np
+
+REDUCTIONS = ["max", "min", "mean"]
+
+
+def parse_alignments(line):
+    """
+    Parses a line of `"i-j"` word alignments into a flat int32 array `[i0, j0, i1, j1, ...]`, which is how the datasets
+    store them (one Arrow list of int32 per segment, so the offsets of the segments are those of the list).
+    """
+    return np.array(line.replace("-", " ").split(), dtype=np.int32)
+
+
+def to_pairs(alignments):
+    """Views flat alignments as an `(n, 2)` array of (source, MT) word indices."""
+    return np.asarray(alignments, dtype=np.int32).reshape(-1, 2)
+
+
+def flatten_batch(alignments, lengths_from, lengths_to):
+    """
+    Concatenates the alignments of a batch of segments into one `(n, 2)` array of indices into the concatenated
+    words of the batch, given the number of words of each segment on both sides.
+    """
+    pairs = [to_pairs(segment_alignments) for segment_alignments in alignments]
+    num_pairs = np.array([len(p) for p in pairs], dtype=np.int64)
+    if num_pairs.sum() == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    offsets = np.stack([np.cumsum(lengths_from) - lengths_from, np.cumsum(lengths_to) - lengths_to], axis=1)
+    return np.concatenate(pairs).astype(np.int64) + np.repeat(offsets, num_pairs, axis=0)
+
+
+def project(values, pairs, num_to, reduce="max", fill_value=0.0):
+    """
+    Projects the values (e.g. BAD indicators or BAD probabilities) of the words on one side of the alignments to the
+    words on the other side. `pairs[:, 0]` index `values` and `pairs[:, 1]` the projected words. Each projected word
+    gets the `reduce` of the values of its aligned words, and `fill_value` if it is not aligned.
+    """
+    if reduce not in REDUCTIONS:
+        raise ValueError(f"Unknown reduction {reduce}, expected one of {REDUCTIONS}")
+    values = np.asarray(values, dtype=np.float64)
+    src_idx, tgt_idx = pairs[:, 0], pairs[:, 1]
+    if reduce == "mean":
+        sums = np.zeros(num_to)
+        counts = np.zeros(num_to)
+        np.add.at(sums, tgt_idx, values[src_idx])
+        np.add.at(counts, tgt_idx, 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(counts > 0, sums / counts, fill_value)
+    ufunc, initial = (np.maximum, -np.inf) if reduce == "max" else (np.minimum, np.inf)
+    projected = np.full(num_to, initial)
+    ufunc.at(projected, tgt_idx, values[src_idx])
+    return np.where(np.isinf(projected), fill_value, projected)
+
+
+def project_batch(values, alignments, lengths_from, lengths_to, reduce="max", fill_value=0.0, mt_to_src=True):
+    """
+    Projects the word values of a batch of segments through their alignments in one vectorized call, and returns
+    the projected values of each segment. With `mt_to_src`, `values` are MT word values projected to the source.
+    """
+    lengths_from = np.asarray(lengths_from, dtype=np.int64)
+    lengths_to = np.asarray(lengths_to, dtype=np.int64)
+    if mt_to_src:
+        pairs = flatten_batch(alignments, lengths_to, lengths_from)[:, ::-1]
+    else:
+        pairs = flatten_batch(alignments, lengths_from, lengths_to)
+    flat_values = np.concatenate([np.asarray(v, dtype=np.float64) for v in values]) if len(values) else np.zeros(0)
+    projected = project(flat_values, pairs, int(lengths_to.sum()), reduce, fill_value)
+    return np.split(projected, np.cumsum(lengths_to)[:-1])
+
+
+def project_bad_tags(mt_tags, alignments, src_lengths, bad_label=0, ok_label=1):
+    """
+    Derives source word tags from MT word tags (without gaps): a source word is BAD if it is aligned to at least one
+    BAD MT word. Works on label ids, for a batch of segments.
+    """
+    mt_bad = [np.asarray(tags) == bad_label for tags in mt_tags]
+    mt_lengths = [len(tags) for tags in mt_tags]
+    src_bad = project_batch(mt_bad, alignments, mt_lengths, src_lengths, reduce="max", mt_to_src=True)
+    return [np.where(bad > 0, bad_label, ok_label).tolist() for bad in src_bad]
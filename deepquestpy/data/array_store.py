@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+VALUES_FILE_NAME = "values.bin"
+OFFSETS_FILE_NAME = "offsets.npy"
+METADATA_FILE_NAME = "metadata.json"
+
+
+class RaggedArrayWriter:
+    """
+    Writes a sequence of arrays of different lengths (but the same row shape and type) into a single flat file
+    that can be memory-mapped, together with the offset of each array. The store is written to a temporary folder
+    that is only moved to `path` when it is closed, so an interrupted job never leaves a partial store behind.
+    """
+
+    def __init__(self, path, dtype, row_shape=(), metadata=None):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.metadata = metadata if metadata is not None else {}
+        if os.path.exists(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        self._values_file = open(os.path.join(self.tmp_path, VALUES_FILE_NAME), "wb")
+        self._lengths = []
+
+    def append(self, array):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        if array.shape[1:] != self.row_shape:
+            raise ValueError(f"Expected arrays with rows of shape {self.row_shape}, but got {array.shape[1:]}")
+        self._values_file.write(array.tobytes())
+        self._lengths.append(len(array))
+
+    def close(self):
+        self._values_file.close()
+        offsets = np.zeros(len(self._lengths) + 1, dtype=np.int64)
+        np.cumsum(self._lengths, out=offsets[1:])
+        np.save(os.path.join(self.tmp_path, OFFSETS_FILE_NAME), offsets)
+        with open(os.path.join(self.tmp_path, METADATA_FILE_NAME), "w") as writer:
+            json.dump(
+                {"dtype": self.dtype.str, "row_shape": list(self.row_shape), "metadata": self.metadata}, writer, indent=2
+            )
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._values_file.close()
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+class RaggedArrayStore:
+    """Read-only, memory-mapped view of a store written by `RaggedArrayWriter`."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE_NAME)) as reader:
+            info = json.load(reader)
+        self.metadata = info["metadata"]
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE_NAME))
+        dtype, shape = np.dtype(info["dtype"]), (int(self.offsets[-1]),) + tuple(info["row_shape"])
+        # an empty file (e.g. the store of an empty split) cannot be memory-mapped
+        if np.prod(shape) > 0:
+            self.values = np.memmap(os.path.join(path, VALUES_FILE_NAME), dtype=dtype, mode="r", shape=shape)
+        else:
+            self.values = np.zeros(shape, dtype=dtype)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, METADATA_FILE_NAME))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.values[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
@@ -4,11 +4,13 @@ import numpy as np
 from overrides import overrides
 
 from allennlp.data.dataset_readers.dataset_reader import DatasetReader
-from allennlp.data.fields import Field, TextField, SequenceLabelField,TensorField
+from allennlp.data.fields import Field, MetadataField, TextField, SequenceLabelField,TensorField
 from allennlp.data.instance import Instance
 from allennlp.data.token_indexers import TokenIndexer
 from allennlp.data.tokenizers import Tokenizer, WhitespaceTokenizer
 
+from deepquestpy.data.line_index import ParallelLineIndex
+
 
 @DatasetReader.register("birnn_reader")
 class BiRNNReader(DatasetReader):
@@ -23,6 +25,7 @@ class BiRNNReader(DatasetReader):
         token_indexers_tgt: Dict[str, TokenIndexer] = None,
         sentence_level:bool = True,
         tag_label_namespace = "tag_labels",
+        with_instance_metadata: bool = False,
         **kwargs,
     ) -> None:
         super().__init__(manual_distributed_sharding=True, manual_multiprocess_sharding=True, **kwargs)
@@ -32,6 +35,8 @@ class BiRNNReader(DatasetReader):
         self._token_indexers_tgt = token_indexers_tgt
         self.sentence_level = sentence_level
         self._tag_label_namespace: str = tag_label_namespace
+        # the split and position of each instance, used to read its precomputed embeddings
+        self.with_instance_metadata = with_instance_metadata
 
     @overrides
     def _read(self, path_name: str):
@@ -40,12 +45,14 @@ class BiRNNReader(DatasetReader):
         tgt_filename = os.path.join(self.data_path,path_name,path_name+".mt")
         tgt_tags_filename = os.path.join(self.data_path,path_name,path_name+".tags")
         hter_filename = os.path.join(self.data_path,path_name,path_name+".hter")
-        with open(src_filename, "r") as src_file, open(src_tags_filename, "r") as src_tags_file, open(tgt_filename, "r") as tgt_file,\
-                open(tgt_tags_filename, "r") as tgt_tags_file,\
-                open(hter_filename, "r") as hter_file:
-            for src,src_tags,tgt,tgt_tags,hter in zip(self.shard_iterable(src_file), self.shard_iterable(src_tags_file),
-                self.shard_iterable(tgt_file), self.shard_iterable(tgt_tags_file), self.shard_iterable(hter_file)):
-                yield self.text_to_instance(src, src_tags, tgt, tgt_tags,np.asarray(hter,dtype=np.float32))
+        index = ParallelLineIndex({"src": src_filename, "src_tags": src_tags_filename, "tgt": tgt_filename,
+                                   "tgt_tags": tgt_tags_filename, "hter": hter_filename})
+        # each worker only reads its own records
+        for idx in self.shard_iterable(range(len(index))):
+            record = index[idx]
+            metadata = {"split": path_name, "idx": idx} if self.with_instance_metadata else None
+            yield self.text_to_instance(record["src"], record["src_tags"], record["tgt"], record["tgt_tags"],
+                                        np.asarray(record["hter"], dtype=np.float32), metadata)
 
     @overrides
     def text_to_instance(
@@ -55,6 +62,7 @@ class BiRNNReader(DatasetReader):
         tgt: str,
         tgt_tags:str,
         sent_label: np.ndarray = None,
+        metadata: Dict = None,
     ) -> Instance:
 
         fields: Dict[str, Field] = {}
@@ -78,5 +86,7 @@ class BiRNNReader(DatasetReader):
             fields["tags_tgt"] = SequenceLabelField(tgt_tags, tokens_tgt,self._tag_label_namespace)
         else:
             fields["labels"] = TensorField(sent_label)
+        if metadata is not None:
+            fields["metadata"] = MetadataField(metadata)
 
         return Instance(fields)
\ No newline at end of file
@@ -4,11 +4,13 @@ import numpy as np
 from overrides import overrides
 
 from allennlp.data.dataset_readers.dataset_reader import DatasetReader
-from allennlp.data.fields import Field, TextField, SequenceLabelField,TensorField
+from allennlp.data.fields import Field, MetadataField, TextField, SequenceLabelField,TensorField
 from allennlp.data.instance import Instance
 from allennlp.data.token_indexers import TokenIndexer
 from allennlp.data.tokenizers import Tokenizer, WhitespaceTokenizer, PretrainedTransformerTokenizer
 
+from deepquestpy.data.line_index import ParallelLineIndex
+
 @DatasetReader.register("birnn_sent_reader")
 class BiRNNSentReader(DatasetReader):
     """
@@ -22,6 +24,7 @@ class BiRNNSentReader(DatasetReader):
         token_indexers_tgt: Dict[str, TokenIndexer] = None,
         sentence_level:bool = True,
         tag_label_namespace = "tag_labels",
+        with_instance_metadata: bool = False,
         do_predict:bool = False,
         **kwargs,
     ) -> None:
@@ -33,6 +36,8 @@ class BiRNNSentReader(DatasetReader):
         self._token_indexers_tgt = token_indexers_tgt
         self.sentence_level = sentence_level
         self._tag_label_namespace: str = tag_label_namespace
+        # the split and position of each instance, used to read its precomputed embeddings
+        self.with_instance_metadata = with_instance_metadata
         self.do_predict = do_predict
 
     @overrides
@@ -42,13 +47,14 @@ class BiRNNSentReader(DatasetReader):
         score_filename = os.path.join(self.data_path,path_name,path_name+".score")
         t_pred_filename = os.path.join(self.data_path,path_name,path_name+".tpred")
 
-        with open(src_filename, "r") as src_file, open(tgt_filename, "r") as tgt_file,\
-                open(score_filename, "r") as score_file, open(t_pred_filename, "r") as t_pred_file:
-
-            for src, tgt, score, t_pred in zip(self.shard_iterable(src_file),
-                self.shard_iterable(tgt_file), self.shard_iterable(score_file), self.shard_iterable(t_pred_file)):
-                
-                yield self.text_to_instance(src, tgt, np.asarray(score, dtype=np.float32), np.asarray(t_pred, dtype=np.float32))
+        index = ParallelLineIndex({"src": src_filename, "tgt": tgt_filename, "score": score_filename,
+                                   "t_pred": t_pred_filename})
+        # each worker only reads its own records
+        for idx in self.shard_iterable(range(len(index))):
+            record = index[idx]
+            metadata = {"split": path_name, "idx": idx} if self.with_instance_metadata else None
+            yield self.text_to_instance(record["src"], record["tgt"], np.asarray(record["score"], dtype=np.float32),
+                                        np.asarray(record["t_pred"], dtype=np.float32), metadata)
 
     @overrides
     def text_to_instance(
@@ -57,6 +63,7 @@ class BiRNNSentReader(DatasetReader):
         tgt: str,
         sent_label: np.ndarray = None,
         t_pred: np.ndarray = None,
+        metadata: Dict = None,
     ) -> Instance:
 
         fields: Dict[str, Field] = {}
@@ -74,5 +81,7 @@ class BiRNNSentReader(DatasetReader):
         if not self.do_predict:
             fields["labels"] = TensorField(sent_label)
             fields["t_pred"] = TensorField(t_pred)
+        if metadata is not None:
+            fields["metadata"] = MetadataField(metadata)
 
         return Instance(fields)
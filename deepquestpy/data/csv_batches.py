@@ -0,0 +1,18 @@
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+
+def read_csv_batches(filepath, column_types, block_size=1 << 24):
+    """Reads a csv file as a stream of Arrow record batches."""
+    return pa_csv.open_csv(
+        filepath,
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(include_columns=list(column_types), column_types=column_types),
+    )
+
+
+def clean_text_column(column, strip_whitespace=False):
+    """Replaces the missing values of a text column with empty strings, and optionally trims the whitespace."""
+    column = pc.fill_null(column, "")
+    return pc.utf8_trim_whitespace(column) if strip_whitespace else column
@@ -69,3 +69,33 @@ class DataCollatorForJointClassification:
             batch_in_tensor[k] = torch.tensor(v, dtype=dtype)
 
         return batch_in_tensor
+
+
+@dataclass
+class DataCollatorForSentencePairs:
+    """
+    Data collator for models that encode the source and the translation separately. The inputs of the source
+    (`input_ids`, `attention_mask`) and those of the translation (`mt_input_ids`, `mt_attention_mask`) are each padded
+    to their own longest sequence.
+
+    Args:
+        tokenizer (:class:`~transformers.PreTrainedTokenizer` or :class:`~transformers.PreTrainedTokenizerFast`):
+            The tokenizer used for encoding the data.
+        pad_to_multiple_of (:obj:`int`, `optional`):
+            If set will pad the sequences to a multiple of the provided value.
+    """
+
+    tokenizer: PreTrainedTokenizerBase
+    pad_to_multiple_of: Optional[int] = None
+
+    def __call__(self, features):
+        batch = {}
+        for prefix in ["", "mt_"]:
+            side_features = [
+                {name: feature[f"{prefix}{name}"] for name in ["input_ids", "attention_mask"]} for feature in features
+            ]
+            padded = self.tokenizer.pad(side_features, pad_to_multiple_of=self.pad_to_multiple_of, return_tensors="pt")
+            batch.update({f"{prefix}{name}": tensor for name, tensor in padded.items()})
+        if "labels" in features[0]:
+            batch["labels"] = torch.tensor([feature["labels"] for feature in features], dtype=torch.float)
+        return batch
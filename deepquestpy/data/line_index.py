@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+
+INDEX_SUFFIX = ".offsets.npy"
+
+
+def build_line_offsets(path, block_size=1 << 26):
+    """
+    Returns the byte offset of the start of every line of a file, followed by the size of the file, so that line `k`
+    spans `offsets[k]:offsets[k + 1]`. The file is scanned in blocks over a memory map, without decoding it.
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return np.zeros(1, dtype=np.int64)
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    line_ends = [
+        np.flatnonzero(data[start : start + block_size] == ord("\n")) + start + 1
+        for start in range(0, size, block_size)
+    ]
+    line_ends = np.concatenate(line_ends).astype(np.int64)
+    if len(line_ends) == 0 or line_ends[-1] != size:  # the last line does not end with a newline
+        line_ends = np.append(line_ends, size)
+    return np.concatenate([np.zeros(1, dtype=np.int64), line_ends])
+
+
+def load_line_offsets(path):
+    """
+    Loads the line offsets of a file from the index stored next to it, or builds (and tries to store) the index if it
+    does not exist or is older than the file.
+    """
+    index_path = f"{path}{INDEX_SUFFIX}"
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        offsets = np.load(index_path)
+        if offsets[-1] == os.path.getsize(path):
+            return offsets
+    offsets = build_line_offsets(path)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, offsets)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        # the folder of the data is read-only, so the index is only kept in memory
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return offsets
+
+
+class LineIndexedFile:
+    """Random access to the lines of a memory-mapped text file."""
+
+    def __init__(self, path, encoding="utf-8"):
+        self.path = path
+        self.encoding = encoding
+        self.offsets = load_line_offsets(path)
+        self._data = np.memmap(path, dtype=np.uint8, mode="r") if self.offsets[-1] > 0 else np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Line {idx} is out of range for {self.path} ({len(self)} lines)")
+        line = self._data[self.offsets[idx] : self.offsets[idx + 1]].tobytes().decode(self.encoding)
+        return line.rstrip("\r\n")
+
+    def get_range(self, start, end):
+        """Returns the lines `[start, end)`, decoded in one go."""
+        start, end = max(start, 0), min(end, len(self))
+        if start >= end:
+            return []
+        text = self._data[self.offsets[start] : self.offsets[end]].tobytes().decode(self.encoding)
+        return [line.rstrip("\r") for line in text.split("\n")[: end - start]]
+
+
+class ParallelLineIndex:
+    """
+    Random access to the records of a set of parallel text files, where line `k` of every file belongs to record `k`.
+    Checks that all the files have the same number of lines. Files given as `None` (e.g. missing labels) give `None`.
+    """
+
+    def __init__(self, paths, encoding="utf-8"):
+        self.names = list(paths)
+        self.files = {name: LineIndexedFile(path, encoding) for name, path in paths.items() if path is not None}
+        num_lines = {name: len(f) for name, f in self.files.items()}
+        if len(set(num_lines.values())) > 1:
+            raise ValueError(f"The parallel files do not have the same number of lines: {num_lines}")
+        self.num_records = next(iter(num_lines.values())) if num_lines else 0
+
+    def __len__(self):
+        return self.num_records
+
+    def __getitem__(self, idx):
+        return {name: self.files[name][idx] if name in self.files else None for name in self.names}
+
+    def get_range(self, start, end):
+        """Returns the records `[start, end)` as a list of dicts."""
+        start, end = max(start, 0), min(end, self.num_records)
+        columns = {name: f.get_range(start, end) for name, f in self.files.items()}
+        return [
+            {name: columns[name][i] if name in columns else None for name in self.names} for i in range(end - start)
+        ]
+
+    def iter_records(self, start=0, end=None, block_size=10000):
+        """Yields `(idx, record)` for the records `[start, end)`, reading `block_size` records at a time."""
+        end = self.num_records if end is None else min(end, self.num_records)
+        for block_start in range(start, end, block_size):
+            block_end = min(block_start + block_size, end)
+            yield from enumerate(self.get_range(block_start, block_end), start=block_start)
+
+    def get_shard(self, shard_idx, num_shards):
+        """Returns the (start, end) range of the `shard_idx`-th of `num_shards` contiguous shards."""
+        bounds = np.linspace(0, self.num_records, num_shards + 1).astype(int)
+        return int(bounds[shard_idx]), int(bounds[shard_idx + 1])
+
+    def sample(self, num_samples, seed=None):
+        """Returns `num_samples` records picked at random, without replacement."""
+        rng = np.random.default_rng(seed)
+        indices = rng.choice(self.num_records, size=min(num_samples, self.num_records), replace=False)
+        return [self[int(idx)] for idx in indices]
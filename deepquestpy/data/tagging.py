@@ -0,0 +1,83 @@
+import numpy as np
+
+from deepquestpy.data.alignments import parse_alignments, project, to_pairs
+
+OK, BAD = "OK", "BAD"
+
+
+def _to_ids(mt_words, pe_words):
+    vocab = {}
+    mt_ids = np.array([vocab.setdefault(word, len(vocab)) for word in mt_words], dtype=np.int64)
+    pe_ids = np.array([vocab.setdefault(word, len(vocab)) for word in pe_words], dtype=np.int64)
+    return mt_ids, pe_ids
+
+
+def edit_distance_matrix(mt_ids, pe_ids):
+    """
+    Returns the matrix `d[i, j]` of the edit distances between the first `i` MT words and the first `j` PE words,
+    with unit costs for insertions, deletions and substitutions. Each row is computed with vectorized operations:
+    the insertions along a row are a running minimum, `d[i, j] = j + min_k<=j (t[k] - k)`.
+    """
+    num_mt, num_pe = len(mt_ids), len(pe_ids)
+    columns = np.arange(num_pe + 1)
+    d = np.empty((num_mt + 1, num_pe + 1), dtype=np.int64)
+    d[0] = columns
+    for i in range(1, num_mt + 1):
+        t = np.empty(num_pe + 1, dtype=np.int64)
+        t[0] = i
+        t[1:] = np.minimum(d[i - 1, :-1] + (pe_ids != mt_ids[i - 1]), d[i - 1, 1:] + 1)
+        d[i] = columns + np.minimum.accumulate(t - columns)
+    return d
+
+
+def tag_post_edit(mt_words, pe_words):
+    """
+    Tags the words of a translation given its post-edition, with a TER-style edit alignment (without block shifts).
+    MT words kept as they are in the PE are OK, substituted or deleted words are BAD, and the gap before a word
+    (and the gap at the end) is BAD if PE words were inserted there.
+
+    Returns the MT tags with gaps (`2 * len(mt_words) + 1` tags, starting with a gap) and the HTER.
+    """
+    mt_ids, pe_ids = _to_ids(mt_words, pe_words)
+    d = edit_distance_matrix(mt_ids, pe_ids)
+    word_tags = [OK] * len(mt_words)
+    gap_tags = [OK] * (len(mt_words) + 1)
+
+    i, j = len(mt_ids), len(pe_ids)
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and d[i, j] == d[i - 1, j - 1] + (mt_ids[i - 1] != pe_ids[j - 1]):
+            if mt_ids[i - 1] != pe_ids[j - 1]:
+                word_tags[i - 1] = BAD
+            i, j = i - 1, j - 1
+        elif i > 0 and d[i, j] == d[i - 1, j] + 1:
+            word_tags[i - 1] = BAD  # deleted
+            i -= 1
+        else:
+            gap_tags[i] = BAD  # inserted
+            j -= 1
+
+    tags = [gap_tags[0]]
+    for word_tag, gap_tag in zip(word_tags, gap_tags[1:]):
+        tags.extend([word_tag, gap_tag])
+    hter = d[-1, -1] / max(len(pe_ids), 1)
+    return tags, float(hter)
+
+
+def project_source_tags(mt_word_tags, alignments, num_src_words):
+    """Tags as BAD the source words aligned to at least one BAD MT word. Unaligned source words are OK."""
+    mt_bad = np.array([tag == BAD for tag in mt_word_tags], dtype=np.float64)
+    src_bad = project(mt_bad, to_pairs(alignments)[:, ::-1], num_src_words, reduce="max")
+    return [BAD if bad else OK for bad in src_bad]
+
+
+def tag_triple(src, mt, pe, alignments=None):
+    """
+    Returns the source tags, the MT tags (with gaps) and the HTER of a (source, MT, post-edition) triple of
+    whitespace-tokenized sentences. The source tags are only derived if the source-MT alignments are given.
+    """
+    src_words, mt_words = src.split(), mt.split()
+    mt_tags, hter = tag_post_edit(mt_words, pe.split())
+    src_tags = None
+    if alignments is not None:
+        src_tags = project_source_tags(mt_tags[1::2], parse_alignments(alignments), len(src_words))
+    return src_tags, mt_tags, hter
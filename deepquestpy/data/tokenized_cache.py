@@ -0,0 +1,113 @@
+import glob
+import hashlib
+import inspect
+import json
+import os
+
+from datasets import Dataset, concatenate_datasets
+
+
+# number of rows of a table that are converted to Python values at a time when hashing it
+HASH_WINDOW_ROWS = 1 << 14
+
+
+def _update_with_table(hasher, table):
+    """
+    Hashes the values of a table, column by column in windows of rows. The Arrow buffers are not hashed, as they
+    depend on how the table is chunked and sliced, and hold undefined bytes under the null values.
+    """
+    for name in table.column_names:
+        hasher.update(f"{name}:{table.num_rows}".encode("utf-8"))
+        column = table.column(name)
+        for start in range(0, table.num_rows, HASH_WINDOW_ROWS):
+            hasher.update(repr(column.slice(start, HASH_WINDOW_ROWS).to_pylist()).encode("utf-8"))
+
+
+def get_dataset_fingerprint(dataset):
+    """Computes a hash of the contents of a dataset, which does not depend on where its files are stored."""
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(json.dumps(dataset.features.to_dict(), sort_keys=True).encode("utf-8"))
+    _update_with_table(hasher, dataset.data.table)
+    indices = getattr(dataset, "_indices", None)  # set after `select`, `shuffle`, etc.
+    if indices is not None:
+        _update_with_table(hasher, indices.table)
+    return hasher.hexdigest()
+
+
+def get_tokenizer_fingerprint(tokenizer):
+    """
+    Computes a hash of a tokenizer. The padding and truncation settings of fast tokenizers change after each call,
+    so they are ignored.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(type(tokenizer).__name__.encode("utf-8"))
+    hasher.update(str(tokenizer.model_max_length).encode("utf-8"))
+    hasher.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True).encode("utf-8"))
+    if tokenizer.is_fast:
+        backend_state = json.loads(tokenizer.backend_tokenizer.to_str())
+        backend_state["truncation"] = None
+        backend_state["padding"] = None
+        hasher.update(json.dumps(backend_state, sort_keys=True).encode("utf-8"))
+    else:
+        hasher.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def get_function_fingerprint(function):
+    try:
+        source = inspect.getsource(function)
+    except (OSError, TypeError):
+        source = ""
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{function.__module__}.{function.__qualname__}\n{source}".encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def get_tokenized_fingerprint(dataset, function, tokenizer, fn_kwargs):
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(get_dataset_fingerprint(dataset).encode("utf-8"))
+    hasher.update(get_function_fingerprint(function).encode("utf-8"))
+    hasher.update(get_tokenizer_fingerprint(tokenizer).encode("utf-8"))
+    hasher.update(json.dumps(fn_kwargs, sort_keys=True).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def _load_cached_dataset(cache_file_name):
+    if os.path.exists(cache_file_name):
+        return Dataset.from_file(cache_file_name)
+    # the dataset was tokenized with several processes, so there is one file per process
+    root, ext = os.path.splitext(cache_file_name)
+    shard_files = sorted(glob.glob(f"{root}_*_of_*{ext}"))
+    if shard_files:
+        return concatenate_datasets([Dataset.from_file(shard_file) for shard_file in shard_files])
+    return None
+
+
+def tokenize_dataset(
+    dataset, function, tokenizer, fn_kwargs, cache_dir=None, num_proc=None, load_from_cache_file=True
+):
+    """
+    Tokenizes a dataset with `function(examples, tokenizer, **fn_kwargs)`.
+
+    The fingerprint of the result only depends on the contents of the dataset, the code of the function, the
+    tokenizer and the preprocessing arguments. If `cache_dir` is given, the tokenized dataset is stored there under
+    that fingerprint, so that it can be reused by later runs, even from other machines.
+    """
+    fingerprint = get_tokenized_fingerprint(dataset, function, tokenizer, fn_kwargs)
+    cache_file_name = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_file_name = os.path.join(cache_dir, f"tokenized-{fingerprint}.arrow")
+        if load_from_cache_file:
+            cached_dataset = _load_cached_dataset(cache_file_name)
+            if cached_dataset is not None:
+                return cached_dataset
+    return dataset.map(
+        function,
+        batched=True,
+        fn_kwargs={"tokenizer": tokenizer, **fn_kwargs},
+        num_proc=num_proc,
+        load_from_cache_file=load_from_cache_file,
+        cache_file_name=cache_file_name,
+        new_fingerprint=fingerprint,
+    )
@@ -6,7 +6,9 @@ import os
 import logging
 
 import datasets
-import pandas as pd
+import pyarrow as pa
+
+from deepquestpy.data.csv_batches import clean_text_column, read_csv_batches
 
 _CITATION = """
 """
@@ -16,13 +18,16 @@ _DESCRIPTION = """
 
 
 class CustomQEConfig(datasets.BuilderConfig):
-    def __init__(self, src_lg="en", tgt_lg="de", **kwargs):
+    def __init__(self, src_lg="en", tgt_lg="de", data_fingerprint=None, **kwargs):
         super(CustomQEConfig, self).__init__(**kwargs)
         self.src_lg = src_lg
         self.tgt_lg = tgt_lg
+        # Hash of the contents of the data files. It is part of the config id, so the cache is only
+        # regenerated when the contents of the files change.
+        self.data_fingerprint = data_fingerprint
 
 
-class CustomQE(datasets.GeneratorBasedBuilder):
+class CustomQE(datasets.ArrowBasedBuilder):
 
     BUILDER_CONFIGS = [
         CustomQEConfig(
@@ -70,13 +75,18 @@ class CustomQE(datasets.GeneratorBasedBuilder):
 
         return generators
 
-    def _generate_examples(self, filepath, split, source_lg, target_lg):
+    def _generate_tables(self, filepath, split, source_lg, target_lg):
         logging.info(f"Generating for {split}...")
-        df_translations = pd.read_csv(filepath)
-        for id, row in df_translations.iterrows():
-            yield id, {
-                "translation": {source_lg: str(row["original"]), target_lg: str(row["translation"])},
-                "z_mean": float(row["z_mean"]),
-                # "src_tags": str(row["src_tags"]).split(),
-                # "mt_tags": row["tgt_tags"].split(),
-            }
+        filepaths = filepath if isinstance(filepath, (list, tuple)) else [filepath]
+        column_types = {"original": pa.string(), "translation": pa.string(), "z_mean": pa.float32()}
+        schema = self.info.features.arrow_schema
+        for file_idx, filepath in enumerate(filepaths):
+            for batch_idx, batch in enumerate(read_csv_batches(filepath, column_types)):
+                columns = dict(zip(batch.schema.names, batch.columns))
+                translation = pa.StructArray.from_arrays(
+                    [clean_text_column(columns["original"]), clean_text_column(columns["translation"])],
+                    names=[source_lg, target_lg],
+                )
+                # "src_tags" and "mt_tags" are not read for now
+                table = pa.Table.from_arrays([translation, columns["z_mean"]], names=["translation", "z_mean"])
+                yield f"{file_idx}_{batch_idx}", table.cast(schema)
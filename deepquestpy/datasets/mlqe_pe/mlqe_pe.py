@@ -5,6 +5,9 @@ import os
 
 import datasets
 
+from deepquestpy.data.alignments import parse_alignments
+from deepquestpy.data.line_index import ParallelLineIndex
+
 
 _CITATION = """
 @article{fomicheva2020mlqepe,
@@ -88,7 +91,8 @@ class MlqePePostEditing(datasets.GeneratorBasedBuilder):
                     "mt_tags": datasets.Sequence(datasets.ClassLabel(names=["BAD", "OK"])),
                     "pe": datasets.Value("string"),
                     "hter": datasets.Value("float32"),
-                    "alignments": datasets.Sequence(datasets.Sequence(datasets.Value("int32"))),
+                    # flat (source, MT) pairs: [src_0, mt_0, src_1, mt_1, ...]
+                    "alignments": datasets.Sequence(datasets.Value("int32")),
                 }
             ),
             supervised_keys=None,
@@ -100,63 +104,77 @@ class MlqePePostEditing(datasets.GeneratorBasedBuilder):
     def _split_generators(self, dl_manager):
         """Returns SplitGenerators."""
         my_urls = _URLs[self.config.name]
+        pair = f"{self.config.src_lg}-{self.config.tgt_lg}"
+        splits = [
+            (datasets.Split.TRAIN, "train", f"{pair}-train", "train"),
+            (datasets.Split.VALIDATION, "dev", f"{pair}-dev", "dev"),
+            (datasets.Split.TEST, "test", f"{pair}-test20", "test20"),
+        ]
+        if getattr(dl_manager, "is_streaming", False):
+            # TAR archives cannot be extracted when streaming, their members are read as they come instead
+            archives = dl_manager.download(my_urls)
+            return [
+                datasets.SplitGenerator(
+                    name=name,
+                    gen_kwargs={
+                        "filepath": None,
+                        "split": split,
+                        "source_lg": self.config.src_lg,
+                        "target_lg": self.config.tgt_lg,
+                        "archive_files": dl_manager.iter_archive(archives[url_key]),
+                    },
+                )
+                for name, url_key, _, split in splits
+            ]
         data_dir = dl_manager.download_and_extract(my_urls)
         return [
             datasets.SplitGenerator(
-                name=datasets.Split.TRAIN,
-                gen_kwargs={
-                    "filepath": os.path.join(data_dir["train"], f"{self.config.src_lg}-{self.config.tgt_lg}-train"),
-                    "split": "train",
-                    "source_lg": self.config.src_lg,
-                    "target_lg": self.config.tgt_lg,
-                },
-            ),
-            datasets.SplitGenerator(
-                name=datasets.Split.VALIDATION,
-                gen_kwargs={
-                    "filepath": os.path.join(data_dir["dev"], f"{self.config.src_lg}-{self.config.tgt_lg}-dev"),
-                    "split": "dev",
-                    "source_lg": self.config.src_lg,
-                    "target_lg": self.config.tgt_lg,
-                },
-            ),
-            datasets.SplitGenerator(
-                name=datasets.Split.TEST,
+                name=name,
                 gen_kwargs={
-                    "filepath": os.path.join(data_dir["test"], f"{self.config.src_lg}-{self.config.tgt_lg}-test20"),
-                    "split": "test20",
+                    "filepath": os.path.join(data_dir[url_key], dir_name),
+                    "split": split,
                     "source_lg": self.config.src_lg,
                     "target_lg": self.config.tgt_lg,
                 },
-            ),
+            )
+            for name, url_key, dir_name, split in splits
         ]
 
-    def _generate_examples(self, filepath, split, source_lg, target_lg):
+    def _generate_examples(self, filepath, split, source_lg, target_lg, archive_files=None):
         """Yields examples."""
 
-        def open_and_read(fp):
-            with open(fp, encoding="utf-8") as f:
-                return f.read().splitlines()
-
-        srcs = open_and_read(os.path.join(filepath, f"{split}.src"))
-        mts = open_and_read(os.path.join(filepath, f"{split}.mt"))
-        alignments = [
-            [idx_.split("-") for idx_ in t.split(" ")]
-            for t in open_and_read(os.path.join(filepath, f"{split}.src-mt.alignments"))
-        ]
-        src_tags = [t.split(" ") for t in open_and_read(os.path.join(filepath, f"{split}.source_tags"))]
-        mt_tags = [t.split(" ") for t in open_and_read(os.path.join(filepath, f"{split}.tags"))]
-        pes = open_and_read(os.path.join(filepath, f"{split}.pe"))
-        hters = open_and_read(os.path.join(filepath, f"{split}.hter"))
-
-        for id_, (src_, src_tags_, mt_, mt_tags_, pe_, hter_, alignments_) in enumerate(
-            zip(srcs, src_tags, mts, mt_tags, pes, hters, alignments)
-        ):
-            yield id_, {
+        def make_example(src_, src_tags_, mt_, mt_tags_, pe_, hter_, alignments_):
+            return {
                 "translation": {source_lg: src_, target_lg: mt_},
-                "src_tags": src_tags_,
-                "mt_tags": mt_tags_,
+                "src_tags": src_tags_.split(" "),
+                "mt_tags": mt_tags_.split(" "),
                 "pe": pe_,
-                "hter": hter_,
-                "alignments": alignments_,
+                "hter": float(hter_),
+                "alignments": parse_alignments(alignments_),
             }
+
+        extensions = ["src", "source_tags", "mt", "tags", "pe", "hter", "src-mt.alignments"]
+        if archive_files is None:
+            # The index checks that the files are aligned
+            paths = [os.path.join(filepath, f"{split}.{ext}") for ext in extensions]
+            index = ParallelLineIndex(dict(zip(extensions, paths)))
+            for id_, record in index.iter_records():
+                yield id_, make_example(*[record[ext] for ext in extensions])
+            return
+
+        # the members of an archive can only be read in turn, so the lines of the seven files of the split (a few
+        # thousand pairs) are kept until they have all been read
+        member_names = {f"{split}.{ext}": ext for ext in extensions}
+        lines = {}
+        for path, f in archive_files:
+            ext = member_names.get(os.path.basename(path))
+            if ext is not None:
+                lines[ext] = [line.decode("utf-8").rstrip("\r\n") for line in f]
+        missing = [ext for ext in extensions if ext not in lines]
+        if missing:
+            raise ValueError(f"The archive of the {split} split has no {', '.join(missing)} file")
+        num_lines = {ext: len(ext_lines) for ext, ext_lines in lines.items()}
+        if len(set(num_lines.values())) > 1:
+            raise ValueError(f"The files of the {split} split do not have the same number of lines: {num_lines}")
+        for id_, record in enumerate(zip(*[lines[ext] for ext in extensions])):
+            yield id_, make_example(*record)
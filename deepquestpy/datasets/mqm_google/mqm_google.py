@@ -6,7 +6,10 @@ import os
 import logging
 
 import datasets
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from deepquestpy.data.csv_batches import clean_text_column, read_csv_batches
 
 _CITATION = """
 """
@@ -19,14 +22,31 @@ _LANGUAGE_PAIRS = [
 ]
 
 
+_LABEL_NAMES = ["BAD", "OK"]
+
+
 class MQMGoogleConfig(datasets.BuilderConfig):
-    def __init__(self, src_lg, tgt_lg, **kwargs):
+    def __init__(self, src_lg, tgt_lg, data_fingerprint=None, **kwargs):
         super(MQMGoogleConfig, self).__init__(**kwargs)
         self.src_lg = src_lg
         self.tgt_lg = tgt_lg
+        # Hash of the contents of the data files. It is part of the config id, so the cache is only
+        # regenerated when the contents of the files change.
+        self.data_fingerprint = data_fingerprint
 
 
-class MQMGoogle(datasets.GeneratorBasedBuilder):
+def encode_labels_column(column, label_names):
+    """Converts a column of space-separated labels into a column of lists of label ids."""
+    text = clean_text_column(column, strip_whitespace=True)
+    # empty strings are set to null so that they become empty lists of labels
+    tags = pc.utf8_split_whitespace(pc.if_else(pc.equal(text, ""), pa.scalar(None, pa.string()), text))
+    ids = pc.index_in(tags.flatten(), value_set=pa.array(label_names))
+    if ids.null_count > 0:
+        raise ValueError(f"Found labels that are not in {label_names}.")
+    return pa.ListArray.from_arrays(tags.offsets, pc.cast(ids, pa.int64()))
+
+
+class MQMGoogle(datasets.ArrowBasedBuilder):
     BUILDER_CONFIGS = [
         MQMGoogleConfig(
             name=f"{src_lg}-{tgt_lg}",
@@ -46,7 +66,7 @@ class MQMGoogle(datasets.GeneratorBasedBuilder):
             features=datasets.Features(
                 {
                     "translation": datasets.Translation(languages=(self.config.src_lg, self.config.tgt_lg)),
-                    "bad_labels": datasets.Sequence(datasets.ClassLabel(names=["BAD", "OK"])),
+                    "bad_labels": datasets.Sequence(datasets.ClassLabel(names=_LABEL_NAMES)),
                 }
             ),
             supervised_keys=None,
@@ -75,11 +95,26 @@ class MQMGoogle(datasets.GeneratorBasedBuilder):
                 )
         return generators
 
-    def _generate_examples(self, filepath, split, source_lg, target_lg):
-        logging.info("Generating examples")
-        df_translations = pd.read_csv(filepath)
-        for id, row in df_translations.iterrows():
-            yield id, {
-                "translation": {source_lg: str(row["original"]).strip(), target_lg: str(row["translation"]).strip()},
-                "bad_labels": [] if split == "test" else str(row["bad_labels"]).strip().split(),
-            }
+    def _generate_tables(self, filepath, split, source_lg, target_lg):
+        logging.info("Generating tables")
+        filepaths = filepath if isinstance(filepath, (list, tuple)) else [filepath]
+        column_types = {"original": pa.string(), "translation": pa.string()}
+        if split != "test":
+            column_types["bad_labels"] = pa.string()
+        schema = self.info.features.arrow_schema
+        for file_idx, filepath in enumerate(filepaths):
+            for batch_idx, batch in enumerate(read_csv_batches(filepath, column_types)):
+                columns = dict(zip(batch.schema.names, batch.columns))
+                translation = pa.StructArray.from_arrays(
+                    [
+                        clean_text_column(columns["original"], strip_whitespace=True),
+                        clean_text_column(columns["translation"], strip_whitespace=True),
+                    ],
+                    names=[source_lg, target_lg],
+                )
+                if split == "test":
+                    bad_labels = pa.array([[]] * batch.num_rows, type=pa.list_(pa.int64()))
+                else:
+                    bad_labels = encode_labels_column(columns["bad_labels"], _LABEL_NAMES)
+                table = pa.Table.from_arrays([translation, bad_labels], names=["translation", "bad_labels"])
+                yield f"{file_idx}_{batch_idx}", table.cast(schema)
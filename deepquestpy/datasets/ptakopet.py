@@ -19,6 +19,8 @@ import os
 
 import datasets
 
+from deepquestpy.data.line_index import ParallelLineIndex
+
 
 _CITATION = """
 Not available.
@@ -32,6 +34,11 @@ _HOMEPAGE = "https://browser.mt/data"
 
 _LICENSE = "Unknown"
 
+_BINARY_TAGS = ["OK", "BAD"]
+
+# the word tags of the files are the indices of these severities
+_SEVERITY_TAGS = ["OK", "Minor", "Major", "Critical"]
+
 _LANGUAGE_PAIRS = [
     ("en", "et"),
     ("en", "cs"),
@@ -39,7 +46,7 @@ _LANGUAGE_PAIRS = [
 
 
 class BergamotPtakopetConfig(datasets.BuilderConfig):
-    def __init__(self, src_lang, tgt_lang, use_binary_tags, **kwargs):
+    def __init__(self, src_lang, tgt_lang, use_binary_tags=True, **kwargs):
         super(BergamotPtakopetConfig, self).__init__(**kwargs)
         self.src_lang = src_lang
         self.tgt_lang = tgt_lang
@@ -63,28 +70,15 @@ class BergamotPtakopet(datasets.GeneratorBasedBuilder):
     BUILDER_CONFIG_CLASS = BergamotPtakopetConfig
 
     def _info(self):
-        if self.config.use_binary_tags:
-            features = (
-                datasets.Features(
-                    {
-                        "translation": datasets.Translation(languages=(self.config.src_lang, self.config.tgt_lang)),
-                        "src_tags": datasets.Sequence(datasets.ClassLabel(names=["OK", "BAD"])),
-                        "tgt_tags": datasets.Sequence(datasets.ClassLabel(names=["OK", "BAD"])),
-                        "sent_tag": datasets.Sequence(datasets.ClassLabel(names=["OK", "BAD"])),
-                    }
-                ),
-            )
-        else:
-            features = (
-                datasets.Features(
-                    {
-                        "translation": datasets.Translation(languages=(self.config.src_lang, self.config.tgt_lang)),
-                        "src_tags": datasets.Sequence(datasets.ClassLabel(names=["OK", "Minor", "Major", "Critical"])),
-                        "tgt_tags": datasets.Sequence(datasets.ClassLabel(names=["OK", "Minor", "Major", "Critical"])),
-                        "sent_tag": datasets.Sequence(datasets.ClassLabel(names=["OK", "Minor", "Major", "Critical"])),
-                    }
-                ),
-            )
+        tag_names = _BINARY_TAGS if self.config.use_binary_tags else _SEVERITY_TAGS
+        features = datasets.Features(
+            {
+                "translation": datasets.Translation(languages=(self.config.src_lang, self.config.tgt_lang)),
+                "src_tags": datasets.Sequence(datasets.ClassLabel(names=tag_names)),
+                "tgt_tags": datasets.Sequence(datasets.ClassLabel(names=tag_names)),
+                "sent_tag": datasets.Sequence(datasets.ClassLabel(names=tag_names)),
+            }
+        )
         return datasets.DatasetInfo(
             description=_DESCRIPTION,
             features=features,
@@ -104,25 +98,26 @@ class BergamotPtakopet(datasets.GeneratorBasedBuilder):
                 name=datasets.Split.TEST,
                 gen_kwargs={
                     "src_path": os.path.join(data_dir, "test.src"),
-                    "tgt_path": os.path.join(data_dir, "test.mt"),
-                    "tgt_tags_path": os.path.join(data_dir, "test.word_tags"),
-                    "src_lang": self.config.src_lang,
-                    "tgt_lang": self.config.tgt_lang,
+                    "mt_path": os.path.join(data_dir, "test.mt"),
+                    "mt_tags_path": os.path.join(data_dir, "test.word_tags"),
                 },
             ),
         ]
 
     def _generate_examples(self, src_path, mt_path, mt_tags_path):
-        with open(src_path, encoding="utf-8") as src_file, open(mt_path, encoding="utf-8") as mt_file, open(
-            mt_tags_path, encoding="utf-8"
-        ) as mt_tags_file:
-            for id, (src, mt, mt_tags) in enumerate(zip(src_file, mt_file, mt_tags_file)):
-                raw_mt_tags = mt_tags.strip().split()
-                mt_tags = ["OK" if tag == "0" else "BAD" for tag in raw_mt_tags]
-                src_tokens = src.strip().split()
-                yield id, {
-                    "src": src_tokens,
-                    "tgt": mt.strip().split(),
-                    "src_tags": ["OK"] * len(src_tokens),
-                    "tgt_tags": mt_tags,
-                }
+        index = ParallelLineIndex({"src": src_path, "mt": mt_path, "mt_tags": mt_tags_path})
+        for id, record in index.iter_records():
+            if self.config.use_binary_tags:
+                mt_tags = ["OK" if tag == "0" else "BAD" for tag in record["mt_tags"].split()]
+            else:
+                mt_tags = [_SEVERITY_TAGS[int(tag)] for tag in record["mt_tags"].split()]
+            src_tokens = record["src"].split()
+            yield id, {
+                "translation": {
+                    self.config.src_lang: record["src"].strip(),
+                    self.config.tgt_lang: record["mt"].strip(),
+                },
+                "src_tags": ["OK"] * len(src_tokens),
+                "tgt_tags": mt_tags,
+                "sent_tag": [],
+            }
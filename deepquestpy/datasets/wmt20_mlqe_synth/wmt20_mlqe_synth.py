@@ -5,6 +5,8 @@ import logging
 
 import datasets
 
+from deepquestpy.data.line_index import ParallelLineIndex
+
 
 _CITATION = """
 """
@@ -60,37 +62,48 @@ class WMT20QESynth(datasets.GeneratorBasedBuilder):
         if not self.config.data_dir:
             raise ValueError(f"Must specify the folder where the files are, but got data_dir={self.config.data_dir}")
         data_dir = self.config.data_dir
+
+        def optional_path(path):
+            return path if os.path.exists(path) else None
+
         generators = []
-        generators.append(
-            datasets.SplitGenerator(
-                name=datasets.Split.TRAIN,
-                gen_kwargs={
-                    "source_lg": self.config.src_lg,
-                    "target_lg": self.config.tgt_lg,
-                    "src_path": os.path.join(data_dir, "train", "train.src"),
-                    "tgt_path": os.path.join(data_dir, "train", "train.mt"),
-                    "src_tags_path": os.path.join(data_dir, "train", "train.source_tags"),
-                    "tgt_tags_path": os.path.join(data_dir, "train", "train.tags"),
-                    "hter_path": os.path.join(data_dir, "train", "train.hter"),
-                },
+        for name, split in [
+            (datasets.Split.TRAIN, "train"),
+            (datasets.Split.VALIDATION, "dev"),
+            (datasets.Split.TEST, "test"),
+        ]:
+            if not os.path.exists(os.path.join(data_dir, split, f"{split}.src")):
+                if split == "train":
+                    raise ValueError(f"Could not find the training data in {os.path.join(data_dir, split)}")
+                continue
+            generators.append(
+                datasets.SplitGenerator(
+                    name=name,
+                    gen_kwargs={
+                        "source_lg": self.config.src_lg,
+                        "target_lg": self.config.tgt_lg,
+                        "src_path": os.path.join(data_dir, split, f"{split}.src"),
+                        "tgt_path": os.path.join(data_dir, split, f"{split}.mt"),
+                        # The test data may not have labels
+                        "src_tags_path": optional_path(os.path.join(data_dir, split, f"{split}.source_tags")),
+                        "tgt_tags_path": optional_path(os.path.join(data_dir, split, f"{split}.tags")),
+                        "hter_path": optional_path(os.path.join(data_dir, split, f"{split}.hter")),
+                    },
+                )
             )
-        )
 
         return generators
 
     def _generate_examples(self, source_lg, target_lg, src_path, tgt_path, src_tags_path, tgt_tags_path, hter_path):
         logging.info("Generating examples")
-        with open(src_path, encoding="utf-8") as src_file, open(tgt_path, encoding="utf-8") as mt_file, open(
-            src_tags_path, encoding="utf-8"
-        ) as src_tags_file, open(tgt_tags_path, encoding="utf-8") as mt_tags_file, open(
-            hter_path, encoding="utf-8"
-        ) as hter_file:
-            for id, (src, mt, src_tags, mt_tags, hter) in enumerate(
-                zip(src_file, mt_file, src_tags_file, mt_tags_file, hter_file)
-            ):
-                yield id, {
-                    "translation": {source_lg: src.strip(), target_lg: mt.strip()},
-                    "src_tags": src_tags.strip().split(),
-                    "mt_tags": mt_tags.strip().split(),
-                    "hter": float(hter.strip()),
-                }
+        # The index checks that the files are aligned. The missing label files give None.
+        index = ParallelLineIndex(
+            {"src": src_path, "mt": tgt_path, "src_tags": src_tags_path, "mt_tags": tgt_tags_path, "hter": hter_path}
+        )
+        for id, record in index.iter_records():
+            yield id, {
+                "translation": {source_lg: record["src"].strip(), target_lg: record["mt"].strip()},
+                "src_tags": record["src_tags"].split() if record["src_tags"] is not None else [],
+                "mt_tags": record["mt_tags"].split() if record["mt_tags"] is not None else [],
+                "hter": float(record["hter"]) if record["hter"] is not None else None,
+            }
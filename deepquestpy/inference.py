@@ -0,0 +1,165 @@
+import contextlib
+import itertools
+
+import torch
+
+from deepquestpy.commands.cli_args import DataArguments, ModelArguments
+from deepquestpy.commands.utils import get_deepquest_model
+from deepquestpy.models.adapters import load_adapter, use_adapter
+from deepquestpy.models.base import DeepQuestModelWord
+
+# architecture names of the sentence-level BiRNN models, loaded from AllenNLP archives
+BIRNN_ARCH_NAMES = ["birnn-sent", "birnn"]
+
+
+def batched(iterable, batch_size):
+    """Yields lists of `batch_size` items (the last one may be shorter) from any iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class InferenceEngine:
+    """
+    Minimal predictor for embedding QE in another service: the model of any architecture of `ARCHITECTURE_MAP` and
+    its tokenizer are loaded once, and pairs are predicted in `torch.inference_mode`, without a `Trainer`, Arrow
+    datasets or accumulation of the outputs.
+
+    Sentence-level models give a score per (source, translation) pair, word-level models a dict with the `src_tags`
+    and `mt_tags` of each pair. Extra keyword arguments are passed to `DataArguments` (e.g. `labels_in_gaps=True`).
+    The adapters of `adapter_paths` are loaded on top of the encoder, and each call selects its own with `adapter`.
+    """
+
+    def __init__(
+        self,
+        model_name_or_path,
+        arch_name,
+        src_lang="src",
+        tgt_lang="tgt",
+        batch_size=32,
+        device=None,
+        fp16=False,
+        label_list=None,
+        adapter_paths=None,
+        **data_kwargs,
+    ):
+        model_args = ModelArguments(model_name_or_path=model_name_or_path, arch_name=arch_name)
+        data_args = DataArguments(src_lang=src_lang, tgt_lang=tgt_lang, **data_kwargs)
+        self.deepquest_model = get_deepquest_model(arch_name, model_args, data_args, None)
+        if label_list is not None and isinstance(self.deepquest_model, DeepQuestModelWord):
+            self.deepquest_model.set_label_list(label_list)
+        self.batch_size = batch_size
+        self.device = torch.device(device) if device is not None else None
+        self.model = self.deepquest_model.get_inference_model()
+        for adapter_path in adapter_paths or []:
+            load_adapter(self.model, adapter_path)
+        if self.device is not None:
+            self.model.to(self.device)
+        self.device = next(self.model.parameters()).device
+        if fp16:
+            self.model.half()
+
+    def encode(self, pairs):
+        """Tokenizes and pads a batch of pairs. Can run in another thread than `forward`."""
+        return self.deepquest_model.encode_batch(pairs)
+
+    def forward(self, batch, adapter=None):
+        """Runs the model on an encoded batch and returns the result of each pair."""
+        inputs = {name: tensor.to(self.device, non_blocking=True) for name, tensor in batch["inputs"].items()}
+        with torch.inference_mode(), self._use_adapter(adapter):
+            logits = self.model(**inputs)["logits"]
+        return self.deepquest_model.decode_batch(logits.float().cpu().numpy(), batch)
+
+    def _use_adapter(self, adapter):
+        return use_adapter(self.model, adapter) if adapter is not None else contextlib.nullcontext()
+
+    def predict_batches(self, pairs, adapter=None):
+        """Yields the results of each batch of pairs as soon as it is predicted. `pairs` can be any iterable."""
+        for batch_pairs in batched(pairs, self.batch_size):
+            yield self.forward(self.encode(batch_pairs), adapter=adapter)
+
+    def predict_iter(self, pairs, adapter=None):
+        """Yields the result of each pair, predicting them one batch at a time."""
+        for results in self.predict_batches(pairs, adapter=adapter):
+            yield from results
+
+    def predict(self, pairs, adapter=None):
+        """Returns the results of a list of pairs, with the given adapter of the model if any."""
+        return list(self.predict_iter(pairs, adapter=adapter))
+
+
+class BiRNNInferenceEngine(InferenceEngine):
+    """
+    The same predictor for a sentence-level `BiRNN` model, loaded from its `model.tar.gz` archive or from a
+    directory exported by `deepquestpy export_mmap`.
+    """
+
+    def __init__(self, archive_file, batch_size=32, device=None):
+        from allennlp.common.util import import_module_and_submodules
+
+        from deepquestpy.models.mmap_weights import load_model_archive
+
+        import_module_and_submodules("deepquestpy")
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        cuda_device = (self.device.index or 0) if self.device.type == "cuda" else -1
+        archive = load_model_archive(archive_file, cuda_device=cuda_device)
+        self.model = archive.model
+        self.model.eval()
+        self.reader = archive.dataset_reader
+        if not getattr(self.reader, "sentence_level", True):
+            raise ValueError(f"{archive_file} is a word-level BiRNN model, only sentence-level ones are supported")
+        self.batch_size = batch_size
+
+    def _text_to_instance(self, src, mt):
+        """
+        Builds the inputs of a pair with the tokenizer and token indexers of the reader, which all the BiRNN readers
+        have, whatever the gold labels their `text_to_instance` expects.
+        """
+        from allennlp.data import Instance
+        from allennlp.data.fields import TextField
+
+        tokenizer = self.reader._tokenizer
+        fields = {}
+        for name, text, token_indexers in [
+            ("tokens_src", src, self.reader._token_indexers_src),
+            ("tokens_tgt", mt, self.reader._token_indexers_tgt),
+        ]:
+            tokens = tokenizer.add_special_tokens(tokenizer.tokenize(text.strip()))
+            fields[name] = TextField(tokens, token_indexers=token_indexers)
+        return Instance(fields)
+
+    def encode(self, pairs):
+        from allennlp.data import Batch
+
+        batch = Batch([self._text_to_instance(src, mt) for src, mt in pairs])
+        batch.index_instances(self.model.vocab)
+        return batch.as_tensor_dict()
+
+    def forward(self, batch, adapter=None):
+        from allennlp.nn.util import move_to_device
+
+        if adapter is not None:
+            raise ValueError("BiRNN models have no adapters")
+
+        with torch.inference_mode():
+            return self.model(**move_to_device(batch, self.device))["scores"].view(-1).tolist()
+
+
+def is_birnn_arch(arch_name):
+    return arch_name.lower() in BIRNN_ARCH_NAMES
+
+
+def get_inference_engine(model_name_or_path, arch_name, batch_size=32, device=None, **kwargs):
+    """
+    Returns the predictor of a model: `arch_name` is `birnn-sent` (or `birnn`) for the archive of a sentence-level
+    BiRNN, or any other architecture of `ARCHITECTURE_MAP` for a transformer checkpoint (the other arguments go to
+    `InferenceEngine`).
+    """
+    if is_birnn_arch(arch_name):
+        return BiRNNInferenceEngine(model_name_or_path, batch_size=batch_size, device=device)
+    return InferenceEngine(model_name_or_path, arch_name, batch_size=batch_size, device=device, **kwargs)
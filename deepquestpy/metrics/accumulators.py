@@ -0,0 +1,146 @@
+import numpy as np
+
+
+def _to_flat_array(values, dtype):
+    """Flattens a batch given as an array or as a list of (possibly empty) sequences."""
+    if isinstance(values, np.ndarray):
+        return values.astype(dtype, copy=False).reshape(-1)
+    values = list(values)
+    if values and isinstance(values[0], (list, tuple, np.ndarray)):
+        return np.concatenate([np.asarray(v, dtype=dtype).reshape(-1) for v in values] or [np.zeros(0, dtype)])
+    return np.asarray(values, dtype=dtype).reshape(-1)
+
+
+class MetricAccumulator:
+    """
+    Base class of the streaming metrics. The whole state is a single numpy array of sums, so that accumulators are
+    merged by adding their states, whether they come from other batches, other workers or other processes.
+    """
+
+    def __init__(self, state):
+        self.state = state
+
+    def update(self, references, predictions):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def merge(self, other):
+        if type(other) is not type(self) or other.state.shape != self.state.shape:
+            raise ValueError(f"Cannot merge a {type(other).__name__} into a {type(self).__name__}")
+        self.state = self.state + other.state
+        return self
+
+    def get_state(self):
+        return self.state.copy()
+
+    def load_state(self, state):
+        state = np.asarray(state, dtype=self.state.dtype)
+        if state.shape != self.state.shape:
+            raise ValueError(f"Expected a state of shape {self.state.shape}, got {state.shape}")
+        self.state = state.copy()
+        return self
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class WordTagAccumulator(MetricAccumulator):
+    """
+    Accumulates the confusion matrix of word-level tags (rows are references, columns are predictions) and computes
+    the F1 of each tag and the Matthews correlation coefficient from it. Tags are 0 for BAD and 1 for OK.
+    """
+
+    def __init__(self, num_labels=2):
+        self.num_labels = num_labels
+        super().__init__(np.zeros((num_labels, num_labels), dtype=np.int64))
+
+    def update(self, references, predictions):
+        if len(references) != len(predictions):
+            raise ValueError(f"Got {len(references)} references and {len(predictions)} predictions")
+        for idx, (gold, pred) in enumerate(zip(references, predictions)):
+            if np.ndim(gold) > 0 and len(gold) != len(pred):
+                raise ValueError(f"Numbers of tags don't match in sequence {idx}: {len(gold)} and {len(pred)}")
+        references = _to_flat_array(references, np.int64)
+        predictions = _to_flat_array(predictions, np.int64)
+        self.state += np.bincount(
+            references * self.num_labels + predictions, minlength=self.num_labels ** 2
+        ).reshape(self.num_labels, self.num_labels)
+        return self
+
+    def __len__(self):
+        return int(self.state.sum())
+
+    def result(self):
+        confusion = self.state.astype(np.float64)
+        true_counts, pred_counts = confusion.sum(axis=1), confusion.sum(axis=0)
+        n = confusion.sum()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f1 = np.nan_to_num(2 * np.diag(confusion) / (true_counts + pred_counts))
+        # multiclass MCC, as in sklearn.metrics.matthews_corrcoef
+        covariance = np.trace(confusion) * n - true_counts @ pred_counts
+        variance_true = n ** 2 - true_counts @ true_counts
+        variance_pred = n ** 2 - pred_counts @ pred_counts
+        mcc = covariance / np.sqrt(variance_true * variance_pred) if variance_true * variance_pred > 0 else 0.0
+        return {"f1_good": float(f1[1]), "f1_bad": float(f1[0]), "mcc": float(mcc)}
+
+
+class SentenceScoreAccumulator(MetricAccumulator):
+    """
+    Accumulates the sufficient statistics of Pearson's r, MAE and RMSE between references `x` and predictions `y`:
+    n, Σx, Σy, Σxy, Σx², Σy², Σ|x - y| and Σ(x - y)².
+    """
+
+    FIELDS = ["n", "sum_x", "sum_y", "sum_xy", "sum_xx", "sum_yy", "sum_abs_diff", "sum_sq_diff"]
+
+    def __init__(self):
+        super().__init__(np.zeros(len(self.FIELDS), dtype=np.float64))
+
+    def update(self, references, predictions):
+        x = _to_flat_array(references, np.float64)
+        y = _to_flat_array(predictions, np.float64)
+        if len(x) != len(y):
+            raise ValueError(f"Incorrect number of predicted scores, expecting {len(x)}, given {len(y)}.")
+        diff = x - y
+        self.state += [len(x), x.sum(), y.sum(), x @ y, x @ x, y @ y, np.abs(diff).sum(), diff @ diff]
+        return self
+
+    def __len__(self):
+        return int(self.state[0])
+
+    def result(self):
+        n, sum_x, sum_y, sum_xy, sum_xx, sum_yy, sum_abs_diff, sum_sq_diff = self.state
+        if n == 0:
+            return {"pearson": float("nan"), "mae": float("nan"), "rmse": float("nan")}
+        covariance = sum_xy - sum_x * sum_y / n
+        variance_x = max(sum_xx - sum_x ** 2 / n, 0.0)
+        variance_y = max(sum_yy - sum_y ** 2 / n, 0.0)
+        pearson = covariance / np.sqrt(variance_x * variance_y) if variance_x * variance_y > 0 else float("nan")
+        return {
+            "pearson": float(np.clip(pearson, -1.0, 1.0)),
+            "mae": float(sum_abs_diff / n),
+            "rmse": float(np.sqrt(sum_sq_diff / n)),
+        }
+
+
+def merge_accumulators(accumulators):
+    """Merges a non-empty list of accumulators of the same type into the first one."""
+    merged = accumulators[0]
+    for accumulator in accumulators[1:]:
+        merged.merge(accumulator)
+    return merged
+
+
+def compute_accumulated_metrics(accumulators):
+    """
+    Returns the metrics of a dict of accumulators, prefixing the names of the metrics with the key of their
+    accumulator (e.g. `tgt_mcc`). Accumulators that have not seen any example are skipped.
+    """
+    metrics = {}
+    for prefix, accumulator in accumulators.items():
+        if len(accumulator) == 0:
+            continue
+        for name, value in accumulator.result().items():
+            metrics[f"{prefix}_{name}" if prefix else name] = value
+    return metrics
@@ -0,0 +1,212 @@
+import numpy as np
+
+STATISTICS = ["pearson", "spearman", "kendall", "mae", "rmse"]
+
+
+def _tie_groups(values):
+    """Returns the tie group of each value, numbered in increasing order of the values."""
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    groups = np.empty(len(values), dtype=np.int64)
+    groups[order] = np.concatenate([[0], np.cumsum(sorted_values[1:] != sorted_values[:-1])])
+    return groups
+
+
+def _weighted_midranks(counts, groups):
+    """
+    Returns the midranks of the examples in each resample, given as the number of times `counts[b, i]` that the
+    (sorted) example `i` appears in resample `b`. Tied examples share the average of the ranks of their group.
+    """
+    group_starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+    group_counts = np.add.reduceat(counts, group_starts, axis=1)
+    ranks_before = np.cumsum(group_counts, axis=1) - group_counts
+    return (ranks_before + (group_counts + 1) / 2)[:, groups]
+
+
+def _weighted_pearson(counts, x, y):
+    """Pearson's r between `x` and `y` in each resample, where `x` and `y` are vectors or per-resample matrices."""
+    n = counts.sum(axis=1)
+    sum_x, sum_y = (counts * x).sum(axis=1), (counts * y).sum(axis=1)
+    covariance = (counts * x * y).sum(axis=1) - sum_x * sum_y / n
+    variance_x = (counts * x * x).sum(axis=1) - sum_x ** 2 / n
+    variance_y = (counts * y * y).sum(axis=1) - sum_y ** 2 / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.clip(covariance / np.sqrt(variance_x * variance_y), -1.0, 1.0)
+
+
+def compute_statistics(references, predictions, statistics=STATISTICS):
+    """Point estimates of the correlations and errors between gold and predicted sentence scores."""
+    x = np.asarray(references, dtype=np.float64)
+    y = np.asarray(predictions, dtype=np.float64)
+    return dict(zip(statistics, _resample_statistics(np.ones((1, len(x))), x, y, statistics)[:, 0]))
+
+
+def _resample_statistics(counts, x, y, statistics, x_groups=None, y_groups=None):
+    """Returns a `(len(statistics), num_resamples)` array with the statistics of each resample."""
+    n = counts.sum(axis=1)
+    results = []
+    for statistic in statistics:
+        if statistic == "pearson":
+            results.append(_weighted_pearson(counts, x, y))
+        elif statistic == "spearman":
+            if x_groups is None:
+                x_groups, y_groups = _tie_groups(x), _tie_groups(y)
+            results.append(_weighted_pearson(counts, *_ranks_of_resamples(counts, x_groups, y_groups)))
+        elif statistic == "kendall":
+            if x_groups is None:
+                x_groups, y_groups = _tie_groups(x), _tie_groups(y)
+            results.append(_weighted_kendall(counts, x_groups, y_groups))
+        elif statistic == "mae":
+            results.append((counts * np.abs(x - y)).sum(axis=1) / n)
+        elif statistic == "rmse":
+            results.append(np.sqrt((counts * (x - y) ** 2).sum(axis=1) / n))
+        else:
+            raise ValueError(f"Unknown statistic {statistic}, expected one of {STATISTICS}")
+    return np.stack(results)
+
+
+def _ranks_of_resamples(counts, x_groups, y_groups):
+    """Midranks of `x` and `y` within each resample, aligned with the original order of the examples."""
+    x_order = np.argsort(x_groups, kind="stable")
+    y_order = np.argsort(y_groups, kind="stable")
+    x_ranks = np.empty_like(counts, dtype=np.float64)
+    y_ranks = np.empty_like(counts, dtype=np.float64)
+    x_ranks[:, x_order] = _weighted_midranks(counts[:, x_order], x_groups[x_order])
+    y_ranks[:, y_order] = _weighted_midranks(counts[:, y_order], y_groups[y_order])
+    return x_ranks, y_ranks
+
+
+def _sum_of_squared_group_counts(counts, is_group_start):
+    """Sum over the groups of the squared number of examples of the group, in each resample."""
+    group_counts = np.add.reduceat(counts, np.flatnonzero(is_group_start), axis=1, dtype=np.float64)
+    return (group_counts ** 2).sum(axis=1)
+
+
+def _weighted_kendall(counts, x_groups, y_groups):
+    """
+    Kendall's tau-b in each resample, for a batch of resamples at once. The examples are sorted by x (then y), and the
+    sum of `sign(y_j - y_i)` over the pairs `i < j` is counted bottom-up as in a merge sort: at each level, every
+    example of a right block is compared with the left block next to it, through the prefix sums of the counts of the
+    left block sorted by y. The orders only depend on the data, so each level costs a few `(resamples, examples)`
+    matrix operations, on integer counts to halve their memory.
+    """
+    order = np.lexsort((y_groups, x_groups))
+    x_groups, y_groups = x_groups[order], y_groups[order]
+    counts = counts[:, order].astype(np.int32)
+    n = len(x_groups)
+    score = np.zeros(len(counts))
+    # the examples sorted by y within each block of the current level
+    by_y = np.arange(n)
+    size = 1
+    while size < n:
+        by_y = by_y[np.lexsort((y_groups[by_y], by_y // (2 * size)))]
+        pair_ids = by_y // (2 * size)
+        is_right = (by_y // size) % 2 == 1
+        left, right = by_y[~is_right], by_y[is_right]
+        # the y groups are < n, so the keys sort by block, then by y
+        left_keys = pair_ids[~is_right] * n + y_groups[left]
+        right_pairs = pair_ids[is_right]
+        right_keys = right_pairs * n + y_groups[right]
+        prefix = np.zeros((len(counts), len(left) + 1), dtype=np.int32)
+        np.cumsum(counts[:, left], axis=1, out=prefix[:, 1:])
+        # counts of the left examples below y_j minus those above it: (below - start) - (end - above)
+        balance = prefix[:, np.searchsorted(left_keys, right_keys, "left")]
+        balance += prefix[:, np.searchsorted(left_keys, right_keys, "right")]
+        right_counts = counts[:, right]
+        score += np.einsum("bj,bj->b", right_counts, balance, dtype=np.float64)
+        # the start and end of a left block are the same for all the right examples of the pair
+        pairs, first = np.unique(right_pairs, return_index=True)
+        bounds = prefix[:, np.searchsorted(left_keys, pairs * n, "left")]
+        bounds += prefix[:, np.searchsorted(left_keys, (pairs + 1) * n, "left")]
+        score -= np.einsum("bj,bj->b", np.add.reduceat(right_counts, first, axis=1, dtype=np.float64), bounds)
+        size *= 2
+
+    # the pairs tied in x were counted as concordant when their y differ
+    new_x = np.concatenate([[True], x_groups[1:] != x_groups[:-1]])
+    new_xy = new_x | np.concatenate([[True], y_groups[1:] != y_groups[:-1]])
+    x_ties = _sum_of_squared_group_counts(counts, new_x)
+    score -= (x_ties - _sum_of_squared_group_counts(counts, new_xy)) / 2
+    y_order = np.argsort(y_groups, kind="stable")
+    y_ties = _sum_of_squared_group_counts(
+        counts[:, y_order], np.concatenate([[True], np.diff(y_groups[y_order]) != 0])
+    )
+
+    n = counts.sum(axis=1, dtype=np.float64)
+    # number of pairs not tied in x (or y): (n^2 - sum of t^2) / 2 over the tie groups
+    untied_x = (n * n - x_ties) / 2
+    untied_y = (n * n - y_ties) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.clip(score / np.sqrt(untied_x * untied_y), -1.0, 1.0)
+
+
+def get_resamples_per_batch(num_examples, max_memory):
+    """Number of resamples processed at once so that a `(resamples, examples)` float64 matrix fits in `max_memory`."""
+    # the midranks of spearman need a few matrices of that size at the same time
+    return max(1, int(max_memory // (8 * 6 * max(num_examples, 1))))
+
+
+def bootstrap_statistics(
+    references,
+    predictions,
+    num_resamples=1000,
+    confidence_level=0.95,
+    statistics=STATISTICS,
+    seed=None,
+    max_memory=2 ** 30,
+):
+    """
+    Computes the statistics on the whole data and their percentile bootstrap confidence intervals.
+
+    Each resample is drawn as the number of times each example is picked (a multinomial draw), so the statistics of a
+    batch of resamples are computed at once with matrix operations, without copying the data. At most `max_memory`
+    bytes are used by the matrices of a batch.
+    """
+    x = np.asarray(references, dtype=np.float64)
+    y = np.asarray(predictions, dtype=np.float64)
+    if len(x) != len(y):
+        raise ValueError(f"Incorrect number of predicted scores, expecting {len(x)}, given {len(y)}.")
+    n = len(x)
+    rng = np.random.default_rng(seed)
+
+    x_groups, y_groups = _tie_groups(x), _tie_groups(y)
+
+    resamples_per_batch = get_resamples_per_batch(n, max_memory)
+    resampled = []
+    for start in range(0, num_resamples, resamples_per_batch):
+        batch_size = min(resamples_per_batch, num_resamples - start)
+        counts = rng.multinomial(n, np.full(n, 1.0 / n), size=batch_size).astype(np.float64)
+        resampled.append(_resample_statistics(counts, x, y, statistics, x_groups, y_groups))
+    resampled = np.concatenate(resampled, axis=1)
+
+    point = compute_statistics(x, y, statistics)
+    alpha = 100 * (1 - confidence_level) / 2
+    low, high = np.nanpercentile(resampled, [alpha, 100 - alpha], axis=1)
+    results = {}
+    for i, statistic in enumerate(statistics):
+        results[statistic] = float(point[statistic])
+        results[f"{statistic}_ci_low"] = float(low[i])
+        results[f"{statistic}_ci_high"] = float(high[i])
+    return results
+
+
+
+def compute_global_statistics(
+    references, predictions, bootstrap_resamples=0, confidence_level=0.95, seed=None, max_memory=2 ** 30
+):
+    """
+    Computes the statistics that need all the scores at once, unlike those of `SentenceScoreAccumulator`: the rank
+    correlations, and with `bootstrap_resamples > 0` the confidence intervals of all the statistics.
+    """
+    results = compute_statistics(references, predictions, statistics=["spearman", "kendall"])
+    if bootstrap_resamples > 0:
+        results.update(
+            bootstrap_statistics(
+                references,
+                predictions,
+                num_resamples=bootstrap_resamples,
+                confidence_level=confidence_level,
+                seed=seed,
+                max_memory=max_memory,
+            )
+        )
+    return results
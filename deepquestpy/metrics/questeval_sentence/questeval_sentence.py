@@ -1,9 +1,7 @@
-import numpy as np
-
 import datasets
 
-from sklearn.metrics import f1_score, matthews_corrcoef
-from scipy.stats import pearsonr
+from deepquestpy.metrics.accumulators import SentenceScoreAccumulator
+from deepquestpy.metrics.bootstrap import compute_global_statistics
 
 _CITATION = """
 """
@@ -45,15 +43,22 @@ class QuEstEvalSentence(datasets.Metric):
             ),
         )
 
-    def _compute(self, predictions, references):
+    def _compute(
+        self, predictions, references, bootstrap_resamples=0, confidence_level=0.95, seed=None, max_memory=2 ** 30
+    ):
         assert len(references) == len(
             predictions
         ), f"Incorrect number of predicted scores, expecting {len(references)}, given {len(predictions)}."
 
-        pearson = pearsonr(references, predictions)[0]
-        diff = np.subtract(references, predictions)
-        mae = np.abs(diff).mean()
-        rmse = (diff ** 2).mean() ** 0.5
-
-        scores = {"pearson": pearson, "mae": mae, "rmse": rmse}
+        scores = SentenceScoreAccumulator().update(references, predictions).result()
+        scores.update(
+            compute_global_statistics(
+                references,
+                predictions,
+                bootstrap_resamples=bootstrap_resamples,
+                confidence_level=confidence_level,
+                seed=seed,
+                max_memory=max_memory,
+            )
+        )
         return scores
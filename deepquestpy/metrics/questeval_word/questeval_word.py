@@ -1,9 +1,7 @@
-import numpy as np
-
-from sklearn.metrics import f1_score, matthews_corrcoef
-
 import datasets
 
+from deepquestpy.metrics.accumulators import WordTagAccumulator
+
 _CITATION = """
 """
 
@@ -32,44 +30,9 @@ Examples:
 """
 
 
-def list_of_lists(a_list):
-    """
-        check if <a_list> is a list of lists
-        """
-    if (
-        isinstance(a_list, (list, tuple, np.ndarray))
-        and len(a_list) > 0
-        and all([isinstance(l, (list, tuple, np.ndarray)) for l in a_list])
-    ):
-        return True
-    return False
-
-
-def flatten(lofl):
-    """
-    convert list of lists into a flat list
-    """
-    if list_of_lists(lofl):
-        return [item for sublist in lofl for item in sublist]
-    elif type(lofl) == dict:
-        return lofl.values()
-
-
 def compute_scores(references, predictions):
-    # Verify that there's the same number of tags for each instance
-    for idx, (gold, pred) in enumerate(zip(references, predictions)):
-        assert len(gold) == len(pred), f"Numbers of tags don't match in sequence {idx}: {len(gold)} and {len(pred)}"
-
-    flat_references = flatten(references)
-    flat_predictions = flatten(predictions)
-
     # {0: 'BAD', 1: 'OK'}
-    f1_bad, f1_good = f1_score(flat_references, flat_predictions, average=None, pos_label=None)
-    mcc = matthews_corrcoef(flat_references, flat_predictions)
-
-    scores = {"f1_good": f1_good, "f1_bad": f1_bad, "mcc": mcc}
-
-    return scores
+    return WordTagAccumulator().update(references, predictions).result()
 
 
 # @datasets.utils.file_utils.add_start_docstrings(_DESCRIPTION, _KWARGS_DESCRIPTION)
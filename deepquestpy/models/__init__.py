@@ -1,3 +1,5 @@
 from deepquestpy.models.transformer_sent import *
+from deepquestpy.models.transformer_sent_early_exit import *
+from deepquestpy.models.transformer_siamese_sent import *
 from deepquestpy.models.transformer_word import *
 from deepquestpy.models.beringlab_word import *
@@ -0,0 +1,195 @@
+import contextlib
+import contextvars
+import copy
+import json
+import os
+
+import torch
+import torch.nn as nn
+
+ADAPTER_CONFIG_NAME = "adapter_config.json"
+ADAPTER_WEIGHTS_NAME = "adapter_model.bin"
+
+# adapters selected for the forward passes of the current thread (or asyncio task), by id of the model
+_call_adapters = contextvars.ContextVar("qe_adapters", default={})
+
+
+class BottleneckAdapter(nn.Module):
+    """
+    Bottleneck adapter [0] applied to the output of the feed-forward block of a transformer layer.
+    [0] https://arxiv.org/abs/1902.00751
+    """
+
+    def __init__(self, hidden_size, adapter_size):
+        super().__init__()
+        self.down_proj = nn.Linear(hidden_size, adapter_size)
+        self.activation = nn.GELU()
+        self.up_proj = nn.Linear(adapter_size, hidden_size)
+        # Start from the identity function so that adding an adapter does not change the pretrained encoder
+        nn.init.zeros_(self.up_proj.weight)
+        nn.init.zeros_(self.up_proj.bias)
+
+    def forward(self, hidden_states):
+        return hidden_states + self.up_proj(self.activation(self.down_proj(hidden_states)))
+
+
+def _get_encoder_layers(model):
+    return model.base_model.encoder.layer
+
+
+def _get_head_names(model):
+    # Everything outside of the encoder (e.g. `classifier`) is considered part of the prediction head
+    excluded = [model.base_model_prefix, "qe_adapters", "qe_adapter_heads"]
+    return [name for name, _ in model.named_children() if name not in excluded]
+
+
+def get_active_adapter(model):
+    """The adapter used by a forward pass: the one selected by `use_adapter` for the current call, or the default."""
+    return _call_adapters.get().get(id(model), model.active_qe_adapter)
+
+
+def _make_adapter_hook(model, layer_idx):
+    def hook(module, inputs, output):
+        adapter_name = get_active_adapter(model)
+        if adapter_name is None:
+            return output
+        return model.qe_adapters[adapter_name][layer_idx](output)
+
+    return hook
+
+
+def _route_head_to_adapters(model, head, head_name):
+    # the forward of the head is replaced on the instance (its weights and their names stay the same), so that the
+    # calls are routed to the head of the active adapter instead of running the original head as well
+    forward = head.forward
+
+    def route(*args, **kwargs):
+        adapter_name = get_active_adapter(model)
+        if adapter_name is None:
+            return forward(*args, **kwargs)
+        return model.qe_adapter_heads[adapter_name][head_name](*args, **kwargs)
+
+    head.forward = route
+
+
+def _copy_head(head):
+    head = copy.deepcopy(head)
+    # the copy would otherwise route its own calls to the heads of the adapters
+    del head.forward
+    return head
+
+
+def _install_adapter_hooks(model):
+    if hasattr(model, "qe_adapters"):
+        return
+    head_names = _get_head_names(model)
+    model.qe_adapters = nn.ModuleDict()
+    model.qe_adapter_heads = nn.ModuleDict()
+    model.active_qe_adapter = None
+    for layer_idx, layer in enumerate(_get_encoder_layers(model)):
+        layer.output.dense.register_forward_hook(_make_adapter_hook(model, layer_idx))
+    for head_name in head_names:
+        _route_head_to_adapters(model, getattr(model, head_name), head_name)
+
+
+def add_adapter(model, adapter_name, adapter_size=64):
+    """
+    Adds a new adapter (one bottleneck per encoder layer plus a copy of the prediction head) to a model and makes it
+    the active one. The weights of the pretrained encoder are shared by all the adapters of the model.
+    """
+    _install_adapter_hooks(model)
+    if adapter_name in model.qe_adapters:
+        raise ValueError(f"An adapter named {adapter_name} has already been added to the model.")
+    hidden_size = model.config.hidden_size
+    adapters = nn.ModuleList(
+        [BottleneckAdapter(hidden_size, adapter_size) for _ in range(len(_get_encoder_layers(model)))]
+    )
+    heads = nn.ModuleDict({name: _copy_head(getattr(model, name)) for name in _get_head_names(model)})
+    device = next(model.parameters()).device
+    model.qe_adapters[adapter_name] = adapters.to(device)
+    model.qe_adapter_heads[adapter_name] = heads.to(device)
+    model.qe_adapters[adapter_name].adapter_size = adapter_size
+    set_active_adapter(model, adapter_name)
+
+
+def _check_adapter(model, adapter_name):
+    if not hasattr(model, "qe_adapters") or adapter_name not in model.qe_adapters:
+        raise ValueError(f"The model does not have an adapter named {adapter_name}.")
+
+
+def set_active_adapter(model, adapter_name):
+    """Selects the adapter (and its prediction head) used by default in the forward pass."""
+    _check_adapter(model, adapter_name)
+    model.active_qe_adapter = adapter_name
+
+
+@contextlib.contextmanager
+def use_adapter(model, adapter_name):
+    """
+    Selects the adapter of a model for the forward passes run by the current thread (or asyncio task) within the
+    block, without changing the model, so that concurrent callers sharing it can each use their own language pair.
+    """
+    _check_adapter(model, adapter_name)
+    token = _call_adapters.set({**_call_adapters.get(), id(model): adapter_name})
+    try:
+        yield
+    finally:
+        _call_adapters.reset(token)
+
+
+def freeze_model_except_adapter(model, adapter_name):
+    """Freezes all the weights of the model, except for those of the adapter and its prediction head."""
+    for param in model.parameters():
+        param.requires_grad = False
+    for param in model.qe_adapters[adapter_name].parameters():
+        param.requires_grad = True
+    for param in model.qe_adapter_heads[adapter_name].parameters():
+        param.requires_grad = True
+
+
+def save_adapter(model, adapter_name, save_directory):
+    """Saves only the weights of an adapter and its prediction head."""
+    os.makedirs(save_directory, exist_ok=True)
+    state_dict = {
+        "adapters": model.qe_adapters[adapter_name].state_dict(),
+        "heads": model.qe_adapter_heads[adapter_name].state_dict(),
+    }
+    torch.save(state_dict, os.path.join(save_directory, ADAPTER_WEIGHTS_NAME))
+    adapter_config = {
+        "adapter_name": adapter_name,
+        "adapter_size": model.qe_adapters[adapter_name].adapter_size,
+        "base_model": model.config._name_or_path,
+        "num_layers": len(_get_encoder_layers(model)),
+    }
+    with open(os.path.join(save_directory, ADAPTER_CONFIG_NAME), "w") as writer:
+        json.dump(adapter_config, writer, indent=2)
+
+
+def load_adapter(model, load_directory, adapter_name=None):
+    """Loads an adapter saved with `save_adapter` on top of a model, and returns its name."""
+    with open(os.path.join(load_directory, ADAPTER_CONFIG_NAME)) as reader:
+        adapter_config = json.load(reader)
+    if adapter_config["num_layers"] != len(_get_encoder_layers(model)):
+        raise ValueError(
+            f"The adapter in {load_directory} was trained for a model with {adapter_config['num_layers']} layers, "
+            f"but the model has {len(_get_encoder_layers(model))} layers."
+        )
+    adapter_name = adapter_name if adapter_name else adapter_config["adapter_name"]
+    add_adapter(model, adapter_name, adapter_config["adapter_size"])
+    state_dict = torch.load(os.path.join(load_directory, ADAPTER_WEIGHTS_NAME), map_location="cpu")
+    model.qe_adapters[adapter_name].load_state_dict(state_dict["adapters"])
+    model.qe_adapter_heads[adapter_name].load_state_dict(state_dict["heads"])
+    return adapter_name
+
+
+def setup_adapters(model, model_args, adapter_name):
+    """Loads, adds and activates the adapters requested through the command line arguments."""
+    if model_args.adapter_paths:
+        for adapter_path in model_args.adapter_paths.split(","):
+            load_adapter(model, adapter_path.strip())
+    if model_args.train_adapter:
+        add_adapter(model, adapter_name, model_args.adapter_size)
+        freeze_model_except_adapter(model, adapter_name)
+    elif model_args.adapter_paths:
+        set_active_adapter(model, adapter_name)
+    return model
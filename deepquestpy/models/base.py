@@ -1,10 +1,52 @@
+import contextlib
+import threading
+
+import torch
+
+from deepquestpy.models.adapters import use_adapter
+
+
 class DeepQuestModel:
     def __init__(self) -> None:
-        return
+        # guards the lazy loading of the inference model and the (not thread-safe) fast tokenizers
+        self._inference_lock = threading.Lock()
+        self._tokenizer_lock = threading.Lock()
+        self._inference_model = None
 
-    def predict(self):
+    def get_inference_model(self):
+        """Loads the model once, in evaluation mode, on the GPU if there is one. Safe to call from several threads."""
+        with self._inference_lock:
+            if self._inference_model is None:
+                device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                self._inference_model = self.get_model().to(device).eval()
+        return self._inference_model
+
+    def encode_batch(self, pairs):
+        """Tokenizes (source, translation) pairs into model inputs, plus the metadata needed to decode them."""
+        raise NotImplementedError()
+
+    def decode_batch(self, logits, batch):
+        """Turns the logits of an encoded batch into one result per pair."""
         raise NotImplementedError()
 
+    def predict(self, pairs, batch_size=32, model=None, adapter=None):
+        """
+        Predicts a list of (source, translation) pairs, with the given adapter of the model if any. Everything
+        specific to a call travels with its batches, so one instance (and its loaded model) can serve concurrent
+        callers, including for different language pairs.
+        """
+        model = model if model is not None else self.get_inference_model()
+        device = next(model.parameters()).device
+        results = []
+        with use_adapter(model, adapter) if adapter is not None else contextlib.nullcontext():
+            for start in range(0, len(pairs), batch_size):
+                batch = self.encode_batch(pairs[start : start + batch_size])
+                inputs = {name: tensor.to(device) for name, tensor in batch["inputs"].items()}
+                with torch.no_grad():
+                    logits = model(**inputs)["logits"]
+                results.extend(self.decode_batch(logits.float().cpu().numpy(), batch))
+        return results
+
     def postprocess_predictions(self, predictions=None, labels=None):
         raise NotImplementedError()
 
@@ -14,7 +56,7 @@ class DeepQuestModel:
 
 class DeepQuestModelWord(DeepQuestModel):
     def __init__(self):
-        return
+        super().__init__()
 
     def save_output(self, output_file_path, predictions):
         with open(f"{output_file_path}.src.preds", "w") as writer:
@@ -28,7 +70,7 @@ class DeepQuestModelWord(DeepQuestModel):
 
 class DeepQuestModelSent(DeepQuestModel):
     def __init__(self):
-        return
+        super().__init__()
 
     def save_output(self, output_file_path, predictions):
         with open(f"{output_file_path}.preds", "w") as writer:
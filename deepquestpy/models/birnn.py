@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Any, Dict, List
 import torch
 
 from allennlp.data import TextFieldTensors, Vocabulary
@@ -8,6 +8,8 @@ from allennlp.modules.attention import DotProductAttention
 from allennlp.nn.util import get_text_field_mask, weighted_sum
 from allennlp.training.metrics import PearsonCorrelation
 
+from deepquestpy.models.embedding_store import EmbeddingStore, embed_text_field
+
 @Model.register("birnn")
 class BiRNN(Model):
     """
@@ -28,12 +30,15 @@ class BiRNN(Model):
         kd_with_gold_data: bool = False,
         alpha: float = None,
         label_namespace: str = "labels",
+        embedding_store_dir: str = None,
         **kwargs,
     ) -> None:
 
         super().__init__(vocab, **kwargs)
         self._text_field_embedder_src = text_field_embedder_src
         self._text_field_embedder_tgt = text_field_embedder_tgt
+        # precomputed embeddings, read instead of running the embedders (needs a reader with instance metadata)
+        self._embedding_store = EmbeddingStore(embedding_store_dir) if embedding_store_dir else None
         self.seq2seq_encoder_src = seq2seq_encoder_src
         self.seq2seq_encoder_tgt = seq2seq_encoder_tgt
         self.attention = attention
@@ -62,34 +67,54 @@ class BiRNN(Model):
         self._pearson = PearsonCorrelation()
         self._loss = torch.nn.MSELoss()
 
-    def forward(self, tokens_src: TextFieldTensors, tokens_tgt: TextFieldTensors, labels: torch.FloatTensor = None, t_pred: torch.FloatTensor = None
-    ) -> Dict[str, torch.Tensor]:
-
-        embedded_text_src = self._text_field_embedder_src(tokens_src)
-        embedded_text_tgt = self._text_field_embedder_tgt(tokens_tgt)
-
+    def encode_source(self, tokens_src: TextFieldTensors, metadata: List[Dict[str, Any]] = None) -> torch.Tensor:
+        """
+        Encodes the source sentences into one vector each. The source side is independent of the MT side until the
+        final layer, so the result can be reused to score several translations of the same source.
+        """
+        embedded_text_src = embed_text_field(self._text_field_embedder_src, tokens_src, "src", self._embedding_store, metadata)
         mask_src = get_text_field_mask(tokens_src)
-        mask_tgt = get_text_field_mask(tokens_tgt)
-
         encoded_text_src = self.seq2seq_encoder_src(embedded_text_src, mask=mask_src)
-        encoded_text_tgt = self.seq2seq_encoder_tgt(embedded_text_tgt, mask=mask_tgt)
-
         if self._dropout:
             encoded_text_src = self._dropout(encoded_text_src)
-            encoded_text_tgt = self._dropout(encoded_text_tgt)
-
         encoded_text_src = self._linear_layer_src(encoded_text_src)
-        encoded_text_tgt = self._linear_layer_tgt(encoded_text_tgt)
-
         attention_dist_src = self.attention(self.context_weights_src.expand(encoded_text_src.size()[0],-1),encoded_text_src)
-        encoded_text_src = weighted_sum(encoded_text_src, attention_dist_src)
+        return weighted_sum(encoded_text_src, attention_dist_src)
 
+    def encode_target(self, tokens_tgt: TextFieldTensors, metadata: List[Dict[str, Any]] = None) -> torch.Tensor:
+        """Encodes the MT sentences into one vector each."""
+        embedded_text_tgt = embed_text_field(self._text_field_embedder_tgt, tokens_tgt, "tgt", self._embedding_store, metadata)
+        mask_tgt = get_text_field_mask(tokens_tgt)
+        encoded_text_tgt = self.seq2seq_encoder_tgt(embedded_text_tgt, mask=mask_tgt)
+        if self._dropout:
+            encoded_text_tgt = self._dropout(encoded_text_tgt)
+        encoded_text_tgt = self._linear_layer_tgt(encoded_text_tgt)
         attention_dist_tgt = self.attention(self.context_weights_tgt.expand(encoded_text_tgt.size()[0], -1),encoded_text_tgt)
-        encoded_text_tgt = weighted_sum(encoded_text_tgt, attention_dist_tgt)
+        return weighted_sum(encoded_text_tgt, attention_dist_tgt)
 
+    def score_encodings(self, encoded_text_src: torch.Tensor, encoded_text_tgt: torch.Tensor) -> torch.Tensor:
         encoded_text = torch.cat([encoded_text_src,encoded_text_tgt],dim=-1)
-        scores = torch.sigmoid(self._linear_layer(encoded_text).squeeze())
-        
+        return torch.sigmoid(self._linear_layer(encoded_text).squeeze(-1))
+
+    def score_nbest(self, tokens_src: TextFieldTensors, tokens_tgt: TextFieldTensors, encoded_text_src: torch.Tensor = None) -> torch.Tensor:
+        """
+        Scores a batch of candidate translations of a single source sentence (`tokens_src` has a batch size of 1).
+        The source is encoded once and broadcast over the candidates. Pass the `encoded_text_src` returned by
+        `encode_source` to reuse it for the following batches of candidates of the same source.
+        """
+        if encoded_text_src is None:
+            encoded_text_src = self.encode_source(tokens_src)
+        encoded_text_tgt = self.encode_target(tokens_tgt)
+        return self.score_encodings(encoded_text_src.expand(encoded_text_tgt.size(0), -1), encoded_text_tgt)
+
+    def forward(self, tokens_src: TextFieldTensors, tokens_tgt: TextFieldTensors, labels: torch.FloatTensor = None, t_pred: torch.FloatTensor = None,
+                metadata: List[Dict[str, Any]] = None
+    ) -> Dict[str, torch.Tensor]:
+
+        encoded_text_src = self.encode_source(tokens_src, metadata)
+        encoded_text_tgt = self.encode_target(tokens_tgt, metadata)
+        scores = self.score_encodings(encoded_text_src, encoded_text_tgt)
+
         output_dict = {"scores": scores}
 
         # The changes for adding knowledge distillation are included here.
@@ -136,3 +161,8 @@ class BiRNN(Model):
     def get_metrics(self, reset: bool = False) -> Dict[str, float]:
         metrics = {"pearson": self._pearson.get_metric(reset)}
         return metrics
+
+    def compute_metrics(self, scores: torch.Tensor, labels: torch.Tensor) -> Dict[str, float]:
+        """Returns the metrics of `get_metrics` for scores predicted outside of this model, e.g. by forked workers."""
+        self._pearson(scores, labels)
+        return self.get_metrics(reset=True)
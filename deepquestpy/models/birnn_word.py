@@ -1,5 +1,5 @@
 import torch
-from typing import Dict
+from typing import Any, Dict, List
 
 from allennlp.data import TextFieldTensors, Vocabulary
 from allennlp.models.model import Model
@@ -7,6 +7,8 @@ from allennlp.modules import Seq2SeqEncoder, TextFieldEmbedder
 from allennlp.nn.util import get_text_field_mask, sequence_cross_entropy_with_logits
 from allennlp.training.metrics import FBetaMeasure
 
+from deepquestpy.models.embedding_store import EmbeddingStore, embed_text_field
+
 
 @Model.register("birnn_word")
 class BiRNNWord(Model):
@@ -22,12 +24,15 @@ class BiRNNWord(Model):
         seq2seq_encoder_tgt: Seq2SeqEncoder,
         dropout: float = None,
         tag_label_namespace: str = "tag_labels",
+        embedding_store_dir: str = None,
         **kwargs,
     ) -> None:
 
         super().__init__(vocab, **kwargs)
         self._text_field_embedder_src = text_field_embedder_src
         self._text_field_embedder_tgt = text_field_embedder_tgt
+        # precomputed embeddings, read instead of running the embedders (needs a reader with instance metadata)
+        self._embedding_store = EmbeddingStore(embedding_store_dir) if embedding_store_dir else None
         self.seq2seq_encoder_src = seq2seq_encoder_src
         self.seq2seq_encoder_tgt = seq2seq_encoder_tgt
 
@@ -59,11 +64,11 @@ class BiRNNWord(Model):
     def forward(
         self, tokens_src: TextFieldTensors, tokens_tgt: TextFieldTensors,
             tags_src: torch.LongTensor=None, tags_tgt: torch.LongTensor=None,
-            sent_label: torch.FloatTensor = None
+            sent_label: torch.FloatTensor = None, metadata: List[Dict[str, Any]] = None
     ) -> Dict[str, torch.Tensor]:
 
-        embedded_text_src = self._text_field_embedder_src(tokens_src)
-        embedded_text_tgt = self._text_field_embedder_tgt(tokens_tgt)
+        embedded_text_src = embed_text_field(self._text_field_embedder_src, tokens_src, "src", self._embedding_store, metadata)
+        embedded_text_tgt = embed_text_field(self._text_field_embedder_tgt, tokens_tgt, "tgt", self._embedding_store, metadata)
 
         mask_src = get_text_field_mask(tokens_src)
         mask_tgt = get_text_field_mask(tokens_tgt)
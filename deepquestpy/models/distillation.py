@@ -0,0 +1,234 @@
+import dataclasses
+import inspect
+import logging
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import DataCollatorWithPadding, Trainer
+
+from deepquestpy.data.array_store import RaggedArrayStore, RaggedArrayWriter
+from deepquestpy.data.tokenized_cache import get_dataset_fingerprint
+from deepquestpy.models.base import DeepQuestModelWord
+
+logger = logging.getLogger(__name__)
+
+TEACHER_COLUMN = "teacher_positions"
+
+
+def get_word_positions(word_ids, length_source):
+    """
+    Maps each token to the index of its word in the concatenation of the source and target words, or -1 for
+    special tokens and for the tokens that are not the first one of their word.
+    """
+    positions = []
+    offset = 0
+    previous_word_idx = None
+    count_special = 0
+    for word_idx in word_ids:
+        if word_idx is None:
+            positions.append(-1)
+            count_special += 1
+            if count_special == 3:  # two from start and end of src, and one from start of tgt
+                offset = length_source
+            previous_word_idx = None
+            continue
+        positions.append(offset + word_idx if word_idx != previous_word_idx else -1)
+        previous_word_idx = word_idx
+    return positions
+
+
+def get_word_logits(word_ids, logits, length_source, length_target):
+    """Keeps the logits of the first token of each word. Words that were truncated away are filled with NaN."""
+    word_logits = np.full((length_source + length_target, logits.shape[-1]), np.nan, dtype=np.float32)
+    for position, word_position in enumerate(get_word_positions(word_ids, length_source)):
+        if word_position >= 0:
+            word_logits[word_position] = logits[position]
+    return word_logits
+
+
+@torch.no_grad()
+def compute_teacher_store(model, tokenizer, dataset, store_path, word_level, batch_size=32, metadata=None):
+    """
+    Runs the teacher once over a tokenized dataset and writes its predictions to a memory-mapped store: one score
+    per example for sentence-level models, and the logits of each word (as float16) for word-level models.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model.to(device)
+    model.eval()
+    input_names = [name for name in tokenizer.model_input_names if name in dataset.column_names]
+    if word_level:
+        writer = RaggedArrayWriter(store_path, np.float16, row_shape=(model.config.num_labels,), metadata=metadata)
+    else:
+        writer = RaggedArrayWriter(store_path, np.float32, metadata=metadata)
+    with writer:
+        for start in range(0, len(dataset), batch_size):
+            batch = dataset[start : start + batch_size]
+            features = [{name: batch[name][i] for name in input_names} for i in range(len(batch[input_names[0]]))]
+            inputs = tokenizer.pad(features, return_tensors="pt").to(device)
+            logits = model(**inputs)[0].float().cpu().numpy()
+            for i in range(len(features)):
+                if word_level:
+                    writer.append(
+                        get_word_logits(
+                            batch["ids_words"][i], logits[i], batch["length_source"][i], batch["length_target"][i]
+                        )
+                    )
+                else:
+                    writer.append(logits[i].reshape(-1)[:1])
+    return RaggedArrayStore(store_path)
+
+
+def add_teacher_positions(examples, indices, offsets, word_level):
+    """Adds, for each example, the rows of the teacher store that hold its targets."""
+    if not word_level:
+        return {TEACHER_COLUMN: [[int(offsets[idx])] for idx in indices]}
+    teacher_positions = []
+    for idx, word_ids, length_source in zip(indices, examples["ids_words"], examples["length_source"]):
+        offset = int(offsets[idx])
+        teacher_positions.append(
+            [offset + position if position >= 0 else -1 for position in get_word_positions(word_ids, length_source)]
+        )
+    return {TEACHER_COLUMN: teacher_positions}
+
+
+def prepare_distillation_dataset(
+    deepquest_model, raw_dataset, tokenized_dataset, model_args, data_args, training_args
+):
+    """
+    Computes (or reuses) the predictions of the teacher on the raw training dataset, and adds to the tokenized
+    dataset of the student the position of its targets in the teacher store.
+    """
+    from deepquestpy.commands.utils import get_deepquest_model
+
+    word_level = isinstance(deepquest_model, DeepQuestModelWord)
+    store_path = model_args.teacher_store_dir
+    if store_path is None:
+        store_path = os.path.join(training_args.output_dir, "teacher_store")
+    metadata = {
+        "teacher": model_args.teacher_model_name_or_path,
+        "arch_name": model_args.arch_name,
+        "dataset_fingerprint": get_dataset_fingerprint(raw_dataset),
+    }
+
+    if not RaggedArrayStore.exists(store_path) or RaggedArrayStore(store_path).metadata != metadata:
+        logger.info(f"Computing the predictions of the teacher {model_args.teacher_model_name_or_path}")
+        teacher_args = dataclasses.replace(
+            model_args,
+            model_name_or_path=model_args.teacher_model_name_or_path,
+            config_name=None,
+            tokenizer_name=None,
+            teacher_model_name_or_path=None,
+            train_adapter=False,
+            adapter_paths=None,
+        )
+        teacher = get_deepquest_model(model_args.arch_name, teacher_args, data_args, training_args)
+        if word_level:
+            teacher.set_label_list(deepquest_model.label_list)
+        compute_teacher_store(
+            teacher.get_model(),
+            teacher.get_tokenizer(),
+            teacher.tokenize_datasets(raw_dataset),
+            store_path,
+            word_level,
+            batch_size=training_args.per_device_eval_batch_size,
+            metadata=metadata,
+        )
+
+    teacher_store = RaggedArrayStore(store_path)
+    if len(teacher_store) != len(tokenized_dataset):
+        raise ValueError(
+            f"The teacher store in {store_path} has {len(teacher_store)} examples, "
+            f"but the training dataset has {len(tokenized_dataset)}."
+        )
+    tokenized_dataset = tokenized_dataset.map(
+        add_teacher_positions,
+        batched=True,
+        with_indices=True,
+        fn_kwargs={"offsets": teacher_store.offsets, "word_level": word_level},
+        num_proc=data_args.preprocessing_num_workers,
+    )
+    return tokenized_dataset, teacher_store
+
+
+class DistillationDataCollator:
+    """Wraps the collator of the student to also pad the positions of the teacher targets (with -1)."""
+
+    def __init__(self, data_collator, tokenizer, word_level):
+        self.data_collator = data_collator if data_collator is not None else DataCollatorWithPadding(tokenizer)
+        self.padding_side = tokenizer.padding_side
+        self.word_level = word_level
+
+    def __call__(self, features):
+        if TEACHER_COLUMN not in features[0]:  # evaluation datasets have no teacher targets
+            return self.data_collator(features)
+        teacher_positions = [feature.pop(TEACHER_COLUMN) for feature in features]
+        batch = self.data_collator(features)
+        length = batch["input_ids"].shape[1] if self.word_level else 1
+        padded = torch.full((len(features), length), -1, dtype=torch.long)
+        for i, positions in enumerate(teacher_positions):
+            positions = torch.tensor(positions[:length], dtype=torch.long)
+            if self.padding_side == "right":
+                padded[i, : len(positions)] = positions
+            else:
+                padded[i, length - len(positions) :] = positions
+        batch[TEACHER_COLUMN] = padded
+        return batch
+
+
+class DistillationTrainer(Trainer):
+    """
+    Trainer that optimizes `alpha * distillation_loss + (1 - alpha) * gold_loss`. The distillation loss is the mean
+    squared error to the teacher scores for sentence-level models, and the cross-entropy with the softened teacher
+    tags (scaled by `temperature ** 2` [0]) for word-level models.
+    [0] https://arxiv.org/abs/1503.02531
+    """
+
+    def __init__(self, *args, teacher_store=None, alpha=0.5, temperature=1.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher_store = teacher_store
+        self.alpha = alpha
+        self.temperature = temperature
+
+    def _remove_unused_columns(self, dataset, description=None):
+        # The default implementation would drop the positions of the teacher targets
+        if not self.args.remove_unused_columns:
+            return dataset
+        model_inputs = set(inspect.signature(self.model.forward).parameters)
+        model_inputs.update(["label", "label_ids", TEACHER_COLUMN])
+        return dataset.remove_columns([name for name in dataset.column_names if name not in model_inputs])
+
+    def _get_teacher_targets(self, positions, device):
+        targets = self.teacher_store.values[positions.cpu().numpy()]
+        return torch.from_numpy(np.asarray(targets, dtype=np.float32)).to(device)
+
+    def _distillation_loss(self, logits, teacher_positions):
+        if logits.dim() == 2:  # sentence-level regression
+            teacher_scores = self._get_teacher_targets(teacher_positions[:, 0], logits.device)
+            return F.mse_loss(logits.view(-1).float(), teacher_scores)
+
+        mask = teacher_positions >= 0
+        teacher_logits = self._get_teacher_targets(teacher_positions[mask], logits.device)
+        student_logits = logits[mask].float()
+        # words that were truncated by the tokenizer of the teacher have no targets
+        available = ~torch.isnan(teacher_logits[:, 0])
+        if not available.any():
+            return logits.sum() * 0.0
+        teacher_probs = F.softmax(teacher_logits[available] / self.temperature, dim=-1)
+        student_log_probs = F.log_softmax(student_logits[available] / self.temperature, dim=-1)
+        return -(teacher_probs * student_log_probs).sum(dim=-1).mean() * self.temperature ** 2
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        teacher_positions = inputs.pop(TEACHER_COLUMN, None)
+        outputs = model(**inputs)
+        gold_loss = outputs["loss"] if isinstance(outputs, dict) and "loss" in outputs else None
+        if teacher_positions is None:
+            loss = gold_loss
+        else:
+            distillation_loss = self._distillation_loss(outputs["logits"], teacher_positions)
+            if gold_loss is None:
+                loss = distillation_loss
+            else:
+                loss = self.alpha * distillation_loss + (1 - self.alpha) * gold_loss
+        return (loss, outputs) if return_outputs else loss
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import torch
+from allennlp.nn.util import get_text_field_mask
+
+from deepquestpy.data.array_store import RaggedArrayStore
+
+
+def get_store_path(store_dir, split, side):
+    """Path of the embeddings of one side (`src` or `tgt`) of one split."""
+    return os.path.join(store_dir, f"{split}.{side}")
+
+
+class EmbeddingStore:
+    """
+    Precomputed embeddings of the tokens of the BiRNN instances, stored as memory-mapped float16 arrays with one
+    `(num_tokens, embedding_dim)` row per instance, for each split and side. See `deepquestpy precompute_embeddings`.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._stores = {}
+
+    def get_store(self, split, side):
+        key = (split, side)
+        if key not in self._stores:
+            path = get_store_path(self.store_dir, split, side)
+            if not RaggedArrayStore.exists(path):
+                raise ValueError(f"No precomputed embeddings for the {side} side of {split} in {self.store_dir}")
+            self._stores[key] = RaggedArrayStore(path)
+        return self._stores[key]
+
+    def embed(self, tokens, metadata, side):
+        """Returns the embeddings of a batch of instances, padded like their tokens."""
+        mask = get_text_field_mask(tokens)
+        embeddings = None
+        for i, instance_metadata in enumerate(metadata):
+            rows = self.get_store(instance_metadata["split"], side)[instance_metadata["idx"]]
+            if embeddings is None:
+                embeddings = np.zeros((*mask.shape, rows.shape[-1]), dtype=np.float32)
+            if len(rows) != int(mask[i].sum()):
+                raise ValueError(
+                    f"The stored embeddings of instance {instance_metadata['idx']} of {instance_metadata['split']} do "
+                    f"not match its tokens ({len(rows)} != {int(mask[i].sum())}), they need to be precomputed again"
+                )
+            embeddings[i, : len(rows)] = rows
+        return torch.from_numpy(embeddings).to(mask.device)
+
+
+def embed_text_field(text_field_embedder, tokens, side, embedding_store=None, metadata=None):
+    """Reads the embeddings of the tokens from the store if there is one, or runs the embedder."""
+    if embedding_store is not None and metadata is not None:
+        return embedding_store.embed(tokens, metadata, side)
+    return text_field_embedder(tokens)
@@ -0,0 +1,170 @@
+import contextlib
+import inspect
+import logging
+import os
+
+import numpy as np
+import torch
+from transformers import DataCollatorWithPadding, Trainer
+
+from deepquestpy.data.array_store import RaggedArrayStore, RaggedArrayWriter
+from deepquestpy.data.tokenized_cache import get_dataset_fingerprint
+
+logger = logging.getLogger(__name__)
+
+FEATURES_COLUMN = "frozen_features_idx"
+
+
+def get_encoder_modules(model):
+    """Returns the embeddings and the list of layers of the encoder of a BERT-like model."""
+    base_model = model.base_model
+    if not hasattr(base_model, "embeddings") or not hasattr(getattr(base_model, "encoder", None), "layer"):
+        raise ValueError(f"Caching the frozen layers is not supported for {type(model).__name__}")
+    return base_model.embeddings, base_model.encoder.layer
+
+
+def freeze_bottom_layers(model, num_layers):
+    """Freezes the embeddings and the bottom `num_layers` layers of the encoder."""
+    embeddings, layers = get_encoder_modules(model)
+    if not 0 < num_layers <= len(layers):
+        raise ValueError(f"Cannot freeze {num_layers} layers of a model with {len(layers)} layers")
+    for module in [embeddings, *layers[:num_layers]]:
+        for parameter in module.parameters():
+            parameter.requires_grad = False
+
+
+@contextlib.contextmanager
+def skip_frozen_layers(model, num_layers):
+    """
+    Makes the embeddings and the bottom `num_layers` layers pass their input through, so that the model can be run on
+    cached hidden states given as `inputs_embeds`. The modules stay in place, so the checkpoints are complete.
+    """
+    embeddings, layers = get_encoder_modules(model)
+    embeddings.forward = lambda *args, inputs_embeds=None, **kwargs: inputs_embeds
+    for layer in layers[:num_layers]:
+        layer.forward = lambda hidden_states, *args, **kwargs: (hidden_states,)
+    try:
+        yield model
+    finally:
+        for module in [embeddings, *layers[:num_layers]]:
+            del module.forward
+
+
+@torch.no_grad()
+def compute_frozen_features(model, tokenizer, dataset, num_layers, store_path, batch_size=32, metadata=None):
+    """
+    Runs the embeddings and the bottom `num_layers` layers once over a tokenized dataset and writes the hidden states
+    of every token, as float16, to a memory-mapped store. The frozen layers are run in evaluation mode (no dropout).
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model.to(device)
+    model.eval()
+    embeddings, layers = get_encoder_modules(model)
+    input_names = [name for name in tokenizer.model_input_names if name in dataset.column_names]
+    writer = RaggedArrayWriter(store_path, np.float16, row_shape=(model.config.hidden_size,), metadata=metadata)
+    with writer:
+        for start in range(0, len(dataset), batch_size):
+            batch = dataset[start : start + batch_size]
+            features = [{name: batch[name][i] for name in input_names} for i in range(len(batch[input_names[0]]))]
+            inputs = tokenizer.pad(features, padding="longest", return_tensors="pt").to(device)
+            attention_mask = inputs["attention_mask"]
+            hidden_states = embeddings(input_ids=inputs["input_ids"], token_type_ids=inputs.get("token_type_ids"))
+            extended_mask = model.get_extended_attention_mask(attention_mask, attention_mask.shape, device)
+            for layer in layers[:num_layers]:
+                hidden_states = layer(hidden_states, attention_mask=extended_mask)[0]
+            hidden_states = hidden_states.half().cpu().numpy()
+            for i, feature in enumerate(features):
+                length = len(feature["input_ids"])
+                if tokenizer.padding_side == "right":
+                    writer.append(hidden_states[i, :length])
+                else:
+                    writer.append(hidden_states[i, hidden_states.shape[1] - length :])
+    return RaggedArrayStore(store_path)
+
+
+def prepare_feature_cache(model, tokenizer, dataset, description, model_args, training_args, index_offset=0):
+    """
+    Computes (or reuses) the hidden states of the frozen layers for a tokenized dataset, and adds to the dataset the
+    index of each example in the store, plus `index_offset` so that the examples of several stores can be told apart.
+    """
+    store_path = os.path.join(model_args.feature_cache_dir, f"{description}-{model_args.frozen_layers}-layers")
+    metadata = {
+        "model_name_or_path": model_args.model_name_or_path,
+        "frozen_layers": model_args.frozen_layers,
+        "dataset_fingerprint": get_dataset_fingerprint(dataset),
+    }
+    if not RaggedArrayStore.exists(store_path) or RaggedArrayStore(store_path).metadata != metadata:
+        logger.info(f"Computing the hidden states of the {model_args.frozen_layers} frozen layers for {description}")
+        compute_frozen_features(
+            model,
+            tokenizer,
+            dataset,
+            model_args.frozen_layers,
+            store_path,
+            batch_size=training_args.per_device_eval_batch_size,
+            metadata=metadata,
+        )
+    store = RaggedArrayStore(store_path)
+    if len(store) != len(dataset):
+        raise ValueError(f"The feature store in {store_path} has {len(store)} examples, the dataset {len(dataset)}")
+    dataset = dataset.add_column(FEATURES_COLUMN, list(range(index_offset, index_offset + len(dataset))))
+    return dataset, store
+
+
+class CachedFeaturesDataCollator:
+    """
+    Wraps the collator of the model to replace the input ids of the examples by their cached hidden states, padded
+    like the rest of the batch. The stores are given in the order of their index offsets.
+    """
+
+    def __init__(self, data_collator, tokenizer, stores):
+        self.data_collator = data_collator if data_collator is not None else DataCollatorWithPadding(tokenizer)
+        self.padding_side = tokenizer.padding_side
+        self.stores = stores
+        self.store_offsets = np.cumsum([0] + [len(store) for store in stores])
+
+    def __call__(self, features):
+        if FEATURES_COLUMN not in features[0]:
+            return self.data_collator(features)
+        indices = [feature.pop(FEATURES_COLUMN) for feature in features]
+        batch = self.data_collator(features)
+        input_ids = batch.pop("input_ids")
+        hidden_states = np.zeros((*input_ids.shape, self.stores[0].values.shape[-1]), dtype=np.float32)
+        for i, idx in enumerate(indices):
+            store_idx = np.searchsorted(self.store_offsets, idx, side="right") - 1
+            states = self.stores[store_idx][idx - self.store_offsets[store_idx]]
+            if self.padding_side == "right":
+                hidden_states[i, : len(states)] = states
+            else:
+                hidden_states[i, input_ids.shape[1] - len(states) :] = states
+        batch["inputs_embeds"] = torch.from_numpy(hidden_states)
+        return batch
+
+
+class CachedFeaturesTrainer(Trainer):
+    """Trainer that runs only the layers above the `frozen_layers` bottom ones on batches of cached hidden states."""
+
+    def __init__(self, *args, frozen_layers=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frozen_layers = frozen_layers
+
+    def _remove_unused_columns(self, dataset, description=None):
+        # The default implementation would drop the index of the cached features
+        if not self.args.remove_unused_columns:
+            return dataset
+        model_inputs = set(inspect.signature(self.model.forward).parameters)
+        model_inputs.update(["label", "label_ids", FEATURES_COLUMN])
+        return dataset.remove_columns([name for name in dataset.column_names if name not in model_inputs])
+
+    def _run_cached(self, inputs):
+        if "inputs_embeds" in inputs:
+            return skip_frozen_layers(self.model, self.frozen_layers)
+        return contextlib.nullcontext()
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        with self._run_cached(inputs):
+            return super().compute_loss(model, inputs, return_outputs=return_outputs, **kwargs)
+
+    def prediction_step(self, model, inputs, prediction_loss_only, ignore_keys=None):
+        with self._run_cached(inputs):
+            return super().prediction_step(model, inputs, prediction_loss_only, ignore_keys=ignore_keys)
@@ -0,0 +1,215 @@
+import contextlib
+import inspect
+import json
+import os
+import struct
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+try:
+    from transformers.modeling_utils import no_init_weights
+except ImportError:  # transformers < 4.9
+    no_init_weights = contextlib.nullcontext
+
+# a safetensors file: the weights of a checkpoint, next to its config (and tokenizer or AllenNLP vocabulary)
+MMAP_WEIGHTS_NAME = "model-mmap.safetensors"
+
+# safetensors dtype names; bfloat16 has no numpy equivalent and is stored as (and viewed from) int16
+DTYPES = {
+    torch.float64: ("F64", np.float64),
+    torch.float32: ("F32", np.float32),
+    torch.float16: ("F16", np.float16),
+    torch.bfloat16: ("BF16", np.int16),
+    torch.int64: ("I64", np.int64),
+    torch.int32: ("I32", np.int32),
+    torch.int16: ("I16", np.int16),
+    torch.int8: ("I8", np.int8),
+    torch.uint8: ("U8", np.uint8),
+    torch.bool: ("BOOL", np.bool_),
+}
+DTYPES_BY_NAME = {name: (torch_dtype, np_dtype) for torch_dtype, (name, np_dtype) in DTYPES.items()}
+
+
+def save_weights(state_dict, path, metadata=None):
+    """
+    Writes tensors in the safetensors layout: the length of a JSON header (8 bytes, little-endian), the header (the
+    dtype, shape and byte range of each tensor), then the raw data of the tensors. The tensors are stored by
+    decreasing element size so that every one of them is aligned and can be memory-mapped as is.
+    """
+    tensors = sorted(state_dict.items(), key=lambda item: -item[1].element_size())
+    header = {}
+    offset = 0
+    for name, tensor in tensors:
+        if tensor.dtype not in DTYPES:
+            raise ValueError(f"Cannot store {name} of type {tensor.dtype}")
+        num_bytes = tensor.numel() * tensor.element_size()
+        header[name] = {
+            "dtype": DTYPES[tensor.dtype][0],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + num_bytes],
+        }
+        offset += num_bytes
+    if metadata:
+        header["__metadata__"] = {key: str(value) for key, value in metadata.items()}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # pads the header with spaces so that the data starts on an 8-byte boundary
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for _, tensor in tensors:
+            tensor = tensor.detach().cpu().contiguous()
+            if tensor.dtype == torch.bfloat16:
+                tensor = tensor.view(torch.int16)
+            tensor.numpy().tofile(f)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_weights(path):
+    """
+    Returns the tensors of a file written by `save_weights` (or any safetensors file), and its metadata. The tensors
+    are copy-on-write views of a memory map of the file: nothing is read until it is used, and the processes that
+    load the same file share the pages of the page cache, as long as they do not write to the weights.
+    """
+    with open(path, "rb") as f:
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_length))
+    metadata = header.pop("__metadata__", {})
+    data = np.memmap(path, dtype=np.uint8, mode="c", offset=8 + header_length)
+    tensors = OrderedDict()
+    for name, info in header.items():
+        torch_dtype, np_dtype = DTYPES_BY_NAME[info["dtype"]]
+        start, end = info["data_offsets"]
+        array = data[start:end].view(np_dtype).reshape(info["shape"])
+        tensor = torch.from_numpy(array)
+        tensors[name] = tensor.view(torch.bfloat16) if torch_dtype == torch.bfloat16 else tensor
+    return tensors, metadata
+
+
+def assign_weights(model, tensors):
+    """
+    Makes the parameters and buffers of a model point to the given tensors, without copying them (unlike
+    `load_state_dict`), so that the model runs on the memory-mapped weights.
+    """
+    expected = set(model.state_dict())
+    missing, unexpected = expected - set(tensors), set(tensors) - expected
+    if missing or unexpected:
+        raise ValueError(
+            f"The weights do not match the model, missing: {sorted(missing)}, unexpected: {sorted(unexpected)}"
+        )
+    for name, tensor in tensors.items():
+        module_name, _, attribute = name.rpartition(".")
+        module = model.get_submodule(module_name) if module_name else model
+        if attribute in module._parameters:
+            requires_grad = module._parameters[attribute].requires_grad
+            module._parameters[attribute] = nn.Parameter(tensor, requires_grad=requires_grad)
+        else:
+            module._buffers[attribute] = tensor
+    return model
+
+
+def is_mmap_checkpoint(path):
+    return os.path.isfile(os.path.join(path, MMAP_WEIGHTS_NAME))
+
+
+def from_pretrained(model_class, model_name_or_path, config=None, **kwargs):
+    """
+    `model_class.from_pretrained`, or, for a checkpoint saved by `save_mmap_checkpoint`, the model built from its
+    config without initializing its weights, then pointed to its memory-mapped weights.
+    """
+    if not is_mmap_checkpoint(model_name_or_path):
+        return model_class.from_pretrained(model_name_or_path, config=config, **kwargs)
+    if config is None:
+        from transformers import AutoConfig
+
+        config = AutoConfig.from_pretrained(model_name_or_path)
+    with no_init_weights():
+        # the Auto classes build the model class of the config
+        model = model_class.from_config(config) if hasattr(model_class, "from_config") else model_class(config)
+    tensors, _ = load_weights(os.path.join(model_name_or_path, MMAP_WEIGHTS_NAME))
+    assign_weights(model, tensors)
+    model.tie_weights()
+    return model.eval()
+
+
+def save_mmap_checkpoint(model, tokenizer, output_dir):
+    """Saves a transformer model (config and memory-mappable weights) and its tokenizer."""
+    os.makedirs(output_dir, exist_ok=True)
+    model.config.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    save_weights(model.state_dict(), os.path.join(output_dir, MMAP_WEIGHTS_NAME), metadata={"format": "pt"})
+
+
+def _skip_pretrained_weights(params):
+    """
+    Removes from the configuration of an AllenNLP model what loads weights that the saved ones replace, as
+    `load_archive` does, and stops the pretrained transformer embedders from loading theirs when they can.
+    """
+    from allennlp.modules.token_embedders import PretrainedTransformerEmbedder
+
+    can_skip_weights = "load_weights" in inspect.signature(PretrainedTransformerEmbedder.__init__).parameters
+
+    def skip(params):
+        if isinstance(params, dict):
+            for key in ["pretrained_file", "initializer"]:
+                params.pop(key, None)
+            if can_skip_weights and params.get("type") == "pretrained_transformer":
+                params["load_weights"] = False
+            values = params.values()
+        else:
+            values = params if isinstance(params, list) else []
+        for value in values:
+            skip(value)
+
+    skip(params)
+
+
+def save_mmap_archive(archive, output_dir):
+    """Saves an AllenNLP archive as a directory of its config, vocabulary and memory-mappable weights."""
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "config.json"), "w") as f:
+        json.dump(archive.config.as_dict(quiet=True), f, indent=2)
+    archive.model.vocab.save_to_files(os.path.join(output_dir, "vocabulary"))
+    save_weights(archive.model.state_dict(), os.path.join(output_dir, MMAP_WEIGHTS_NAME), metadata={"format": "pt"})
+
+
+def load_model_archive(path, cuda_device=-1):
+    """
+    `load_archive` for a `model.tar.gz`, or, for a directory saved by `save_mmap_archive`, an archive whose model
+    runs on the memory-mapped weights, without extracting or deserializing anything.
+    """
+    from allennlp.models.archival import load_archive
+
+    if not is_mmap_checkpoint(path):
+        return load_archive(path, cuda_device=cuda_device)
+
+    from allennlp.common import Params
+    from allennlp.data import DatasetReader, Vocabulary
+    from allennlp.models import Model
+    from allennlp.models.archival import Archive
+
+    config = Params.from_file(os.path.join(path, "config.json"))
+    vocab = Vocabulary.from_files(os.path.join(path, "vocabulary"))
+    model_params = config.get("model").as_dict(quiet=True)
+    _skip_pretrained_weights(model_params)
+    model = Model.from_params(vocab=vocab, params=Params(model_params))
+    tensors, _ = load_weights(os.path.join(path, MMAP_WEIGHTS_NAME))
+    assign_weights(model, tensors)
+    if cuda_device >= 0:
+        model.cuda(cuda_device)
+    model.eval()
+    dataset_reader = DatasetReader.from_params(config["dataset_reader"].duplicate())
+    validation_dataset_reader = dataset_reader
+    if "validation_dataset_reader" in config:
+        validation_dataset_reader = DatasetReader.from_params(config["validation_dataset_reader"].duplicate())
+    fields = {
+        "model": model,
+        "config": config,
+        "dataset_reader": dataset_reader,
+        "validation_dataset_reader": validation_dataset_reader,
+        "meta": None,
+    }
+    return Archive(**{name: value for name, value in fields.items() if name in Archive._fields})
@@ -0,0 +1,20 @@
+import torch.nn as nn
+
+
+def prune_top_layers(model, num_layers_to_drop):
+    """Removes the top `num_layers_to_drop` layers of the encoder of a model, in place."""
+    encoder = model.base_model.encoder
+    num_layers = len(encoder.layer)
+    if not 0 <= num_layers_to_drop < num_layers:
+        raise ValueError(f"Cannot remove {num_layers_to_drop} layers from an encoder with {num_layers} layers.")
+    encoder.layer = nn.ModuleList(list(encoder.layer)[: num_layers - num_layers_to_drop])
+    model.config.num_hidden_layers = num_layers - num_layers_to_drop
+    return model
+
+
+def get_model_size(model):
+    """Returns the number of parameters of a model and the size of its weights in bytes."""
+    state_dict = model.state_dict()
+    num_params = sum(param.numel() for param in model.parameters())
+    num_bytes = sum(tensor.numel() * tensor.element_size() for tensor in state_dict.values())
+    return num_params, num_bytes
@@ -1,6 +1,6 @@
 import numpy as np
 
-from datasets import load_metric
+from datasets import IterableDataset, load_metric
 from transformers import (
     AutoConfig,
     AutoTokenizer,
@@ -11,9 +11,27 @@ from transformers import (
 
 from deepquestpy.models.base import DeepQuestModelSent
 from deepquestpy.commands.utils import METRICS_DIR
+from deepquestpy.data.tokenized_cache import tokenize_dataset
+from deepquestpy.metrics.accumulators import SentenceScoreAccumulator
+from deepquestpy.metrics.bootstrap import compute_global_statistics
+from deepquestpy.models.mmap_weights import from_pretrained
+
+
+def preprocess_examples_sent(examples, tokenizer, src_lang, tgt_lang, label_column_name, pad_to_max_length):
+    tokenized_inputs = tokenizer(
+        text=[e[src_lang] for e in examples["translation"]],
+        text_pair=[e[tgt_lang] for e in examples["translation"]],
+        padding="max_length" if pad_to_max_length else False,
+        truncation=True,
+    )
+    if label_column_name in examples:
+        tokenized_inputs["labels"] = examples[label_column_name]
+    return tokenized_inputs
 
 
 class TransformerDeepQuestModelSent(DeepQuestModelSent):
+    preprocess_function = staticmethod(preprocess_examples_sent)
+
     def __init__(self, model_args, data_args, training_args) -> None:
         super().__init__()
         self.num_labels = 1  # regression
@@ -39,25 +57,29 @@ class TransformerDeepQuestModelSent(DeepQuestModelSent):
         return None
 
     def tokenize_datasets(self, datasets):
-        return datasets.map(
-            self._preprocess_examples,
-            batched=True,
+        if isinstance(datasets, IterableDataset):
+            # streamed datasets are tokenized on the fly
+            return datasets.map(self._preprocess_examples, batched=True)
+        return tokenize_dataset(
+            datasets,
+            self.preprocess_function,
+            self.tokenizer,
+            self._get_preprocessing_kwargs(),
+            cache_dir=self.data_args.tokenized_cache_dir,
             num_proc=self.data_args.preprocessing_num_workers,
             load_from_cache_file=not self.data_args.overwrite_cache,
         )
 
+    def _get_preprocessing_kwargs(self):
+        return {
+            "src_lang": self.data_args.src_lang,
+            "tgt_lang": self.data_args.tgt_lang,
+            "label_column_name": self.data_args.label_column_name,
+            "pad_to_max_length": self.data_args.pad_to_max_length,
+        }
+
     def _preprocess_examples(self, examples):
-        src_lang = self.data_args.src_lang
-        tgt_lang = self.data_args.tgt_lang
-        label_column_name = self.data_args.label_column_name
-        tokenized_inputs = self.tokenizer(
-            text=[e[src_lang] for e in examples["translation"]],
-            text_pair=[e[tgt_lang] for e in examples["translation"]],
-            padding="max_length" if self.data_args.pad_to_max_length else False,
-            truncation=True,
-        )
-        tokenized_inputs["labels"] = examples[label_column_name]
-        return tokenized_inputs
+        return self.preprocess_function(examples, self.tokenizer, **self._get_preprocessing_kwargs())
 
     def get_data_collator(self):
         if self.data_args.pad_to_max_length:
@@ -71,7 +93,8 @@ class TransformerDeepQuestModelSent(DeepQuestModelSent):
         return self.tokenizer
 
     def get_model(self):
-        return AutoModelForSequenceClassification.from_pretrained(
+        return from_pretrained(
+            AutoModelForSequenceClassification,
             self.model_args.model_name_or_path,
             from_tf=bool(".ckpt" in self.model_args.model_name_or_path),
             config=self.config,
@@ -79,13 +102,46 @@ class TransformerDeepQuestModelSent(DeepQuestModelSent):
             revision=self.model_args.model_revision,
         )
 
+    def _get_bootstrap_kwargs(self):
+        return {
+            "bootstrap_resamples": self.data_args.bootstrap_resamples,
+            "confidence_level": self.data_args.confidence_level,
+            "seed": self.training_args.seed,
+        }
+
     def compute_metrics(self, p):
         metric = load_metric(f"{METRICS_DIR}/questeval_sentence")
         predictions, labels = p
         predictions = np.squeeze(predictions)
-        metrics = metric.compute(references=labels, predictions=predictions)
+        metrics = metric.compute(references=labels, predictions=predictions, **self._get_bootstrap_kwargs())
         return metrics
 
+    def get_metric_accumulators(self):
+        return {"": SentenceScoreAccumulator()}
+
+    def update_metric_accumulators(self, accumulators, predictions, labels, eval_columns=None):
+        """Adds a batch of postprocessed predictions and their gold scores to the metric accumulators."""
+        accumulators[""].update(labels, predictions["predictions"])
+
+    def compute_global_metrics(self, predictions, labels):
+        """Returns the metrics that are not accumulated, computed over all the (raw) predictions."""
+        predictions = self.postprocess_predictions(predictions)["predictions"]
+        return compute_global_statistics(labels, predictions, **self._get_bootstrap_kwargs())
+
+    def encode_batch(self, pairs):
+        src_lang, tgt_lang = self.data_args.src_lang, self.data_args.tgt_lang
+        examples = {"translation": [{src_lang: src, tgt_lang: tgt} for src, tgt in pairs]}
+        with self._tokenizer_lock:
+            tokenized = self._preprocess_examples(examples)
+            inputs = self.tokenizer.pad(
+                {name: tokenized[name] for name in self.tokenizer.model_input_names if name in tokenized},
+                return_tensors="pt",
+            )
+        return {"inputs": dict(inputs)}
+
+    def decode_batch(self, logits, batch):
+        return [float(score) for score in self.postprocess_predictions(logits)["predictions"]]
+
     def postprocess_predictions(self, predictions, *args):
         predictions = np.squeeze(predictions)
         predictions = np.atleast_1d(predictions)
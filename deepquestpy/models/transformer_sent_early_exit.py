@@ -0,0 +1,206 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn import MSELoss
+
+from datasets import load_metric
+from transformers.modeling_outputs import ModelOutput
+from transformers.models.xlm_roberta.configuration_xlm_roberta import XLMRobertaConfig
+from transformers.models.roberta.modeling_roberta import (
+    RobertaPreTrainedModel,
+    RobertaModel,
+    RobertaClassificationHead,
+)
+
+from deepquestpy.models.transformer_sent import TransformerDeepQuestModelSent
+from deepquestpy.commands.utils import METRICS_DIR
+from deepquestpy.models.mmap_weights import from_pretrained
+
+EARLY_EXIT_TRAINING_MODES = ["joint", "self_distillation"]
+
+
+@dataclass
+class EarlyExitRegressionOutput(ModelOutput):
+    loss: Optional[torch.FloatTensor] = None
+    logits: torch.FloatTensor = None
+    exit_layers: torch.LongTensor = None
+
+
+class ExitHead(nn.Module):
+    """Lightweight head that predicts the score and the expected absolute error of that score."""
+
+    def __init__(self, config):
+        super().__init__()
+        self.dropout = nn.Dropout(config.hidden_dropout_prob)
+        self.out_proj = nn.Linear(config.hidden_size, 2)
+
+    def forward(self, features):
+        outputs = self.out_proj(self.dropout(features[:, 0, :]))  # take <s> token (equiv. to [CLS])
+        return outputs[:, 0], nn.functional.softplus(outputs[:, 1])
+
+
+class RobertaForQualityEstimationSentEarlyExit(RobertaPreTrainedModel):
+    """
+    Sentence-level regressor with exit heads on intermediate layers [0]. At inference, each example leaves the encoder
+    at the first exit whose predicted error is below `early_exit_threshold`, and the remaining examples of the batch
+    go on together through the next layers.
+    [0] https://arxiv.org/abs/2004.12993
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        if not hasattr(config, "exit_layers"):
+            config.exit_layers = list(range(4, config.num_hidden_layers, 4))
+        if not hasattr(config, "early_exit_training"):
+            config.early_exit_training = "joint"
+        if config.early_exit_training not in EARLY_EXIT_TRAINING_MODES:
+            raise ValueError(f"early_exit_training must be one of {', '.join(EARLY_EXIT_TRAINING_MODES)}")
+
+        self.roberta = RobertaModel(config, add_pooling_layer=False)
+        self.exit_heads = nn.ModuleDict(
+            {str(layer): ExitHead(config) for layer in config.exit_layers if layer < config.num_hidden_layers}
+        )
+        self.classifier = RobertaClassificationHead(config)
+        self.early_exit_threshold = None
+
+        self.init_weights()
+
+    def _run_layer(self, layer, hidden_states, extended_attention_mask):
+        layer_outputs = layer(hidden_states, attention_mask=extended_attention_mask)
+        return layer_outputs[0] if isinstance(layer_outputs, tuple) else layer_outputs
+
+    def _forward_all_exits(self, input_ids, attention_mask, labels):
+        outputs = self.roberta(input_ids, attention_mask=attention_mask, output_hidden_states=True, return_dict=True)
+        logits = self.classifier(outputs.last_hidden_state).view(-1)
+        exit_outputs = [
+            (int(layer), head(outputs.hidden_states[int(layer)])) for layer, head in self.exit_heads.items()
+        ]
+
+        loss = None
+        if labels is not None:
+            loss_fct = MSELoss()
+            labels = labels.view(-1).to(logits.dtype)
+            num_layers = self.config.num_hidden_layers
+            if self.config.early_exit_training == "joint":
+                # deeper exits get a larger weight, as their predictions are expected to be better
+                loss = num_layers * loss_fct(logits, labels)
+                for layer, (scores, errors) in exit_outputs:
+                    loss = loss + layer * loss_fct(scores, labels)
+                    loss = loss + layer * loss_fct(errors, (scores.detach() - labels).abs())
+                loss = loss / (num_layers + sum(layer for layer, _ in exit_outputs))
+            else:
+                # the exits learn to reproduce the prediction of the full model
+                targets = logits.detach()
+                loss = loss_fct(logits, labels)
+                for _, (scores, errors) in exit_outputs:
+                    loss = loss + loss_fct(scores, targets) / len(exit_outputs)
+                    loss = loss + loss_fct(errors, (scores.detach() - targets).abs()) / len(exit_outputs)
+
+        exit_layers = torch.full_like(logits, self.config.num_hidden_layers, dtype=torch.long)
+        return EarlyExitRegressionOutput(loss=loss, logits=logits.unsqueeze(-1), exit_layers=exit_layers)
+
+    def _forward_early_exit(self, input_ids, attention_mask):
+        batch_size = input_ids.size(0)
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        hidden_states = self.roberta.embeddings(input_ids=input_ids)
+        scores = hidden_states.new_zeros(batch_size)
+        exit_layers = input_ids.new_full((batch_size,), self.config.num_hidden_layers)
+        active = torch.arange(batch_size, device=input_ids.device)
+
+        extended_attention_mask = self.get_extended_attention_mask(
+            attention_mask, attention_mask.shape, input_ids.device
+        )
+        for layer_idx, layer in enumerate(self.roberta.encoder.layer, start=1):
+            hidden_states = self._run_layer(layer, hidden_states, extended_attention_mask)
+            head = self.exit_heads[str(layer_idx)] if str(layer_idx) in self.exit_heads else None
+            if head is None:
+                continue
+            exit_scores, exit_errors = head(hidden_states)
+            done = exit_errors <= self.early_exit_threshold
+            if not done.any():
+                continue
+            scores[active[done]] = exit_scores[done].to(scores.dtype)
+            exit_layers[active[done]] = layer_idx
+            keep = ~done
+            if not keep.any():
+                return scores, exit_layers
+            # continue with the remaining examples only, without the padding that none of them needs
+            active, hidden_states, attention_mask = active[keep], hidden_states[keep], attention_mask[keep]
+            max_length = int(attention_mask.sum(dim=1).max())
+            if not attention_mask[:, max_length:].any():
+                hidden_states, attention_mask = hidden_states[:, :max_length], attention_mask[:, :max_length]
+            extended_attention_mask = self.get_extended_attention_mask(
+                attention_mask, attention_mask.shape, input_ids.device
+            )
+        scores[active] = self.classifier(hidden_states).view(-1).to(scores.dtype)
+        return scores, exit_layers
+
+    def forward(self, input_ids=None, attention_mask=None, labels=None):
+        if self.training or self.early_exit_threshold is None:
+            return self._forward_all_exits(input_ids, attention_mask, labels)
+
+        scores, exit_layers = self._forward_early_exit(input_ids, attention_mask)
+        loss = None
+        if labels is not None:
+            loss = MSELoss()(scores, labels.view(-1).to(scores.dtype))
+        return EarlyExitRegressionOutput(loss=loss, logits=scores.unsqueeze(-1), exit_layers=exit_layers)
+
+
+class XLMRobertaForQualityEstimationSentEarlyExit(RobertaForQualityEstimationSentEarlyExit):
+    config_class = XLMRobertaConfig
+
+
+class TransformerDeepQuestModelSentEarlyExit(TransformerDeepQuestModelSent):
+    def __init__(self, model_args, data_args, training_args) -> None:
+        super().__init__(model_args, data_args, training_args)
+        if model_args.exit_layers:
+            self.config.exit_layers = [int(layer) for layer in model_args.exit_layers.split(",")]
+        if model_args.early_exit_training:
+            self.config.early_exit_training = model_args.early_exit_training
+
+    def get_model(self):
+        model = from_pretrained(
+            XLMRobertaForQualityEstimationSentEarlyExit,
+            self.model_args.model_name_or_path,
+            from_tf=bool(".ckpt" in self.model_args.model_name_or_path),
+            config=self.config,
+            cache_dir=self.model_args.cache_dir,
+            revision=self.model_args.model_revision,
+        )
+        model.early_exit_threshold = self.model_args.early_exit_threshold
+        return model
+
+    def _split_predictions(self, predictions):
+        if isinstance(predictions, tuple):
+            return predictions[0], predictions[1]
+        return predictions, None
+
+    def _get_exit_metrics(self, exit_layers):
+        average_exit_layer = float(np.mean(exit_layers))
+        return {
+            "average_exit_layer": average_exit_layer,
+            "layer_speedup": self.config.num_hidden_layers / average_exit_layer,
+        }
+
+    def compute_metrics(self, p):
+        metric = load_metric(f"{METRICS_DIR}/questeval_sentence")
+        predictions, labels = p
+        predictions, exit_layers = self._split_predictions(predictions)
+        metrics = metric.compute(
+            references=labels, predictions=np.squeeze(predictions), **self._get_bootstrap_kwargs()
+        )
+        if exit_layers is not None:
+            metrics.update(self._get_exit_metrics(exit_layers))
+        return metrics
+
+    def postprocess_predictions(self, predictions, *args):
+        predictions, exit_layers = self._split_predictions(predictions)
+        postprocessed = super().postprocess_predictions(predictions)
+        if exit_layers is not None:
+            postprocessed.update(self._get_exit_metrics(exit_layers))
+            postprocessed["exit_layers"] = np.atleast_1d(exit_layers)
+        return postprocessed
@@ -0,0 +1,194 @@
+import threading
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+from torch.nn import MSELoss
+
+from transformers.modeling_outputs import SequenceClassifierOutput
+from transformers.models.xlm_roberta.configuration_xlm_roberta import XLMRobertaConfig
+from transformers.models.roberta.modeling_roberta import RobertaPreTrainedModel, RobertaModel
+
+from deepquestpy.models.transformer_sent import TransformerDeepQuestModelSent
+from deepquestpy.data.data_collator import DataCollatorForSentencePairs
+from deepquestpy.models.mmap_weights import from_pretrained
+
+SIAMESE_POOLING_MODES = ["mean", "cls"]
+
+
+def preprocess_examples_siamese(examples, tokenizer, src_lang, tgt_lang, label_column_name, pad_to_max_length):
+    padding = "max_length" if pad_to_max_length else False
+    tokenized_src = tokenizer([e[src_lang] for e in examples["translation"]], padding=padding, truncation=True)
+    tokenized_mt = tokenizer([e[tgt_lang] for e in examples["translation"]], padding=padding, truncation=True)
+    tokenized_inputs = {
+        "input_ids": tokenized_src["input_ids"],
+        "attention_mask": tokenized_src["attention_mask"],
+        "mt_input_ids": tokenized_mt["input_ids"],
+        "mt_attention_mask": tokenized_mt["attention_mask"],
+    }
+    if label_column_name in examples:
+        tokenized_inputs["labels"] = examples[label_column_name]
+    return tokenized_inputs
+
+
+class EmbeddingCache:
+    """Thread-safe LRU cache of the embeddings of the last `max_size` distinct sources."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._embeddings)
+
+    def get(self, key):
+        with self._lock:
+            embedding = self._embeddings.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._embeddings.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, key, embedding):
+        with self._lock:
+            self._embeddings[key] = embedding
+            self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self.max_size:
+                self._embeddings.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._embeddings.clear()
+            self.hits = self.misses = 0
+
+
+class RobertaForQualityEstimationSentSiamese(RobertaPreTrainedModel):
+    """
+    Sentence-level regressor that encodes the source and the translation separately with the same encoder [0], and
+    predicts the score from their pooled embeddings u and v, as (u, v, |u - v|, u * v). At inference, each distinct
+    source of a batch is encoded once, and the embeddings of the sources are kept in an LRU cache, so that a source
+    scored with many translations (n-best lists, several systems) is only encoded the first time.
+    [0] https://arxiv.org/abs/1908.10084
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        if not hasattr(config, "siamese_pooling"):
+            config.siamese_pooling = "mean"
+        if config.siamese_pooling not in SIAMESE_POOLING_MODES:
+            raise ValueError(f"siamese_pooling must be one of {', '.join(SIAMESE_POOLING_MODES)}")
+
+        self.roberta = RobertaModel(config, add_pooling_layer=False)
+        self.regressor = nn.Sequential(
+            nn.Dropout(config.hidden_dropout_prob),
+            nn.Linear(4 * config.hidden_size, config.hidden_size),
+            nn.Tanh(),
+            nn.Dropout(config.hidden_dropout_prob),
+            nn.Linear(config.hidden_size, 1),
+        )
+        self.source_cache = None
+
+        self.init_weights()
+
+    def set_source_cache_size(self, max_size):
+        """Keeps the embeddings of the last `max_size` distinct sources at inference (none if 0)."""
+        self.source_cache = EmbeddingCache(max_size) if max_size > 0 else None
+
+    def train(self, mode=True):
+        # the cached embeddings are stale as soon as the weights change
+        if mode and self.source_cache is not None:
+            self.source_cache.clear()
+        return super().train(mode)
+
+    def encode(self, input_ids, attention_mask):
+        """Returns the pooled embeddings of a batch of segments."""
+        hidden_states = self.roberta(input_ids, attention_mask=attention_mask, return_dict=True).last_hidden_state
+        if self.config.siamese_pooling == "cls":
+            return hidden_states[:, 0]
+        mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+        return (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+    def score_embeddings(self, embeddings_src, embeddings_mt):
+        features = torch.cat(
+            [embeddings_src, embeddings_mt, (embeddings_src - embeddings_mt).abs(), embeddings_src * embeddings_mt], -1
+        )
+        return self.regressor(features).view(-1)
+
+    def _encode_sources(self, input_ids, attention_mask):
+        if self.training:
+            return self.encode(input_ids, attention_mask)
+        keys = [tuple(ids[mask.bool()].tolist()) for ids, mask in zip(input_ids, attention_mask)]
+        embeddings = {}
+        if self.source_cache is not None:
+            for key in set(keys):
+                embedding = self.source_cache.get(key)
+                if embedding is not None:
+                    embeddings[key] = embedding
+        # the first row of each source that is not cached
+        missing = {}
+        for row, key in enumerate(keys):
+            if key not in embeddings and key not in missing:
+                missing[key] = row
+        if missing:
+            rows = torch.tensor(list(missing.values()), device=input_ids.device)
+            input_ids, attention_mask = input_ids[rows], attention_mask[rows]
+            max_length = int(attention_mask.sum(dim=1).max())
+            if not attention_mask[:, max_length:].any():
+                input_ids, attention_mask = input_ids[:, :max_length], attention_mask[:, :max_length]
+            for key, embedding in zip(missing, self.encode(input_ids, attention_mask)):
+                embeddings[key] = embedding
+                if self.source_cache is not None:
+                    # a copy, so that the cache does not hold on to the embeddings of the whole batch
+                    self.source_cache.put(key, embedding.detach().clone())
+        return torch.stack([embeddings[key] for key in keys])
+
+    def forward(self, input_ids=None, attention_mask=None, mt_input_ids=None, mt_attention_mask=None, labels=None):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        if mt_attention_mask is None:
+            mt_attention_mask = torch.ones_like(mt_input_ids)
+        embeddings_src = self._encode_sources(input_ids, attention_mask)
+        embeddings_mt = self.encode(mt_input_ids, mt_attention_mask)
+        logits = self.score_embeddings(embeddings_src, embeddings_mt)
+
+        loss = None
+        if labels is not None:
+            loss = MSELoss()(logits, labels.view(-1).to(logits.dtype))
+        return SequenceClassifierOutput(loss=loss, logits=logits.unsqueeze(-1))
+
+
+class XLMRobertaForQualityEstimationSentSiamese(RobertaForQualityEstimationSentSiamese):
+    config_class = XLMRobertaConfig
+
+
+class TransformerDeepQuestModelSentSiamese(TransformerDeepQuestModelSent):
+    preprocess_function = staticmethod(preprocess_examples_siamese)
+
+    def get_data_collator(self):
+        return DataCollatorForSentencePairs(self.tokenizer, pad_to_multiple_of=8 if self.training_args.fp16 else None)
+
+    def get_model(self):
+        model = from_pretrained(
+            XLMRobertaForQualityEstimationSentSiamese,
+            self.model_args.model_name_or_path,
+            from_tf=bool(".ckpt" in self.model_args.model_name_or_path),
+            config=self.config,
+            cache_dir=self.model_args.cache_dir,
+            revision=self.model_args.model_revision,
+        )
+        model.set_source_cache_size(self.model_args.source_cache_size)
+        return model
+
+    def encode_batch(self, pairs):
+        src_lang, tgt_lang = self.data_args.src_lang, self.data_args.tgt_lang
+        examples = {"translation": [{src_lang: src, tgt_lang: tgt} for src, tgt in pairs]}
+        with self._tokenizer_lock:
+            tokenized = self._preprocess_examples(examples)
+            features = [{name: values[i] for name, values in tokenized.items()} for i in range(len(pairs))]
+            inputs = DataCollatorForSentencePairs(self.tokenizer)(features)
+        return {"inputs": inputs}
@@ -1,13 +1,118 @@
 import numpy as np
 
-from datasets import load_metric
+from datasets import IterableDataset, load_metric
 from transformers import AutoConfig, AutoTokenizer, AutoModelForTokenClassification, DataCollatorForTokenClassification
 
 from deepquestpy.models.base import DeepQuestModelWord
 from deepquestpy.commands.utils import METRICS_DIR
+from deepquestpy.data.alignments import parse_alignments, project_bad_tags
+from deepquestpy.data.tokenized_cache import tokenize_dataset
+from deepquestpy.metrics.accumulators import WordTagAccumulator
+from deepquestpy.models.mmap_weights import from_pretrained
+
+
+def preprocess_examples_word(
+    examples,
+    tokenizer,
+    label_to_id,
+    src_lang,
+    tgt_lang,
+    label_column_name_src,
+    label_column_name_tgt,
+    label_all_tokens,
+    labels_in_gaps,
+    pad_to_max_length,
+):
+    tokenized_inputs = tokenizer(
+        text=[e[src_lang].split() for e in examples["translation"]],
+        text_pair=[e[tgt_lang].split() for e in examples["translation"]],
+        padding="max_length" if pad_to_max_length else False,
+        truncation=True,
+        # We use this argument because the texts in our dataset are lists of words (with a label for each word).
+        is_split_into_words=True,
+    )
+    tokenized_inputs["length_source"] = [len(e[src_lang].split()) for e in examples["translation"]]
+    tokenized_inputs["length_target"] = [len(e[tgt_lang].split()) for e in examples["translation"]]
+
+    if len(examples[label_column_name_tgt][0]) > 0:  # to verify that there are labels
+        ids_words, labels_words = preprocess_src_and_tgt_labels(
+            examples,
+            tokenized_inputs,
+            label_to_id,
+            label_column_name_src,
+            label_column_name_tgt,
+            labels_in_gaps,
+            label_all_tokens,
+        )
+        tokenized_inputs["labels"] = labels_words
+    else:
+        ids_words = [tokenized_inputs.word_ids(batch_index=i) for i in range(len(examples["translation"]))]
+
+    tokenized_inputs["ids_words"] = ids_words
+
+    return tokenized_inputs
+
+
+def preprocess_src_and_tgt_labels(
+    examples,
+    tokenized_inputs,
+    label_to_id,
+    label_column_name_src,
+    label_column_name_tgt,
+    labels_in_gaps,
+    label_all_tokens,
+):
+    if label_column_name_src in examples:
+        all_tokens_labels = zip(examples[label_column_name_src], examples[label_column_name_tgt])
+    else:
+        all_tokens_labels = examples[label_column_name_tgt]
+    ids_words = []
+    labels_word = []
+    for i, batch_tokens_labels in enumerate(all_tokens_labels):
+        if label_column_name_src in examples:
+            label_src, label_tgt = batch_tokens_labels
+        else:
+            label_src = None
+            label_tgt = batch_tokens_labels
+        # remove the labels for GAPS in target
+        if not labels_in_gaps:
+            label_tgt = [l for j, l in enumerate(label_tgt) if j % 2 != 0]
+
+        label = label_src
+        word_ids = tokenized_inputs.word_ids(batch_index=i)
+        previous_word_idx = None
+        label_ids = []
+        count_special = 0  # this variable helps keep track on when to change from src labels to tgt labels
+        for word_idx in word_ids:
+            # Special tokens have a word id that is None. We set the label to -100 so they are automatically
+            # ignored in the loss function.
+            if word_idx is None:
+                label_ids.append(-100)
+                count_special += 1
+                if count_special == 3:  # two from start and end of src, and one from start of tgt
+                    label = label_tgt
+            # We set the label for the first token of each word.
+            elif word_idx != previous_word_idx:
+                if label is not None:
+                    label_ids.append(label_to_id[label[word_idx]])
+                else:
+                    label_ids.append(-100)
+            # For the other tokens in a word, we set the label to either the current label or -100, depending on
+            # the label_all_tokens flag.
+            else:
+                if label is not None:
+                    label_ids.append(label_to_id[label[word_idx]] if label_all_tokens else -100)
+                else:
+                    label_ids.append(-100)
+            previous_word_idx = word_idx
+        labels_word.append(label_ids)
+        ids_words.append(word_ids)
+    return ids_words, labels_word
 
 
 class TransformerDeepQuestModelWord(DeepQuestModelWord):
+    preprocess_function = staticmethod(preprocess_examples_word)
+
     def __init__(self, model_args, data_args, training_args):
         super().__init__()
         self.tokenizer_name = model_args.tokenizer_name if model_args.tokenizer_name else model_args.model_name_or_path
@@ -17,6 +122,15 @@ class TransformerDeepQuestModelWord(DeepQuestModelWord):
         self.data_args = data_args
         self.training_args = training_args
 
+    def _set_default_label_list(self):
+        if not hasattr(self, "label_list"):
+            # the names of the ClassLabel of the tags in the QE datasets
+            self.set_label_list(["BAD", "OK"])
+
+    def get_inference_model(self):
+        self._set_default_label_list()
+        return super().get_inference_model()
+
     def set_label_list(self, label_list):
         self.label_list = label_list
         self.label_to_id = {i: i for i in range(len(self.label_list))}
@@ -40,99 +154,33 @@ class TransformerDeepQuestModelWord(DeepQuestModelWord):
 
     def tokenize_datasets(self, datasets):
         self._load_tokenizer()
-        tokenized_datasets = datasets.map(
-            self._preprocess_examples,
-            batched=True,
+        if isinstance(datasets, IterableDataset):
+            # streamed datasets are tokenized on the fly
+            return datasets.map(self._preprocess_examples, batched=True)
+        return tokenize_dataset(
+            datasets,
+            self.preprocess_function,
+            self.tokenizer,
+            self._get_preprocessing_kwargs(),
+            cache_dir=self.data_args.tokenized_cache_dir,
             num_proc=self.data_args.preprocessing_num_workers,
             load_from_cache_file=not self.data_args.overwrite_cache,
         )
-        return tokenized_datasets
-
-    def _preprocess_examples(self, examples):
-        src_lang = self.data_args.src_lang
-        tgt_lang = self.data_args.tgt_lang
-        label_all_tokens = self.data_args.label_all_tokens
-        labels_in_gaps = self.data_args.labels_in_gaps
-        label_column_name_tgt = self.data_args.label_column_name_tgt
-        label_column_name_src = self.data_args.label_column_name_src
-
-        tokenized_inputs = self.tokenizer(
-            text=[e[src_lang].split() for e in examples["translation"]],
-            text_pair=[e[tgt_lang].split() for e in examples["translation"]],
-            padding="max_length" if self.data_args.pad_to_max_length else False,
-            truncation=True,
-            # We use this argument because the texts in our dataset are lists of words (with a label for each word).
-            is_split_into_words=True,
-        )
-        tokenized_inputs["length_source"] = [len(e[src_lang].split()) for e in examples["translation"]]
-        tokenized_inputs["length_target"] = [len(e[tgt_lang].split()) for e in examples["translation"]]
-
-        if len(examples[label_column_name_tgt][0]) > 0:  # to verify that there are labels
-            ids_words, labels_words = self._preprocess_src_and_tgt_labels(
-                examples,
-                tokenized_inputs,
-                label_column_name_src,
-                label_column_name_tgt,
-                labels_in_gaps,
-                label_all_tokens,
-            )
-            tokenized_inputs["labels"] = labels_words
-        else:
-            ids_words = [tokenized_inputs.word_ids(batch_index=i) for i in range(len(examples["translation"]))]
-
-        tokenized_inputs["ids_words"] = ids_words
 
-        return tokenized_inputs
+    def _get_preprocessing_kwargs(self):
+        return {
+            "label_to_id": self.label_to_id,
+            "src_lang": self.data_args.src_lang,
+            "tgt_lang": self.data_args.tgt_lang,
+            "label_column_name_src": self.data_args.label_column_name_src,
+            "label_column_name_tgt": self.data_args.label_column_name_tgt,
+            "label_all_tokens": self.data_args.label_all_tokens,
+            "labels_in_gaps": self.data_args.labels_in_gaps,
+            "pad_to_max_length": self.data_args.pad_to_max_length,
+        }
 
-    def _preprocess_src_and_tgt_labels(
-        self, examples, tokenized_inputs, label_column_name_src, label_column_name_tgt, labels_in_gaps, label_all_tokens
-    ):
-        if label_column_name_src in examples:
-            all_tokens_labels = zip(examples[label_column_name_src], examples[label_column_name_tgt])
-        else:
-            all_tokens_labels = examples[label_column_name_tgt]
-        ids_words = []
-        labels_word = []
-        for i, batch_tokens_labels in enumerate(all_tokens_labels):
-            if label_column_name_src in examples:
-                label_src, label_tgt = batch_tokens_labels
-            else:
-                label_src = None
-                label_tgt = batch_tokens_labels
-            # remove the labels for GAPS in target
-            if not labels_in_gaps:
-                label_tgt = [l for j, l in enumerate(label_tgt) if j % 2 != 0]
-
-            label = label_src
-            word_ids = tokenized_inputs.word_ids(batch_index=i)
-            previous_word_idx = None
-            label_ids = []
-            count_special = 0  # this variable helps keep track on when to change from src labels to tgt labels
-            for word_idx in word_ids:
-                # Special tokens have a word id that is None. We set the label to -100 so they are automatically
-                # ignored in the loss function.
-                if word_idx is None:
-                    label_ids.append(-100)
-                    count_special += 1
-                    if count_special == 3:  # two from start and end of src, and one from start of tgt
-                        label = label_tgt
-                # We set the label for the first token of each word.
-                elif word_idx != previous_word_idx:
-                    if label is not None:
-                        label_ids.append(self.label_to_id[label[word_idx]])
-                    else:
-                        label_ids.append(-100)
-                # For the other tokens in a word, we set the label to either the current label or -100, depending on
-                # the label_all_tokens flag.
-                else:
-                    if label is not None:
-                        label_ids.append(self.label_to_id[label[word_idx]] if label_all_tokens else -100)
-                    else:
-                        label_ids.append(-100)
-                previous_word_idx = word_idx
-            labels_word.append(label_ids)
-            ids_words.append(word_ids)
-        return ids_words, labels_word
+    def _preprocess_examples(self, examples):
+        return self.preprocess_function(examples, self.tokenizer, **self._get_preprocessing_kwargs())
 
     def get_model(self):
         # Load pretrained model
@@ -142,7 +190,11 @@ class TransformerDeepQuestModelWord(DeepQuestModelWord):
             cache_dir=self.model_args.cache_dir,
             revision=self.model_args.model_revision,
         )
-        return AutoModelForTokenClassification.from_pretrained(
+        return self.load_pretrained_model()
+
+    def load_pretrained_model(self):
+        return from_pretrained(
+            AutoModelForTokenClassification,
             self.model_args.model_name_or_path,
             from_tf=bool(".ckpt" in self.model_args.model_name_or_path),
             config=self.config,
@@ -155,22 +207,76 @@ class TransformerDeepQuestModelWord(DeepQuestModelWord):
             self.tokenizer, pad_to_multiple_of=8 if self.training_args.fp16 else None
         )
 
+    def encode_batch(self, pairs):
+        """
+        Tokenizes (source, translation) pairs. With `--project_source_tags`, each pair also needs the word alignments
+        of the source and the translation, as (source, translation, alignments) with alignments given as `"i-j"`.
+        """
+        alignments = None
+        if self.data_args.project_source_tags:
+            if any(len(pair) < 3 for pair in pairs):
+                raise ValueError("--project_source_tags needs pairs given as (source, translation, alignments)")
+            alignments = [parse_alignments(pair[2]) if isinstance(pair[2], str) else pair[2] for pair in pairs]
+        src_lang, tgt_lang = self.data_args.src_lang, self.data_args.tgt_lang
+        examples = {
+            "translation": [{src_lang: pair[0], tgt_lang: pair[1]} for pair in pairs],
+            self.data_args.label_column_name_tgt: [[] for _ in pairs],
+        }
+        with self._tokenizer_lock:
+            # lazily loaded under the lock, so that concurrent first calls load a single tokenizer
+            self._set_default_label_list()
+            self._load_tokenizer()
+            tokenized = self._preprocess_examples(examples)
+            inputs = self.tokenizer.pad(
+                {name: tokenized[name] for name in self.tokenizer.model_input_names if name in tokenized},
+                return_tensors="pt",
+            )
+        metadata = {name: tokenized[name] for name in ["ids_words", "length_source", "length_target"]}
+        if alignments is not None:
+            metadata["alignments"] = alignments
+        return {"inputs": dict(inputs), "metadata": metadata}
+
+    def decode_batch(self, logits, batch):
+        predictions = self.postprocess_predictions(logits, None, eval_columns=batch["metadata"])
+        return [
+            {
+                "src_tags": [self.label_list[tag] for tag in src_tags],
+                "mt_tags": [self.label_list[tag] for tag in tgt_tags],
+            }
+            for src_tags, tgt_tags in zip(predictions["predictions_src"], predictions["predictions_tgt"])
+        ]
+
+    def _get_columns(self, dataset, column_names):
+        """Reads the given columns of a dataset. Streamed datasets are iterated only once."""
+        if isinstance(dataset, IterableDataset):
+            columns = {}
+            for example in dataset:
+                for name in column_names:
+                    if name in example:
+                        columns.setdefault(name, []).append(example[name])
+            return columns
+        return {name: dataset[name] for name in column_names if name in dataset.column_names}
+
     def compute_metrics(self, p):
         metric = load_metric(f"{METRICS_DIR}/questeval_word")
         raw_predictions, raw_labels = p
         raw_predictions = np.argmax(raw_predictions, axis=2)
-        preds_src, preds_tgt = self._get_true_predictions_for_source_and_target(
-            self.evaluation_dataset_for_metrics, raw_predictions, raw_labels
-        )
 
         label_column_name_tgt = self.data_args.label_column_name_tgt
         label_column_name_src = self.data_args.label_column_name_src
 
-        refs_tgt = [[tag for tag in tags] for tags in self.evaluation_dataset_for_metrics[label_column_name_tgt]]
-        if label_column_name_src in self.evaluation_dataset_for_metrics:
-            refs_src = [[tag for tag in tags] for tags in self.evaluation_dataset_for_metrics[label_column_name_src]]
-        else:
-            refs_src = [[]] * len(preds_src)
+        eval_columns = self._get_columns(
+            self.evaluation_dataset_for_metrics,
+            ["ids_words", "length_source", "length_target", "alignments"]
+            + [label_column_name_src, label_column_name_tgt],
+        )
+        preds_src, preds_tgt = self._get_true_predictions_for_source_and_target(
+            eval_columns, raw_predictions, raw_labels
+        )
+        if self.data_args.project_source_tags:
+            preds_src = self._project_source_predictions(eval_columns, preds_tgt)
+
+        refs_src, refs_tgt = self._get_references(eval_columns, len(preds_src))
 
         metrics = metric.compute(
             references=[{"src": ref_src, "tgt": ref_tgt} for ref_src, ref_tgt in zip(refs_src, refs_tgt)],
@@ -179,6 +285,36 @@ class TransformerDeepQuestModelWord(DeepQuestModelWord):
 
         return metrics
 
+    def _get_references(self, eval_columns, num_examples):
+        label_column_name_tgt = self.data_args.label_column_name_tgt
+        label_column_name_src = self.data_args.label_column_name_src
+        refs_tgt = [[tag for tag in tags] for tags in eval_columns[label_column_name_tgt]]
+        if label_column_name_src in eval_columns:
+            refs_src = [[tag for tag in tags] for tags in eval_columns[label_column_name_src]]
+        else:
+            refs_src = [[]] * num_examples
+        return refs_src, refs_tgt
+
+    def get_metric_accumulators(self):
+        return {"tgt": WordTagAccumulator(), "src": WordTagAccumulator()}
+
+    def update_metric_accumulators(self, accumulators, predictions, labels, eval_columns=None):
+        """
+        Adds a batch of postprocessed predictions to the metric accumulators. The gold tags are read from the columns
+        of the batch `eval_columns` if given, or else from the evaluation dataset, which must then be the batch.
+        """
+        if eval_columns is None:
+            label_column_names = [self.data_args.label_column_name_src, self.data_args.label_column_name_tgt]
+            eval_columns = self._get_columns(self.evaluation_dataset_for_metrics, label_column_names)
+        refs_src, refs_tgt = self._get_references(eval_columns, len(predictions["predictions_src"]))
+        accumulators["tgt"].update(refs_tgt, predictions["predictions_tgt"])
+        if any(len(ref) > 0 for ref in refs_src):
+            accumulators["src"].update(refs_src, predictions["predictions_src"])
+
+    def compute_global_metrics(self, predictions, labels):
+        """All the word-level metrics are accumulated."""
+        return {}
+
     def _get_true_predictions_for_source_and_target(self, tokenized_eval_dataset, raw_predictions, raw_labels):
         # Remove ignored index (special tokens)
         if raw_labels is not None:
@@ -225,10 +361,31 @@ class TransformerDeepQuestModelWord(DeepQuestModelWord):
 
         return preds_src, preds_tgt
 
-    def postprocess_predictions(self, predictions, labels):
+    def postprocess_predictions(self, predictions, labels, eval_columns=None):
+        """
+        Splits the predicted tags into source and target tags. The word ids and lengths of the examples are read from
+        `eval_columns` if given, or else from the evaluation dataset set with `set_evaluation_dataset_for_metrics`.
+        """
         predictions = np.argmax(predictions, axis=2)
-        preds_src, preds_tgt = self._get_true_predictions_for_source_and_target(
-            self.evaluation_dataset_for_metrics, predictions, labels
-        )
+        if eval_columns is None:
+            eval_columns = self._get_columns(
+                self.evaluation_dataset_for_metrics, ["ids_words", "length_source", "length_target", "alignments"]
+            )
+        preds_src, preds_tgt = self._get_true_predictions_for_source_and_target(eval_columns, predictions, labels)
+        if self.data_args.project_source_tags:
+            preds_src = self._project_source_predictions(eval_columns, preds_tgt)
         return {"predictions_src": preds_src, "predictions_tgt": preds_tgt}
 
+    def _project_source_predictions(self, eval_columns, preds_tgt):
+        if "alignments" not in eval_columns:
+            raise ValueError("--project_source_tags needs a dataset with an `alignments` column")
+        if self.data_args.labels_in_gaps:
+            preds_tgt = [preds[1::2] for preds in preds_tgt]
+        return project_bad_tags(
+            preds_tgt,
+            eval_columns["alignments"],
+            eval_columns["length_source"],
+            bad_label=self.label_to_id[self.label_list.index("BAD")],
+            ok_label=self.label_to_id[self.label_list.index("OK")],
+        )
+
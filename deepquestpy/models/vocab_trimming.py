@@ -0,0 +1,95 @@
+import json
+import os
+
+import numpy as np
+import torch.nn as nn
+
+
+def collect_token_ids(tokenizer, texts, batch_size=1000):
+    """Returns the sorted ids of the tokens used to tokenize the texts, plus those of the special tokens."""
+    used = np.zeros(len(tokenizer), dtype=bool)
+    used[tokenizer.all_special_ids] = True
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == batch_size:
+            _mark_token_ids(tokenizer, batch, used)
+            batch = []
+    if batch:
+        _mark_token_ids(tokenizer, batch, used)
+    return np.flatnonzero(used)
+
+
+def _mark_token_ids(tokenizer, texts, used):
+    for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]:
+        used[ids] = True
+
+
+def _remap_post_processor(post_processor, id_map):
+    """Remaps the ids of the special tokens added by the post-processor of a fast tokenizer."""
+    if post_processor is None:
+        return None
+    processor_type = post_processor["type"]
+    if processor_type == "Sequence":
+        post_processor["processors"] = [_remap_post_processor(p, id_map) for p in post_processor["processors"]]
+    elif processor_type in ["RobertaProcessing", "BertProcessing"]:
+        for name in ["sep", "cls"]:
+            token, token_id = post_processor[name]
+            post_processor[name] = [token, id_map[token_id]]
+    elif processor_type == "TemplateProcessing":
+        for special_token in post_processor["special_tokens"].values():
+            special_token["ids"] = [id_map[token_id] for token_id in special_token["ids"]]
+    elif processor_type != "ByteLevel":
+        raise ValueError(f"Cannot remap the special tokens of a {processor_type} post-processor")
+    return post_processor
+
+
+def trim_tokenizer_state(tokenizer_state, kept_ids):
+    """
+    Returns the state (`tokenizer.json`) of a fast SentencePiece Unigram tokenizer, such as the one of XLM-R, that
+    only keeps the pieces in `kept_ids`, in the same order. The texts whose pieces are all kept are segmented in the
+    same way, as the best segmentation only uses kept pieces; the ids are those of the trimmed vocabulary.
+    """
+    model = tokenizer_state["model"]
+    if model["type"] != "Unigram":
+        raise ValueError(f"Only Unigram (SentencePiece) tokenizers can be trimmed, not {model['type']}")
+    id_map = {int(old_id): new_id for new_id, old_id in enumerate(kept_ids)}
+    model["vocab"] = [model["vocab"][old_id] for old_id in kept_ids if old_id < len(model["vocab"])]
+    if model.get("unk_id") is not None:
+        model["unk_id"] = id_map[model["unk_id"]]
+    for added_token in tokenizer_state.get("added_tokens") or []:
+        added_token["id"] = id_map[added_token["id"]]
+    tokenizer_state["post_processor"] = _remap_post_processor(tokenizer_state.get("post_processor"), id_map)
+    return tokenizer_state
+
+
+def trim_embeddings(model, kept_ids):
+    """Keeps the rows of `kept_ids` in the input embeddings of a model, in place."""
+    if model.get_output_embeddings() is not None:
+        raise ValueError("Models whose output layer is tied to the embeddings are not supported")
+    embeddings = model.get_input_embeddings()
+    id_map = {int(old_id): new_id for new_id, old_id in enumerate(kept_ids)}
+    padding_idx = id_map[embeddings.padding_idx] if embeddings.padding_idx is not None else None
+    trimmed = nn.Embedding(len(kept_ids), embeddings.embedding_dim, padding_idx=padding_idx)
+    trimmed.weight.data = embeddings.weight.data[kept_ids].clone()
+    model.set_input_embeddings(trimmed)
+    model.config.vocab_size = len(kept_ids)
+    for name in ["pad_token_id", "bos_token_id", "eos_token_id"]:
+        if getattr(model.config, name, None) is not None:
+            setattr(model.config, name, id_map[getattr(model.config, name)])
+    return model
+
+
+def save_trimmed_tokenizer(tokenizer, kept_ids, output_dir):
+    """Saves a fast tokenizer with only the pieces in `kept_ids`, without the files of its slow version."""
+    if not tokenizer.is_fast:
+        raise ValueError("Only fast tokenizers can be trimmed")
+    tokenizer.save_pretrained(output_dir)
+    # the SentencePiece model of the slow tokenizer would not match the trimmed vocabulary
+    for name, file_name in tokenizer.vocab_files_names.items():
+        path = os.path.join(output_dir, file_name)
+        if name != "tokenizer_file" and os.path.exists(path):
+            os.remove(path)
+    tokenizer_state = trim_tokenizer_state(json.loads(tokenizer.backend_tokenizer.to_str()), kept_ids)
+    with open(os.path.join(output_dir, "tokenizer.json"), "w", encoding="utf-8") as f:
+        json.dump(tokenizer_state, f, ensure_ascii=False)
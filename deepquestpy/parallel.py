@@ -0,0 +1,267 @@
+import functools
+import gc
+import inspect
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import torch
+from transformers import DataCollatorWithPadding
+from transformers.trainer_pt_utils import nested_concat
+
+from deepquestpy.metrics.accumulators import merge_accumulators
+
+logger = logging.getLogger(__name__)
+
+# function run by the worker processes, set by the parent right before forking them
+_shard_function = None
+
+
+def get_shards(num_examples, num_workers):
+    """Splits `range(num_examples)` into at most `num_workers` contiguous (start, end) shards of similar size."""
+    bounds = np.linspace(0, num_examples, num_workers + 1).astype(int)
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def get_threads_per_worker(num_workers, threads_per_worker=None):
+    if threads_per_worker is not None:
+        return threads_per_worker
+    return max(1, (os.cpu_count() or 1) // num_workers)
+
+
+def _init_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+
+def _run_shard(shard):
+    return _shard_function(*shard)
+
+
+def run_sharded(shard_function, num_examples, num_workers, threads_per_worker=None):
+    """
+    Runs `shard_function(start, end)` over contiguous shards of the examples in forked worker processes, and returns
+    the results in the original order. The workers are forked after the model has been loaded, so its weights are
+    shared copy-on-write instead of being copied into every process. The parent must not run the model itself
+    before forking, as the OpenMP thread pool of PyTorch does not survive a fork.
+    """
+    global _shard_function
+    shards = get_shards(num_examples, num_workers)
+    num_threads = get_threads_per_worker(num_workers, threads_per_worker)
+    _shard_function = shard_function
+    try:
+        context = multiprocessing.get_context("fork")
+        with context.Pool(len(shards), initializer=_init_worker, initargs=(num_threads,)) as pool:
+            return pool.map(_run_shard, shards, chunksize=1)
+    finally:
+        _shard_function = None
+
+
+def benchmark_workers(shard_function, num_examples, max_workers, threads_per_worker=None):
+    """Measures the throughput of `run_sharded` with 1, 2, 4, ... and `max_workers` workers."""
+    worker_counts = {1, max_workers}
+    worker_counts.update(2 ** i for i in range(max_workers.bit_length()) if 2 ** i < max_workers)
+    results = []
+    for num_workers in sorted(worker_counts):
+        start = time.perf_counter()
+        run_sharded(shard_function, num_examples, num_workers, threads_per_worker)
+        elapsed = time.perf_counter() - start
+        results.append(
+            {
+                "workers": num_workers,
+                "threads_per_worker": get_threads_per_worker(num_workers, threads_per_worker),
+                "seconds": elapsed,
+                "examples_per_second": num_examples / elapsed,
+                "speedup": results[0]["seconds"] / elapsed if results else 1.0,
+            }
+        )
+    return results
+
+
+def format_scaling_table(results):
+    lines = [f"{'workers':>7}  {'threads':>7}  {'seconds':>9}  {'examples/s':>10}  {'speedup':>7}"]
+    for result in results:
+        lines.append(
+            f"{result['workers']:>7}  {result['threads_per_worker']:>7}  {result['seconds']:>9.2f}  "
+            f"{result['examples_per_second']:>10.1f}  {result['speedup']:>6.2f}x"
+        )
+    return "\n".join(lines)
+
+
+def is_out_of_memory_error(error):
+    """Whether an exception is a failed allocation, on CPU or GPU."""
+    if isinstance(error, MemoryError):
+        return True
+    message = str(error)
+    return isinstance(error, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+
+def predict_with_backoff(predict_batch, start, end, batch_size, on_backoff=None):
+    """
+    Yields `predict_batch(batch_start, batch_end)` for the batches of the examples `[start, end)`. When a batch does
+    not fit in memory, the batch size is halved and the batch retried, and the smaller size is kept for the remaining
+    batches (and passed to `on_backoff`), so that long jobs survive a few unusually long examples.
+    """
+    batch_start = start
+    while batch_start < end:
+        batch_end = min(batch_start + batch_size, end)
+        try:
+            output = predict_batch(batch_start, batch_end)
+        except (MemoryError, RuntimeError) as e:
+            if not is_out_of_memory_error(e) or batch_size == 1:
+                raise
+            batch_size = max(1, batch_size // 2)
+            logger.warning(f"Out of memory on examples [{batch_start}, {batch_end}), retrying by {batch_size}")
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            if on_backoff is not None:
+                on_backoff(batch_size)
+            continue
+        yield output
+        batch_start = batch_end
+
+
+def _num_examples(inputs):
+    """Size of the first dimension of the first tensor of (possibly nested, as in AllenNLP) model inputs."""
+    for value in inputs.values():
+        if isinstance(value, dict):
+            num_examples = _num_examples(value)
+            if num_examples is not None:
+                return num_examples
+        elif torch.is_tensor(value) and value.dim() > 0:
+            return value.size(0)
+    return None
+
+
+def _slice_inputs(value, start, end):
+    if isinstance(value, dict):
+        return {name: _slice_inputs(item, start, end) for name, item in value.items()}
+    if (torch.is_tensor(value) and value.dim() > 0) or isinstance(value, list):
+        return value[start:end]
+    return value
+
+
+def _merge_outputs(outputs, sizes):
+    """Concatenates the outputs of consecutive sub-batches; scalars such as the loss are averaged by example."""
+    first = outputs[0]
+    if first is None:
+        return None
+    if isinstance(first, dict):
+        return type(first)(**{name: _merge_outputs([output[name] for output in outputs], sizes) for name in first})
+    if isinstance(first, tuple):
+        return tuple(_merge_outputs([output[i] for output in outputs], sizes) for i in range(len(first)))
+    if isinstance(first, list):
+        return [item for output in outputs for item in output]
+    if torch.is_tensor(first):
+        if first.dim() == 0:
+            return sum(output * size for output, size in zip(outputs, sizes)) / sum(sizes)
+        return torch.cat(outputs)
+    return first
+
+
+def add_out_of_memory_backoff(model):
+    """
+    Makes the `forward` of a model in evaluation mode split a batch that does not fit in memory into smaller ones
+    with `predict_with_backoff` and merge their outputs, so that `Trainer.predict` or the AllenNLP `evaluate`
+    survive a few unusually long batches of a long job. The smaller batch size is kept for the following batches.
+    """
+    forward = model.forward
+    max_batch_size = None
+
+    def set_max_batch_size(batch_size):
+        nonlocal max_batch_size
+        max_batch_size = batch_size
+
+    @functools.wraps(forward)
+    def forward_with_backoff(*args, **inputs):
+        num_examples = _num_examples(inputs)
+        if args or model.training or num_examples is None:
+            return forward(*args, **inputs)
+        sizes = []
+
+        def predict_batch(batch_start, batch_end):
+            output = forward(**_slice_inputs(inputs, batch_start, batch_end))
+            sizes.append(batch_end - batch_start)
+            return output
+
+        batch_size = min(num_examples, max_batch_size or num_examples)
+        outputs = list(predict_with_backoff(predict_batch, 0, num_examples, batch_size, set_max_batch_size))
+        return outputs[0] if len(outputs) == 1 else _merge_outputs(outputs, sizes)
+
+    model.forward = forward_with_backoff
+    return model
+
+
+def make_transformer_shard_function(
+    model, tokenizer, dataset, data_collator=None, batch_size=32, deepquest_model=None
+):
+    """
+    Returns a function that predicts the examples `[start, end)` of a tokenized dataset and returns their logits and
+    labels (if any), padded with -100 like in `Trainer.predict`. With a `deepquest_model`, it also returns the states
+    of the metric accumulators of the model, updated batch by batch (None without labels), so that the metrics of the
+    shards are merged with `merge_metric_states`.
+    """
+    model = model.to("cpu")
+    model.eval()
+    data_collator = data_collator if data_collator is not None else DataCollatorWithPadding(tokenizer)
+    # the inputs of the model, e.g. both sides of the models that encode the source and the translation separately
+    forward_parameters = inspect.signature(model.forward).parameters
+    column_names = [name for name in dataset.column_names if name in forward_parameters]
+
+    def predict_batch(batch_start, batch_end):
+        batch = dataset[batch_start:batch_end]
+        features = [{name: batch[name][i] for name in column_names} for i in range(len(batch[column_names[0]]))]
+        inputs = data_collator(features)
+        labels = inputs.pop("labels", None)
+        logits = model(**inputs)["logits"].numpy()
+        return batch, logits, labels.numpy() if labels is not None else None
+
+    def update_metrics(accumulators, batch, logits, labels):
+        # the columns of the batch carry what the word-level models need besides the logits (word ids, gold tags)
+        predictions = deepquest_model.postprocess_predictions(logits, labels, batch)
+        deepquest_model.update_metric_accumulators(accumulators, predictions, labels, eval_columns=batch)
+
+    def predict_shard(start, end):
+        all_logits, all_labels = None, None
+        accumulators = deepquest_model.get_metric_accumulators() if deepquest_model is not None else None
+        with torch.no_grad():
+            for batch, logits, labels in predict_with_backoff(predict_batch, start, end, batch_size):
+                all_logits = logits if all_logits is None else nested_concat(all_logits, logits, padding_index=-100)
+                if labels is not None:
+                    all_labels = (
+                        labels if all_labels is None else nested_concat(all_labels, labels, padding_index=-100)
+                    )
+                    if accumulators is not None:
+                        update_metrics(accumulators, batch, logits, labels)
+        if deepquest_model is None:
+            return all_logits, all_labels
+        metric_states = None
+        if all_labels is not None:
+            metric_states = {prefix: accumulator.get_state() for prefix, accumulator in accumulators.items()}
+        return all_logits, all_labels, metric_states
+
+    return predict_shard
+
+
+def merge_shards(results):
+    """Concatenates the (logits, labels) of the shards, padding them to the same length."""
+    predictions, labels = results[0][:2]
+    for shard_predictions, shard_labels in (result[:2] for result in results[1:]):
+        predictions = nested_concat(predictions, shard_predictions, padding_index=-100)
+        if labels is not None:
+            labels = nested_concat(labels, shard_labels, padding_index=-100)
+    return predictions, labels
+
+
+def merge_metric_states(deepquest_model, shard_states):
+    """Loads the metric accumulator states returned by the shards into accumulators and merges them."""
+    shard_accumulators = []
+    for states in shard_states:
+        accumulators = deepquest_model.get_metric_accumulators()
+        shard_accumulators.append({prefix: accumulators[prefix].load_state(state) for prefix, state in states.items()})
+    return {
+        prefix: merge_accumulators([accumulators[prefix] for accumulators in shard_accumulators])
+        for prefix in shard_accumulators[0]
+    }
@@ -0,0 +1,96 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from allennlp.data import Batch, Instance
+from allennlp.data.fields import TextField
+from allennlp.nn.util import move_to_device
+
+
+def read_moses_nbest(path):
+    """
+    Reads an n-best list in the Moses format (`id ||| hypothesis ||| features ||| score`) and returns the candidates
+    of each sentence id, in the order of the file.
+    """
+    nbest = OrderedDict()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = [field.strip() for field in line.split("|||")]
+            if len(fields) < 2:
+                raise ValueError(f"Invalid n-best line: {line!r}")
+            nbest.setdefault(int(fields[0]), []).append(fields[1])
+    return nbest
+
+
+class NBestReranker:
+    """Scores and ranks candidate translations of a source sentence with a sentence-level `BiRNN` model."""
+
+    def __init__(self, model, reader, batch_size=64):
+        self.model = model
+        self.model.eval()
+        self.reader = reader
+        self.batch_size = batch_size
+        self.device = next(model.parameters()).device
+
+    def _to_tensors(self, texts, field_name, token_indexers):
+        instances = []
+        for text in texts:
+            tokens = self.reader._tokenizer.add_special_tokens(self.reader._tokenizer.tokenize(text.strip()))
+            instances.append(Instance({field_name: TextField(tokens, token_indexers=token_indexers)}))
+        batch = Batch(instances)
+        batch.index_instances(self.model.vocab)
+        return move_to_device(batch.as_tensor_dict()[field_name], self.device)
+
+    def score(self, source, candidates):
+        """Returns the score of each candidate. The source is encoded once for all the candidates."""
+        scores = []
+        with torch.no_grad():
+            tokens_src = self._to_tensors([source], "tokens_src", self.reader._token_indexers_src)
+            encoded_src = self.model.encode_source(tokens_src)
+            for start in range(0, len(candidates), self.batch_size):
+                tokens_tgt = self._to_tensors(
+                    candidates[start : start + self.batch_size], "tokens_tgt", self.reader._token_indexers_tgt
+                )
+                batch_scores = self.model.score_nbest(tokens_src, tokens_tgt, encoded_text_src=encoded_src)
+                scores.append(batch_scores.cpu().numpy())
+        return np.concatenate(scores) if scores else np.zeros(0)
+
+    def score_pairs(self, sources, targets):
+        """Scores each (source, target) pair independently, as in `forward`."""
+        scores = []
+        with torch.no_grad():
+            for start in range(0, len(targets), self.batch_size):
+                batch_sources = sources[start : start + self.batch_size]
+                batch_targets = targets[start : start + self.batch_size]
+                tokens_src = self._to_tensors(batch_sources, "tokens_src", self.reader._token_indexers_src)
+                tokens_tgt = self._to_tensors(batch_targets, "tokens_tgt", self.reader._token_indexers_tgt)
+                scores.append(self.model(tokens_src, tokens_tgt)["scores"].view(-1).cpu().numpy())
+        return np.concatenate(scores) if scores else np.zeros(0)
+
+    def score_pairwise(self, source, candidates):
+        """Scores the candidates without sharing the encoding of the source. Used as the benchmark baseline."""
+        return self.score_pairs([source] * len(candidates), candidates)
+
+    def rerank(self, source, candidates, higher_is_better=True):
+        """
+        Returns the `(candidate, score)` pairs sorted from the best to the worst predicted score. Set
+        `higher_is_better=False` for models that predict error rates such as HTER.
+        """
+        scores = self.score(source, candidates)
+        order = np.argsort(-scores if higher_is_better else scores, kind="stable")
+        return [(candidates[i], float(scores[i])) for i in order]
+
+
+def benchmark_reranking(reranker, sources, nbest_lists):
+    """Compares the throughput (candidates per second) of n-best scoring with that of pairwise scoring."""
+    num_candidates = sum(len(candidates) for candidates in nbest_lists)
+    results = {}
+    for name, score_function in [("pairwise", reranker.score_pairwise), ("nbest", reranker.score)]:
+        start = time.perf_counter()
+        for source, candidates in zip(sources, nbest_lists):
+            score_function(source, candidates)
+        elapsed = time.perf_counter() - start
+        results[name] = {"seconds": elapsed, "candidates_per_second": num_candidates / elapsed}
+    results["speedup"] = results["pairwise"]["seconds"] / results["nbest"]["seconds"]
+    return results
@@ -1,16 +1,83 @@
 import argparse
 import os
 import json
+import torch
 from allennlp.common.util import import_module_and_submodules
 import_module_and_submodules('deepquestpy')
 
 from allennlp.commands.train import train_model_from_file
 from allennlp.training.util import evaluate
-from allennlp.models.archival import load_archive
 from allennlp.data.data_loaders import SimpleDataLoader
 from utils import disk_footprint
+from deepquestpy.autotune import apply_inference_profile
+from deepquestpy.models.mmap_weights import load_model_archive
+from deepquestpy.parallel import add_out_of_memory_backoff, benchmark_workers, format_scaling_table, predict_with_backoff, run_sharded
+from deepquestpy.rerank import NBestReranker, benchmark_reranking, read_moses_nbest
+
+def make_birnn_shard_function(model, instances, batch_size):
+    """Returns a function that predicts the sentence scores of the instances [start, end) on CPU."""
+    model = model.to("cpu")
+    model.eval()
+
+    def predict_batch(batch_start, batch_end):
+        loader = SimpleDataLoader(instances[batch_start:batch_end], batch_size=batch_end - batch_start)
+        loader.index_with(model.vocab)
+        return model(**next(iter(loader)))["scores"].view(-1).tolist()
+
+    def predict_shard(start, end):
+        scores = []
+        with torch.no_grad():
+            for batch_scores in predict_with_backoff(predict_batch, start, end, batch_size):
+                scores.extend(batch_scores)
+        return scores
+
+    return predict_shard
+
+def predict_in_parallel(model, instances, batch_size, args):
+    predict_shard = make_birnn_shard_function(model, instances, batch_size)
+    if args.benchmark_workers:
+        scaling = benchmark_workers(predict_shard, len(instances), args.num_workers, args.threads_per_worker)
+        print("Prediction throughput by number of workers:")
+        print(format_scaling_table(scaling))
+    results = run_sharded(predict_shard, len(instances), args.num_workers, args.threads_per_worker)
+    flat_list = [score for shard_scores in results for score in shard_scores]
+    metrics = {}
+    labels = [instance["labels"].tensor.item() for instance in instances if "labels" in instance.fields]
+    if len(labels) == len(flat_list):
+        # the metrics of the model, as reported by `evaluate` in a single process
+        metrics = model.compute_metrics(torch.tensor(flat_list), torch.tensor(labels))
+    return flat_list, metrics
+
+def rerank(args):
+    archive = load_model_archive(args.eval_model)
+    reranker = NBestReranker(archive.model, archive.dataset_reader, batch_size=args.rerank_batch_size)
+    with open(args.source_file, encoding="utf-8") as source_file:
+        sources = [line.rstrip("\n") for line in source_file]
+    nbest = read_moses_nbest(args.nbest_file)
+
+    if args.benchmark_rerank:
+        ids = list(nbest)
+        results = benchmark_reranking(reranker, [sources[i] for i in ids], [nbest[i] for i in ids])
+        print(json.dumps(results, indent=2))
+
+    with open(args.rerank_output_file, "w", encoding="utf-8") as output_file:
+        for sentence_id, candidates in nbest.items():
+            ranked = reranker.rerank(sources[sentence_id], candidates, higher_is_better=not args.lower_is_better)
+            for candidate, score in ranked:
+                output_file.write(f"{sentence_id} ||| {candidate} ||| {score:.6f}\n")
+    print("Reranked n-best lists are written to :", args.rerank_output_file)
 
 def main(args):
+    profile_batch_size = None
+    if args.inference_profile and (args.do_eval or args.do_predict):
+        profile_batch_size = apply_inference_profile(args.inference_profile, args)
+    if args.num_workers < 1:
+        raise ValueError("--num_workers must be at least 1")
+    if args.num_workers > 1 and (args.do_train or args.do_rerank):
+        # the workers are forked, and the OpenMP thread pool of PyTorch does not survive a fork once the model has run
+        raise ValueError("--num_workers > 1 cannot be combined with --do_train or --do_rerank, predict in a separate run")
+    if args.do_rerank:
+        rerank(args)
     # Training
     if args.do_train:
         train_model_from_file(parameter_filename=args.config_file,
@@ -18,17 +85,24 @@ def main(args):
                               force=args.overwrite_output_dir)
     # Evaluation
     if args.do_eval or args.do_predict:
-        archive = load_archive(args.eval_model)
+        archive = load_model_archive(args.eval_model)
         model = archive.model
         num_model_parameters = sum(parameter.numel() for parameter in model.parameters() if parameter.requires_grad)
         reader = archive.validation_dataset_reader if "validation_dataset_reader" in archive else archive.dataset_reader
+        if args.num_workers > 1 and not getattr(reader, "sentence_level", True):
+            # the workers only return the sentence scores
+            raise ValueError("--num_workers > 1 only supports sentence-level models")
         if args.do_predict:
             reader.do_predict = True
         eval_instances = list(reader.read(args.eval_data_path))
-        batch_size = archive.config["data_loader"]["batch_sampler"]["batch_size"]
-        eval_loader = SimpleDataLoader(eval_instances, batch_size=batch_size)
-        eval_loader.index_with(model.vocab)
-        metrics = evaluate(model,eval_loader, predictions_output_file=args.pred_output_file)
+        batch_size = profile_batch_size or archive.config["data_loader"]["batch_sampler"]["batch_size"]
+        if args.num_workers > 1:
+            flat_list, metrics = predict_in_parallel(model, eval_instances, batch_size, args)
+        else:
+            eval_loader = SimpleDataLoader(eval_instances, batch_size=batch_size)
+            eval_loader.index_with(model.vocab)
+            add_out_of_memory_backoff(model)
+            metrics = evaluate(model,eval_loader, predictions_output_file=args.pred_output_file)
         if (args.eval_output_file):
             with open(args.eval_output_file,mode="w", encoding="utf-8") as eval_results_fh:
                 print(metrics,file=eval_results_fh)
@@ -37,14 +111,15 @@ def main(args):
             print(metrics)
         
         if (args.pred_output_file):
-            list_of_score_dicts = []
-            
-            with open (args.pred_output_file, "r") as pred_file:
-                for line in pred_file:
-                    list_of_score_dicts.append(json.loads(line))
-            
-            predicted = [x["scores"] for x in list_of_score_dicts]
-            flat_list = [item for sublist in predicted for item in sublist]
+            if args.num_workers <= 1:
+                list_of_score_dicts = []
+
+                with open (args.pred_output_file, "r") as pred_file:
+                    for line in pred_file:
+                        list_of_score_dicts.append(json.loads(line))
+
+                predicted = [x["scores"] for x in list_of_score_dicts]
+                flat_list = [item for sublist in predicted for item in sublist]
         
             with open (args.pred_output_file, "w") as pred_file:
                 pred_file.write("{}\n".format(disk_footprint(args.eval_model)))
@@ -58,8 +133,10 @@ def main(args):
     return
 
 def cli_main(args):
-    if not args.do_train and not args.do_eval and not args.do_predict:
-        raise ValueError("Please specify one of: --do_train to train, --do_eval to evaluate or --do_predict to make predictions")
+    if not args.do_train and not args.do_eval and not args.do_predict and not args.do_rerank:
+        raise ValueError("Please specify one of: --do_train to train, --do_eval to evaluate, --do_predict to make predictions or --do_rerank to rerank n-best lists")
+    if args.do_rerank and (not args.nbest_file or not args.source_file):
+        raise ValueError("--do_rerank requires --nbest_file and --source_file")
 
     if ( os.path.exists(args.output_dir) and os.listdir(args.output_dir) and args.do_train and not args.overwrite_output_dir
     ):
@@ -81,7 +158,7 @@ if __name__ == "__main__":
     # evaluation arguments
     parser.add_argument("--do_eval", action="store_true")
     parser.add_argument("--lang_pair", type=str, default=None, help="language pair on which the model is trained and evaluated on.")
-    parser.add_argument("--eval_model", type=str,default="data/output/model/model.tar.gz", help="Model to evaluate.")
+    parser.add_argument("--eval_model", type=str,default="data/output/model/model.tar.gz", help="Model to evaluate: a model.tar.gz archive, or a directory exported by `deepquestpy export_mmap`.")
     parser.add_argument("--eval_output_file", type=str,default="data/output/eval_results.json", help="Output file to which evaluation results will be written.")
 
     parser.add_argument("--pred_output_file", type=str,default="data/output/predictions.txt", help="Output file to which test predictions are written")
@@ -90,6 +167,19 @@ if __name__ == "__main__":
 
     # prediction arguments
     parser.add_argument("--do_predict", action="store_true")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of worker processes that predict contiguous shards of the evaluation data on CPU (sentence-level models only).")
+    parser.add_argument("--threads_per_worker", type=int, default=None, help="Number of torch threads of each worker. Defaults to the number of cores / num_workers.")
+    parser.add_argument("--benchmark_workers", action="store_true", help="Report the prediction throughput with 1, 2, 4, ... and num_workers workers.")
+    parser.add_argument("--inference_profile", type=str, default=None, help="Profile written by `deepquestpy autotune`, which sets the batch size, num_workers and threads_per_worker.")
+
+    # reranking arguments
+    parser.add_argument("--do_rerank", action="store_true", help="Rerank the candidates of an n-best list with a sentence-level model.")
+    parser.add_argument("--nbest_file", type=str, default=None, help="N-best list in the Moses format (id ||| hypothesis ||| ...).")
+    parser.add_argument("--source_file", type=str, default=None, help="Source sentences, one per line, indexed by the ids of the n-best list.")
+    parser.add_argument("--rerank_output_file", type=str, default="data/output/reranked.nbest", help="Output file to which the reranked n-best lists are written.")
+    parser.add_argument("--lower_is_better", action="store_true", help="Rank the candidates by increasing score, for models that predict error rates such as HTER.")
+    parser.add_argument("--rerank_batch_size", type=int, default=64, help="Number of candidates scored at a time.")
+    parser.add_argument("--benchmark_rerank", action="store_true", help="Compare the throughput of n-best scoring with scoring each pair independently.")
 
     args = parser.parse_args()
     cli_main(args)
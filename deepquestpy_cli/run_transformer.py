@@ -1,27 +1,52 @@
 import logging
 import os
 import sys
+import time
 import transformers
 
-from datasets import load_dataset
-
 from transformers.trainer_utils import get_last_checkpoint, set_seed
 from transformers import HfArgumentParser, TrainingArguments, Trainer
 
-from deepquestpy.commands.cli_args import DataArguments, ModelArguments
-from deepquestpy.commands.utils import DATASETS_LOADERS_DIR, get_deepquest_model
+from deepquestpy.autotune import apply_inference_profile
+from deepquestpy.commands.cli_args import DataArguments, InferenceArguments, ModelArguments
+from deepquestpy.commands.utils import get_deepquest_model, get_label_list, load_raw_datasets, truncate_dataset
+from deepquestpy.metrics.accumulators import compute_accumulated_metrics
+from deepquestpy.models.adapters import save_adapter, setup_adapters
 from deepquestpy.models.base import DeepQuestModelWord
+from deepquestpy.models.distillation import DistillationDataCollator, DistillationTrainer, prepare_distillation_dataset
+from deepquestpy.models.feature_cache import (
+    CachedFeaturesDataCollator,
+    CachedFeaturesTrainer,
+    freeze_bottom_layers,
+    prepare_feature_cache,
+)
+from deepquestpy.parallel import (
+    add_out_of_memory_backoff,
+    benchmark_workers,
+    format_scaling_table,
+    make_transformer_shard_function,
+    merge_metric_states,
+    merge_shards,
+    run_sharded,
+)
 
 logger = logging.getLogger(__name__)
 
 
 def main():
     # Read the arguments
-    parser = HfArgumentParser((ModelArguments, DataArguments, TrainingArguments))
+    parser = HfArgumentParser((ModelArguments, DataArguments, TrainingArguments, InferenceArguments))
     if len(sys.argv) == 2 and sys.argv[1].endswith(".json"):
-        model_args, data_args, training_args = parser.parse_json_file(json_file=os.path.abspath(sys.argv[1]))
+        model_args, data_args, training_args, inference_args = parser.parse_json_file(
+            json_file=os.path.abspath(sys.argv[1])
+        )
     else:
-        model_args, data_args, training_args = parser.parse_args_into_dataclasses()
+        model_args, data_args, training_args, inference_args = parser.parse_args_into_dataclasses()
+
+    if inference_args.inference_profile is not None:
+        training_args.per_device_eval_batch_size = apply_inference_profile(
+            inference_args.inference_profile, inference_args
+        )
 
     # Setup logging
     logging.basicConfig(
@@ -46,55 +71,31 @@ def main():
     # Set seed before initializing model
     set_seed(training_args.seed)
 
-    # Load the dataset splits
-    if data_args.dataset_name in ["mlqe_pe"]:
-        raw_datasets = load_dataset(
-            f"{DATASETS_LOADERS_DIR}/{data_args.dataset_name}", name=f"{data_args.src_lang}-{data_args.tgt_lang}",
-        )
-    elif data_args.dataset_name in ["wmt20_mlqe_synth"]:
-        raw_datasets = load_dataset(
-            f"{DATASETS_LOADERS_DIR}/{data_args.dataset_name}",
-            name=f"{data_args.src_lang}-{data_args.tgt_lang}",
-            data_dir=data_args.data_dir,
-        )
-    elif data_args.dataset_name in ["mqm_google"]:
-        data_files = {}
-        if data_args.train_file is not None:
-            data_files["train"] = data_args.train_file
-        if data_args.validation_file is not None:
-            data_files["validation"] = data_args.validation_file
-        if data_args.test_file is not None:
-            data_files["test"] = data_args.test_file
-        raw_datasets = load_dataset(
-            f"{DATASETS_LOADERS_DIR}/{data_args.dataset_name}",
-            name=f"{data_args.src_lang}-{data_args.tgt_lang}",
-            data_files=data_files,
-            download_mode="force_redownload",
-        )
-    elif data_args.dataset_name is not None:
-        raw_datasets = load_dataset(data_args.dataset_name, name=f"{data_args.src_lang}-{data_args.tgt_lang}")
-    else:
-        data_files = {}
-        if data_args.train_file is not None:
-            data_files["train"] = data_args.train_file
-        if data_args.validation_file is not None:
-            data_files["validation"] = data_args.validation_file
-        if data_args.test_file is not None:
-            data_files["test"] = data_args.test_file
-        raw_datasets = load_dataset(
-            f"{DATASETS_LOADERS_DIR}/custom.py", data_files=data_files, download_mode="force_redownload"
+    if data_args.streaming and training_args.do_train and training_args.max_steps <= 0:
+        raise ValueError("Training on a streamed dataset requires setting --max_steps")
+    distill = training_args.do_train and model_args.teacher_model_name_or_path is not None
+    if distill and data_args.streaming:
+        raise ValueError("Distillation requires a prepared dataset, so it cannot be used with --streaming")
+    use_feature_cache = training_args.do_train and model_args.frozen_layers > 0 and model_args.feature_cache_dir
+    if use_feature_cache and (distill or data_args.streaming or model_args.train_adapter):
+        raise ValueError("The feature cache cannot be used with distillation, --streaming or --train_adapter")
+    if inference_args.num_workers > 1 and data_args.streaming:
+        raise ValueError("Parallel prediction splits the test set in shards, so it cannot be used with --streaming")
+    if inference_args.num_workers > 1 and (training_args.do_train or training_args.do_eval):
+        # the workers are forked, and the OpenMP thread pool of PyTorch does not survive a fork once the model has run
+        raise ValueError(
+            "Parallel prediction cannot be combined with --do_train or --do_eval, as the workers are forked after the "
+            "model has run; predict in a separate run"
         )
 
+    # Load the dataset splits
+    raw_datasets = load_raw_datasets(data_args)
+
     # Create an instance of a DeepQuestModel
     deepquest_model = get_deepquest_model(model_args.arch_name, model_args, data_args, training_args)
 
     if isinstance(deepquest_model, DeepQuestModelWord):
-        for split in ["train", "validation", "test"]:
-            if split in raw_datasets:
-                features = raw_datasets[split].features
-                break
-        label_list = features[data_args.label_column_name_tgt].feature.names
-        deepquest_model.set_label_list(label_list)
+        deepquest_model.set_label_list(get_label_list(raw_datasets, data_args.label_column_name_tgt))
 
     # Preprocess the datasets
     if training_args.do_train:
@@ -102,31 +103,65 @@ def main():
             raise ValueError("--do_train requires a train dataset")
         train_dataset = raw_datasets["train"]
         if data_args.max_train_samples is not None:
-            train_dataset = train_dataset.select(range(data_args.max_train_samples))
+            train_dataset = truncate_dataset(train_dataset, data_args.max_train_samples)
             #  with training_args.main_process_first(desc="train dataset map pre-processing"):
-        train_dataset = deepquest_model.tokenize_datasets(raw_datasets["train"])
+        raw_train_dataset = train_dataset
+        train_dataset = deepquest_model.tokenize_datasets(train_dataset)
+        if distill:
+            train_dataset, teacher_store = prepare_distillation_dataset(
+                deepquest_model, raw_train_dataset, train_dataset, model_args, data_args, training_args
+            )
 
     if training_args.do_eval:
         if "validation" not in raw_datasets:
             raise ValueError("--do_eval requires a validation dataset")
         eval_dataset = raw_datasets["validation"]
         if data_args.max_eval_samples is not None:
-            eval_dataset = eval_dataset.select(range(data_args.max_eval_samples))
+            eval_dataset = truncate_dataset(eval_dataset, data_args.max_eval_samples)
             # with training_args.main_process_first(desc="validation dataset map pre-processing"):
-        eval_dataset = deepquest_model.tokenize_datasets(raw_datasets["validation"])
+        eval_dataset = deepquest_model.tokenize_datasets(eval_dataset)
 
     if training_args.do_predict:
         if "test" not in raw_datasets:
             raise ValueError("--do_predict requires a test dataset")
         predict_dataset = raw_datasets["test"]
         if data_args.max_predict_samples is not None:
-            predict_dataset = predict_dataset.select(range(data_args.max_predict_samples))
+            predict_dataset = truncate_dataset(predict_dataset, data_args.max_predict_samples)
             # with training_args.main_process_first(desc="prediction dataset map pre-processing"):
-        predict_dataset = deepquest_model.tokenize_datasets(raw_datasets["test"])
+        predict_dataset = deepquest_model.tokenize_datasets(predict_dataset)
+
+    # Load the model, with the adapters of the language pair if requested
+    model = deepquest_model.get_model()
+    adapter_name = model_args.adapter_name if model_args.adapter_name else f"{data_args.src_lang}-{data_args.tgt_lang}"
+    if model_args.train_adapter or model_args.adapter_paths:
+        model = setup_adapters(model, model_args, adapter_name)
+    if model_args.frozen_layers > 0:
+        freeze_bottom_layers(model, model_args.frozen_layers)
+    if use_feature_cache:
+        # the frozen layers are run once, and only the top layers are trained on their cached hidden states
+        feature_stores = []
+        cached_datasets = [("train", train_dataset)]
+        if training_args.do_eval:
+            cached_datasets.append(("validation", eval_dataset))
+        for description, dataset in cached_datasets:
+            dataset, store = prepare_feature_cache(
+                model,
+                deepquest_model.get_tokenizer(),
+                dataset,
+                description,
+                model_args,
+                training_args,
+                index_offset=sum(len(s) for s in feature_stores),
+            )
+            feature_stores.append(store)
+            if description == "train":
+                train_dataset = dataset
+            else:
+                eval_dataset = dataset
 
     # Initialize Trainer
-    trainer = Trainer(
-        model=deepquest_model.get_model(),
+    trainer_kwargs = dict(
+        model=model,
         args=training_args,
         train_dataset=train_dataset if training_args.do_train else None,
         eval_dataset=eval_dataset if training_args.do_eval else None,
@@ -134,6 +169,25 @@ def main():
         data_collator=deepquest_model.get_data_collator(),
         compute_metrics=deepquest_model.compute_metrics,
     )
+    if distill:
+        trainer_kwargs["data_collator"] = DistillationDataCollator(
+            trainer_kwargs["data_collator"],
+            deepquest_model.get_tokenizer(),
+            word_level=isinstance(deepquest_model, DeepQuestModelWord),
+        )
+        trainer = DistillationTrainer(
+            teacher_store=teacher_store,
+            alpha=model_args.distillation_alpha,
+            temperature=model_args.distillation_temperature,
+            **trainer_kwargs,
+        )
+    elif use_feature_cache:
+        trainer_kwargs["data_collator"] = CachedFeaturesDataCollator(
+            trainer_kwargs["data_collator"], deepquest_model.get_tokenizer(), feature_stores
+        )
+        trainer = CachedFeaturesTrainer(frozen_layers=model_args.frozen_layers, **trainer_kwargs)
+    else:
+        trainer = Trainer(**trainer_kwargs)
 
     # Train the model
     if training_args.do_train:
@@ -159,7 +213,11 @@ def main():
 
         train_result = trainer.train(resume_from_checkpoint=checkpoint)
         metrics = train_result.metrics
-        trainer.save_model()
+        if model_args.train_adapter:
+            adapter_dir = os.path.join(training_args.output_dir, f"adapter-{adapter_name}")
+            save_adapter(trainer.model, adapter_name, adapter_dir)
+        else:
+            trainer.save_model()
 
         trainer.log_metrics("train", metrics)
         trainer.save_metrics("train", metrics)
@@ -178,9 +236,21 @@ def main():
     if training_args.do_predict:
         logger.info("*** Predict ***")
         deepquest_model.set_evaluation_dataset_for_metrics(predict_dataset)
-        predictions, labels, metrics = trainer.predict(predict_dataset, metric_key_prefix="predict")
+        if inference_args.num_workers > 1:
+            predictions, labels, metrics = predict_in_parallel(
+                trainer.model, deepquest_model, predict_dataset, inference_args, training_args
+            )
+        else:
+            if training_args.n_gpu <= 1:
+                # DataParallel replicas would not use the wrapped forward
+                add_out_of_memory_backoff(trainer.model)
+            predictions, labels, metrics = trainer.predict(predict_dataset, metric_key_prefix="predict")
 
         predictions = deepquest_model.postprocess_predictions(predictions, labels)
+        # early-exit models also report how deep the examples went into the encoder
+        for name in ["average_exit_layer", "layer_speedup"]:
+            if name in predictions:
+                metrics[f"predict_{name}"] = predictions[name]
 
         if trainer.is_world_process_zero():
             deepquest_model.save_output(
@@ -191,5 +261,40 @@ def main():
         trainer.save_metrics("predict", metrics)
 
 
+def predict_in_parallel(model, deepquest_model, predict_dataset, inference_args, training_args):
+    """Predicts contiguous shards of the test set in worker processes on CPU and merges them in order."""
+    predict_shard = make_transformer_shard_function(
+        model,
+        deepquest_model.get_tokenizer(),
+        predict_dataset,
+        data_collator=deepquest_model.get_data_collator(),
+        batch_size=training_args.per_device_eval_batch_size,
+        deepquest_model=deepquest_model,
+    )
+    if inference_args.benchmark_workers:
+        scaling = benchmark_workers(
+            predict_shard, len(predict_dataset), inference_args.num_workers, inference_args.threads_per_worker
+        )
+        logger.info(f"Prediction throughput by number of workers:\n{format_scaling_table(scaling)}")
+
+    start = time.perf_counter()
+    results = run_sharded(
+        predict_shard, len(predict_dataset), inference_args.num_workers, inference_args.threads_per_worker
+    )
+    runtime = time.perf_counter() - start
+    predictions, labels = merge_shards(results)
+
+    metrics = {}
+    if labels is not None:
+        # the metrics are merged from the accumulators of the workers, except those that need all the predictions
+        accumulators = merge_metric_states(deepquest_model, [metric_states for _, _, metric_states in results])
+        metrics = compute_accumulated_metrics(accumulators)
+        metrics.update(deepquest_model.compute_global_metrics(predictions, labels))
+        metrics = {f"predict_{name}": value for name, value in metrics.items()}
+    metrics["predict_runtime"] = round(runtime, 4)
+    metrics["predict_samples_per_second"] = round(len(predict_dataset) / runtime, 3)
+    return predictions, labels, metrics
+
+
 if __name__ == "__main__":
     main()
@@ -1,4 +1,5 @@
 import logging
+import os
 import sys
 
 import tarfile
@@ -14,6 +15,11 @@ METRICS_DIR = PACKAGE_DIR / "deepquestpy" / "metrics"
 
 
 def disk_footprint(model_file):
+    if os.path.isdir(model_file):
+        # a model exported with memory-mapped weights
+        return sum(
+            os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(model_file) for name in names
+        )
     total_bytes = 0
     model_tar = tarfile.open(model_file, "r:gz")
     for model_file in model_tar:
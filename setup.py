@@ -29,5 +29,10 @@ setup(
         "tokenizers",
         "datasets",
     ],
-    entry_points={"console_scripts": ["deepquestpy-run-model=deepquestpy_cli.run_model:main"]},
+    entry_points={
+        "console_scripts": [
+            "deepquestpy-run-model=deepquestpy_cli.run_model:main",
+            "deepquestpy=deepquestpy.commands.main:main",
+        ]
+    },
 )